@@ -1,20 +1,50 @@
-from flask import Flask, jsonify
+from flask import Blueprint, Flask, abort, jsonify, request
 from flask_cors import CORS  # Добавляем импорт
-from models import create_tables
-from handlers import AuthorHandlers, BookHandlers, UtilityHandlers
+from src.cache import create_cache, get_cache, set_cache
+from src.compression import compress_response
+from src.config import config
+from src.models import create_tables, database, pool_stats
+from src import metrics, profiling
+from src.serializers import FastJSONProvider
+from src.handlers import (AuthorHandlers, BatchHandlers, BookHandlers, ChangeHandlers, SearchHandlers,
+                          UtilityHandlers)
 
-# Создаем Flask приложение
-app = Flask(__name__)
+# Маршруты API; приложение с ними собирает create_app()
+api = Blueprint('api', __name__)
 
-# Включаем CORS для всех доменов (для разработки)
-CORS(app)
 
+def create_app():
+    """Создать Flask приложение со всеми маршрутами API.
+
+    Фабрика нужна запускающему коду (src/launcher.py): каждый рабочий
+    процесс создает свое приложение уже после fork.
+    """
+    app = Flask(__name__)
+
+    # Кэш чтения по настройке cache_backend (в каждом рабочем процессе - свое подключение)
+    set_cache(create_cache())
+
+    # Быстрый JSON (orjson, если установлен) для jsonify и потоковых ответов
+    app.json = FastJSONProvider(app)
+
+    # Включаем CORS для всех доменов (для разработки)
+    CORS(app)
+
+    # Альтернативно: более строгая настройка CORS
+    # CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
+
+    app.register_blueprint(api)
+
+    # Число и время SQL-запросов в заголовках ответа, журнал медленных запросов
+    profiling.init_app(app)
+
+    # Счетчики и гистограммы для Prometheus (GET /metrics)
+    metrics.init_app(app)
+    return app
 
-# Альтернативно: более строгая настройка CORS
-# CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
 
 # Или настройка CORS вручную через заголовки
-@app.after_request
+@api.after_app_request
 def after_request(response):
     """Добавляем CORS заголовки к каждому ответу"""
     response.headers.add('Access-Control-Allow-Origin', '*')
@@ -23,92 +53,157 @@ def after_request(response):
     return response
 
 
+# Сжатие ответов gzip/brotli (регистрируется после CORS, поэтому выполняется раньше него)
+@api.after_app_request
+def compress(response):
+    return compress_response(response, request.accept_encodings)
+
+
+# Каждый запрос берет соединение из пула и возвращает его по завершении
+@api.before_app_request
+def open_connection():
+    database.connect(reuse_if_open=True)
+
+
+@api.teardown_app_request
+def close_connection(exc):
+    if not database.is_closed():
+        database.close()
+
+
 # Обработка OPTIONS запросов для CORS
-@app.route('/api/authors', methods=['OPTIONS'])
-@app.route('/api/authors/<int:author_id>', methods=['OPTIONS'])
-@app.route('/api/books', methods=['OPTIONS'])
-@app.route('/api/books/<int:book_id>', methods=['OPTIONS'])
+@api.route('/api/authors', methods=['OPTIONS'])
+@api.route('/api/authors/<int:author_id>', methods=['OPTIONS'])
+@api.route('/api/authors/<int:author_id>/books', methods=['OPTIONS'])
+@api.route('/api/books', methods=['OPTIONS'])
+@api.route('/api/books/bulk', methods=['OPTIONS'])
+@api.route('/api/batch', methods=['OPTIONS'])
+@api.route('/api/books/<int:book_id>', methods=['OPTIONS'])
 def options_handler():
     """Обработчик для OPTIONS запросов (CORS preflight)"""
     return '', 200
 
 
 # ===== Роуты для Авторов =====
-@app.route('/api/authors', methods=['GET'])
+@api.route('/api/authors', methods=['GET'])
 def get_authors():
     return AuthorHandlers.get_authors()
 
 
-@app.route('/api/authors/<int:author_id>', methods=['GET'])
+@api.route('/api/authors/<int:author_id>', methods=['GET'])
 def get_author(author_id):
     return AuthorHandlers.get_author(author_id)
 
 
-@app.route('/api/authors', methods=['POST'])
+@api.route('/api/authors/<int:author_id>/books', methods=['GET'])
+def get_author_books(author_id):
+    return AuthorHandlers.get_author_books(author_id)
+
+
+@api.route('/api/authors', methods=['POST'])
 def create_author():
     return AuthorHandlers.create_author()
 
 
-@app.route('/api/authors/<int:author_id>', methods=['PUT'])
+@api.route('/api/authors/<int:author_id>', methods=['PUT'])
 def update_author(author_id):
     return AuthorHandlers.update_author(author_id)
 
 
-@app.route('/api/authors/<int:author_id>', methods=['DELETE'])
+@api.route('/api/authors/<int:author_id>', methods=['DELETE'])
 def delete_author(author_id):
     return AuthorHandlers.delete_author(author_id)
 
 
 # ===== Роуты для Книг =====
-@app.route('/api/books', methods=['GET'])
+@api.route('/api/books', methods=['GET'])
 def get_books():
     return BookHandlers.get_books()
 
 
-@app.route('/api/books/<int:book_id>', methods=['GET'])
+@api.route('/api/books/<int:book_id>', methods=['GET'])
 def get_book(book_id):
     return BookHandlers.get_book(book_id)
 
 
-@app.route('/api/books', methods=['POST'])
+@api.route('/api/books', methods=['POST'])
 def create_book():
     return BookHandlers.create_book()
 
 
-@app.route('/api/books/<int:book_id>', methods=['PUT'])
+@api.route('/api/books/bulk', methods=['POST'])
+def bulk_create_books():
+    return BookHandlers.bulk_create_books()
+
+
+@api.route('/api/books/<int:book_id>', methods=['PUT'])
 def update_book(book_id):
     return BookHandlers.update_book(book_id)
 
 
-@app.route('/api/books/<int:book_id>', methods=['DELETE'])
+@api.route('/api/books/<int:book_id>', methods=['DELETE'])
 def delete_book(book_id):
     return BookHandlers.delete_book(book_id)
 
 
+# ===== Пакетные запросы =====
+@api.route('/api/batch', methods=['POST'])
+def batch():
+    return BatchHandlers.batch()
+
+
+# ===== Журнал изменений =====
+@api.route('/api/changes', methods=['GET'])
+def get_changes():
+    return ChangeHandlers.get_changes()
+
+
 # ===== Вспомогательные роуты =====
-@app.route('/api/genres', methods=['GET'])
+@api.route('/api/genres', methods=['GET'])
 def get_genres():
     return UtilityHandlers.get_genres()
 
 
-@app.route('/api/tags', methods=['GET'])
+@api.route('/api/tags', methods=['GET'])
 def get_tags():
     return UtilityHandlers.get_tags()
 
 
+@api.route('/api/profiling', methods=['GET'])
+def get_profiling():
+    return UtilityHandlers.get_profiling()
+
+
+# ===== Поиск =====
+@api.route('/api/search', methods=['GET'])
+def search():
+    return SearchHandlers.search()
+
+
 # Роут для проверки работы сервера
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health_check():
     from datetime import datetime
     return jsonify({
         'status': 'OK',
         'message': 'Сервер работает нормально',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'pool': pool_stats(),
+        'cache': get_cache().stats()
     })
 
 
+# Метрики для Prometheus
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    # С выключенными метриками маршрута как будто нет: значения не собираются
+    if not config['metrics_enabled']:
+        abort(404)
+    return metrics.metrics_response()
+
+
 # Главная страница с документацией API
-@app.route('/')
+@api.route('/')
 def index():
     return '''
     <html>
@@ -124,28 +219,53 @@ def index():
             <p>Доступные endpoints:</p>
 
             <div class="endpoint">
-                <strong>GET /api/health</strong> - Проверка работы сервера
+                <strong>GET /api/health</strong> - Проверка работы сервера<br>
+                <strong>GET /metrics</strong> - Метрики в формате Prometheus
             </div>
 
             <div class="endpoint">
                 <strong>GET /api/authors</strong> - Список авторов<br>
+                <strong>GET /api/authors?limit=50&amp;cursor=...&amp;with_total=1</strong> - Постраничный список авторов<br>
+                <strong>GET /api/authors?sort=-book_count&amp;min_books=5</strong> - Авторы по числу книг<br>
                 <strong>POST /api/authors</strong> - Создать автора<br>
                 <strong>GET /api/authors/1</strong> - Получить автора<br>
+                <strong>GET /api/authors/1/books?limit=50&amp;cursor=...</strong> - Книги автора<br>
                 <strong>PUT /api/authors/1</strong> - Обновить автора<br>
                 <strong>DELETE /api/authors/1</strong> - Удалить автора
             </div>
 
             <div class="endpoint">
                 <strong>GET /api/books</strong> - Список книг<br>
+                <strong>GET /api/books?limit=50&amp;cursor=...&amp;with_total=1</strong> - Постраничный список книг<br>
+                <strong>GET /api/books?genre_id=1&amp;year_from=1850&amp;facets=genre,tag,year</strong> - Фильтры и фасеты списка книг<br>
+                <strong>GET /api/books?fields=id,title,authors.name&amp;include=authors</strong> - Только нужные поля и связи<br>
+                <strong>GET /api/books?stream=ndjson</strong> - Выгрузка всех книг потоком NDJSON (или ?stream=1 - потоковый JSON)<br>
                 <strong>POST /api/books</strong> - Создать книгу<br>
+                <strong>POST /api/books/bulk?upsert=1</strong> - Массово создать или обновить книги (JSON-массив или NDJSON)<br>
+                <strong>GET /api/books?ids=1,2,3</strong> - Несколько книг по id (так же /api/authors?ids=)<br>
                 <strong>GET /api/books/1</strong> - Получить книгу<br>
                 <strong>PUT /api/books/1</strong> - Обновить книгу<br>
                 <strong>DELETE /api/books/1</strong> - Удалить книгу
             </div>
 
+            <div class="endpoint">
+                <strong>POST /api/batch</strong> - Операции create/update/delete одной транзакцией и чтение книг и авторов по id
+            </div>
+
+            <div class="endpoint">
+                <strong>GET /api/changes?since=0&amp;limit=100</strong> - Изменения каталога после позиции since (upsert и delete)<br>
+                <strong>GET /api/changes?since=120&amp;wait=30</strong> - Long-poll: ждать новых изменений до 30 секунд<br>
+                <strong>GET /api/changes?since=120&amp;stream=sse</strong> - Изменения потоком Server-Sent Events
+            </div>
+
             <div class="endpoint">
                 <strong>GET /api/genres</strong> - Список жанров<br>
-                <strong>GET /api/tags</strong> - Список тегов
+                <strong>GET /api/tags</strong> - Список тегов<br>
+                <strong>GET /api/profiling</strong> - Время и число SQL-запросов по эндпоинтам
+            </div>
+
+            <div class="endpoint">
+                <strong>GET /api/search?q=толст&amp;limit=20&amp;offset=0</strong> - Полнотекстовый поиск книг
             </div>
 
             <p>Пример использования:</p>
@@ -158,7 +278,7 @@ def index():
 
 
 # Обработка ошибок
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({
         'success': False,
@@ -166,7 +286,7 @@ def not_found(error):
     }), 404
 
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
     return jsonify({
         'success': False,
@@ -174,7 +294,11 @@ def internal_error(error):
     }), 500
 
 
-# Запуск приложения
+# Приложение для сервера разработки, ASGI и тестов
+app = create_app()
+
+
+# Запуск приложения (для разработки; в production - python -m src.launcher)
 if __name__ == '__main__':
     # Создаем таблицы при первом запуске
     create_tables()
@@ -189,16 +313,25 @@ if __name__ == '__main__':
     print("  GET    /api/authors    - список авторов")
     print("  POST   /api/authors    - создать автора")
     print("  GET    /api/authors/1  - получить автора")
+    print("  GET    /api/authors/1/books - книги автора")
     print("  PUT    /api/authors/1  - обновить автора")
     print("  DELETE /api/authors/1  - удалить автора")
     print("  GET    /api/books      - список книг")
     print("  POST   /api/books      - создать книгу")
+    print("  POST   /api/books/bulk - массово создать книги")
     print("  GET    /api/books/1    - получить книгу")
     print("  PUT    /api/books/1    - обновить книгу")
     print("  DELETE /api/books/1    - удалить книгу")
+    print("  POST   /api/batch      - пакет операций")
+    print("  GET    /api/changes?since= - журнал изменений")
     print("  GET    /api/genres     - список жанров")
     print("  GET    /api/tags       - список тегов")
+    print("  GET    /api/search?q=  - поиск книг")
     print("=" * 60)
 
-    # Запускаем сервер
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Запускаем сервер: сервер разработки Flask или ASGI (uvicorn) по настройке server
+    if config['server'] == 'asgi':
+        from src.asgi import run
+        run(app, host='0.0.0.0', port=5000)
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,233 @@
+"""ASGI-вход в API: те же маршруты Flask, но соединения клиентов обслуживает цикл событий.
+
+Запуск: uvicorn src.asgi:app (или LIBRARY_SERVER=asgi python -m src.app).
+
+Запрос читается целиком в цикле событий, после чего Flask-приложение
+выполняется в ограниченном пуле потоков - там же, где и все обращения к
+базе через DatabaseManager. Ответ отправляется клиенту из цикла событий,
+поэтому медленный клиент не занимает поток ОС, пока получает данные.
+"""
+import asyncio
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.app import app as flask_app
+from src.config import config
+
+# Тело запроса больше этого размера (байт) записывается во временный файл, а не в память
+REQUEST_SPOOL_SIZE = 1024 * 1024
+
+# Сколько фрагментов потокового ответа может ждать отправки клиенту
+STREAM_QUEUE_SIZE = 16
+
+
+class ClientDisconnected(Exception):
+    """Клиент закрыл соединение, не дождавшись ответа"""
+
+
+def build_environ(scope, body):
+    """WSGI environ (PEP 3333) по ASGI scope и файлу с телом запроса"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = 'HTTP_' + name
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+
+    # Тело уже прочитано целиком (в том числе при Transfer-Encoding: chunked)
+    body.seek(0, 2)
+    environ['CONTENT_LENGTH'] = str(body.tell())
+    body.seek(0)
+    return environ
+
+
+class WsgiToAsgi:
+    """ASGI-приложение, выполняющее WSGI-приложение в пуле из max_workers потоков.
+
+    Размер пула ограничивает число одновременно выполняемых обработчиков;
+    по умолчанию он равен размеру пула соединений с базой, чтобы потоки
+    не ждали свободного соединения.
+    """
+
+    def __init__(self, wsgi_app, max_workers=None, on_startup=None):
+        self.wsgi_app = wsgi_app
+        self.max_workers = max_workers or config['asgi_threads'] or config['db_max_connections']
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='asgi')
+        self.on_startup = on_startup
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.on_startup:
+                        await asyncio.get_running_loop().run_in_executor(self.executor, self.on_startup)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        """Прочитать тело запроса без участия потоков пула; None, если клиент отключился"""
+        body = tempfile.SpooledTemporaryFile(max_size=REQUEST_SPOOL_SIZE)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body.seek(0)
+        return body
+
+    def run_wsgi(self, environ, loop, queue, disconnected):
+        """В потоке пула: выполнить WSGI-приложение и передать статус и тело ответа в очередь.
+
+        Обычный ответ Flask - один фрагмент, и поток освобождается сразу. Потоковый
+        ответ занимает поток, пока не отправлен, но не более STREAM_QUEUE_SIZE
+        фрагментов вперед клиента.
+        """
+        def put(item):
+            if disconnected.is_set():
+                raise ClientDisconnected()
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            put(('start', status, headers))
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        put(('body', chunk))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            put(('end',))
+        except ClientDisconnected:
+            pass
+        except Exception as e:
+            print(f"Ошибка WSGI-приложения: {e}")
+            if not disconnected.is_set():
+                put(('error',))
+        finally:
+            environ['wsgi.input'].close()
+
+    async def handle_http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        disconnected = threading.Event()
+        environ = build_environ(scope, body)
+        # Обработчики долгих ответов (GET /api/changes) прекращают ждать, когда клиент отключился
+        environ['library.disconnected'] = disconnected
+        future = loop.run_in_executor(self.executor, self.run_wsgi, environ, loop, queue, disconnected)
+
+        # Отключение клиента видно по http.disconnect, даже пока ответу нечего отправить
+        sender = asyncio.ensure_future(self.send_response(queue, send))
+        watcher = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            await asyncio.wait([sender, watcher], return_when=asyncio.FIRST_COMPLETED)
+            finished = sender.done() and not sender.cancelled() and sender.exception() is None
+        finally:
+            sender.cancel()
+            watcher.cancel()
+
+        if not finished:
+            # Клиент ушел: останавливаем обработчик и освобождаем его поток
+            disconnected.set()
+            while not future.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.wait([future], timeout=0.05)
+        await future
+
+    async def wait_disconnect(self, receive):
+        """Дождаться http.disconnect после того, как тело запроса прочитано"""
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def send_response(self, queue, send):
+        status = headers = None
+        started = False
+        while True:
+            item = await queue.get()
+            if item[0] == 'start':
+                status, headers = item[1], item[2]
+                continue
+
+            if not started:
+                if item[0] == 'error':
+                    status, headers = '500 INTERNAL SERVER ERROR', [('Content-Type', 'text/plain')]
+                await send({
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers],
+                })
+                started = True
+
+            if item[0] == 'body':
+                await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+            else:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                return
+
+
+def create_asgi_app(wsgi_app, max_workers=None):
+    """ASGI-обертка над Flask-приложением; при старте сервера создает таблицы и применяет миграции"""
+    from src.models import create_tables
+    return WsgiToAsgi(wsgi_app, max_workers, on_startup=create_tables)
+
+
+def run(wsgi_app=None, host='0.0.0.0', port=5000):
+    """Запустить API в режиме ASGI через uvicorn"""
+    try:
+        import uvicorn
+    except ImportError:
+        print("Для режима ASGI нужен uvicorn: pip install uvicorn")
+        return
+    asgi_app = create_asgi_app(wsgi_app) if wsgi_app is not None else app
+    uvicorn.run(asgi_app, host=host, port=port, lifespan='on')
+
+
+app = create_asgi_app(flask_app)
@@ -0,0 +1,375 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from peewee import SqliteDatabase
+from playhouse.shortcuts import model_to_dict
+
+from src.config import config
+from src.models import MODELS, Book, create_tables, database, init_database, seed_database, SYNTHETIC_WORDS
+from src.serializers import BOOK_SERIALIZER, FastJSONProvider, orjson
+
+
+def fill_books(count):
+    """Заполнить текущую базу count книгами для замеров"""
+    description = 'Роман о судьбах нескольких семей на фоне исторических событий. ' * 5
+    rows = [{'title': f'Книга {i}', 'isbn': f'{i:013d}', 'publication_year': 1800 + i % 200,
+             'description': description, 'page_count': 100 + i % 900}
+            for i in range(count)]
+    with database.atomic():
+        for start in range(0, count, 100):
+            Book.insert_many(rows[start:start + 100]).execute()
+
+
+def measure(func, rows, repeat):
+    """Лучшая из repeat попыток скорость func() в строках в секунду"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return rows / best
+
+
+def benchmark_serialization(rows=20000, repeat=3):
+    """Сравнить model_to_dict + стандартный JSON Flask с ModelSerializer + FastJSONProvider.
+
+    Замер идет на базе в памяти: выборка всех книг и сериализация ответа
+    так же, как это делает GET /api/books. Возвращает словарь с числом строк в секунду.
+    """
+    previous = database.obj
+    database.initialize(SqliteDatabase(':memory:'))
+    try:
+        database.create_tables(MODELS)
+        fill_books(rows)
+
+        app = Flask(__name__)
+        default_provider = DefaultJSONProvider(app)
+        fast_provider = FastJSONProvider(app)
+
+        def before():
+            books = [model_to_dict(book) for book in Book.select().order_by(Book.title)]
+            default_provider.dumps({'success': True, 'data': books, 'count': len(books)})
+
+        def after():
+            books = BOOK_SERIALIZER.rows(BOOK_SERIALIZER.select().order_by(Book.title))
+            fast_provider.dumps({'success': True, 'data': books, 'count': len(books)})
+
+        result = {
+            'rows': rows,
+            'json_backend': 'orjson' if orjson else 'json',
+            'before_rows_per_sec': round(measure(before, rows, repeat)),
+            'after_rows_per_sec': round(measure(after, rows, repeat)),
+        }
+        result['speedup'] = round(result['after_rows_per_sec'] / result['before_rows_per_sec'], 2)
+        return result
+    finally:
+        database.initialize(previous)
+
+
+class BenchmarkContext:
+    """Случайные, но воспроизводимые параметры запросов сценариев"""
+
+    def __init__(self, ids, seed):
+        self.ids = ids
+        self.rng = random.Random(seed)
+        self.created = {'book': [], 'author': []}
+        # Уникальные значения не повторяются и в следующих прогонах на той же базе
+        self.sequence = itertools.count(time.time_ns() // 1000 % 10 ** 12)
+        self.lock = threading.Lock()
+
+    def pick(self, kind):
+        with self.lock:
+            return self.rng.choice(self.ids[kind])
+
+    def pick_many(self, kind, count):
+        """Несколько разных id вида kind"""
+        with self.lock:
+            return self.rng.sample(self.ids[kind], min(count, len(self.ids[kind])))
+
+    def word(self):
+        with self.lock:
+            return self.rng.choice(SYNTHETIC_WORDS)
+
+    def unique(self):
+        """Число, не повторяющееся между запросами (для имен авторов и ISBN)"""
+        with self.lock:
+            return next(self.sequence)
+
+    def add_created(self, kind, object_id):
+        with self.lock:
+            self.created[kind].append(object_id)
+
+    def pop_created(self, kind):
+        with self.lock:
+            return self.created[kind].pop() if self.created[kind] else None
+
+    def new_book(self):
+        """Книга для создания: с уникальным ISBN и связями"""
+        return {'title': f'Книга {self.word()}', 'isbn': f'{self.unique():013d}', 'publication_year': 2000,
+                'author_ids': [self.pick('author')], 'genre_ids': [self.pick('genre')],
+                'tag_ids': [self.pick('tag')]}
+
+
+# Сценарии: имя -> функция(context), возвращающая (метод, путь, тело) одного запроса.
+# Записи идут после чтений, delete_book и delete_author удаляют книги и авторов,
+# созданных create_book и create_author.
+SCENARIOS = {
+    'health': lambda c: ('GET', '/api/health', None),
+    'authors_page': lambda c: ('GET', '/api/authors?limit=50', None),
+    'author': lambda c: ('GET', f"/api/authors/{c.pick('author')}", None),
+    'authors_top': lambda c: ('GET', '/api/authors?limit=50&sort=-book_count&min_books=1', None),
+    'author_books': lambda c: ('GET', f"/api/authors/{c.pick('author')}/books?limit=20", None),
+    'books_page': lambda c: ('GET', '/api/books?limit=50&with_total=1', None),
+    'books_filtered': lambda c: ('GET', f"/api/books?limit=50&genre_id={c.pick('genre')}"
+                                        f"&year_from=1900&facets=genre,tag,year", None),
+    'books_fields': lambda c: ('GET', '/api/books?limit=200&fields=id,title,authors.name&include=authors', None),
+    'book': lambda c: ('GET', f"/api/books/{c.pick('book')}", None),
+    'books_ids': lambda c: ('GET', f"/api/books?ids={','.join(map(str, c.pick_many('book', 20)))}", None),
+    'books_stream': lambda c: ('GET', f"/api/books?stream=ndjson&genre_id={c.pick('genre')}", None),
+    'changes': lambda c: ('GET', '/api/changes?since=0&limit=100', None),
+    'genres': lambda c: ('GET', '/api/genres', None),
+    'tags': lambda c: ('GET', '/api/tags', None),
+    'search': lambda c: ('GET', f'/api/search?q={c.word()}&limit=20', None),
+    'create_author': lambda c: ('POST', '/api/authors', {'name': f'Автор {c.word()} {c.unique()}',
+                                                         'country': 'Россия'}),
+    'update_author': lambda c: ('PUT', f"/api/authors/{c.pick('author')}", {'biography': c.word()}),
+    'create_book': lambda c: ('POST', '/api/books', c.new_book()),
+    'update_book': lambda c: ('PUT', f"/api/books/{c.pick('book')}", {'page_count': 300, 'description': c.word()}),
+    'books_bulk': lambda c: ('POST', '/api/books/bulk', {'books': [c.new_book() for _ in range(20)]}),
+    'batch': lambda c: ('POST', '/api/batch', {
+        'operations': [{'op': 'update', 'type': 'book', 'id': c.pick('book'), 'data': {'description': c.word()}},
+                       {'op': 'update', 'type': 'author', 'id': c.pick('author'), 'data': {'biography': c.word()}},
+                       {'op': 'create', 'type': 'book', 'data': c.new_book()}],
+        'books': c.pick_many('book', 10), 'authors': c.pick_many('author', 5)}),
+    'delete_book': lambda c: ('DELETE', f"/api/books/{c.pop_created('book')}", None),
+    'delete_author': lambda c: ('DELETE', f"/api/authors/{c.pop_created('author')}", None),
+}
+
+# Сценарии создания: имя -> вид объекта, id которого запоминается для сценариев удаления
+CREATING_SCENARIOS = {'create_book': 'book', 'create_author': 'author'}
+
+
+def db_queries(headers):
+    """Число SQL-запросов из заголовка X-DB-Queries (None, если профилирование выключено)"""
+    value = headers.get('X-DB-Queries')
+    return int(value) if value is not None else None
+
+
+class ClientDriver:
+    """Запросы через тестовый клиент Flask в этом же процессе"""
+
+    mode = 'client'
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body):
+        """Выполнить запрос; возвращает (статус, тело JSON, число SQL-запросов)"""
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        response = self.local.client.open(path, method=method, json=body)
+        # Потоковый ответ формируется только при чтении тела
+        response.get_data()
+        response.close()
+        return response.status_code, response.get_json(silent=True), db_queries(response.headers)
+
+
+class HttpDriver:
+    """Запросы по HTTP к запущенному серверу (сессия requests на поток)"""
+
+    mode = 'http'
+
+    def __init__(self, url):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, body):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        response = self.local.session.request(method, self.url + path, json=body)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        return response.status_code, data, db_queries(response.headers)
+
+
+def discover_ids(driver, limit=1000):
+    """id авторов, книг, жанров и тегов, к которым будут обращаться сценарии"""
+    ids = {}
+    for kind, path in (('author', f'/api/authors?limit={limit}'), ('book', f'/api/books?limit={limit}&fields=id'),
+                       ('genre', '/api/genres'), ('tag', '/api/tags')):
+        status, data, _ = driver.request('GET', path, None)
+        if status != 200:
+            raise RuntimeError(f'Не удалось получить список {path}: HTTP {status}')
+        ids[kind] = [item['id'] for item in data['data']] or [0]
+    return ids
+
+
+def is_failure(status, data):
+    """Ответ с ошибкой: 4xx/5xx или 200 с неудавшимися записями (пакет, массовое создание)"""
+    if status >= 400:
+        return True
+    return isinstance(data, dict) and (data.get('success') is False or bool(data.get('failed')))
+
+
+def percentile(sorted_values, p):
+    """Перцентиль p (0-100) по отсортированному списку, метод ближайшего ранга"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def run_scenario(driver, context, name, requests_count, concurrency, warmup):
+    """Выполнить requests_count запросов сценария в concurrency потоков.
+
+    Возвращает пропускную способность, перцентили задержки (мс), число
+    ошибок (см. is_failure) и среднее число SQL-запросов на запрос (по заголовку X-DB-Queries).
+    """
+    build = SCENARIOS[name]
+
+    def one():
+        method, path, body = build(context)
+        started = time.perf_counter()
+        status, data, queries = driver.request(method, path, body)
+        elapsed = time.perf_counter() - started
+        if name in CREATING_SCENARIOS and status == 201:
+            context.add_created(CREATING_SCENARIOS[name], data['data']['id'])
+        return elapsed, is_failure(status, data), queries
+
+    for _ in range(warmup):
+        one()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: one(), range(requests_count)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    queries = [count for _, _, count in results if count is not None]
+    result = {
+        'requests': requests_count,
+        'errors': sum(1 for _, failed, _ in results if failed),
+        'throughput_rps': round(requests_count / wall, 1),
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+    return result
+
+
+def benchmark_api(driver, scenarios=None, requests_count=200, concurrency=8, warmup=10, seed=42, books=None):
+    """Прогнать сценарии API через driver и собрать результаты в словарь для JSON"""
+    names = scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"Неизвестные сценарии: {', '.join(unknown)}")
+
+    context = BenchmarkContext(discover_ids(driver), seed)
+    # Удаления - только созданных в этом прогоне книг и авторов, поэтому без прогрева
+    results = {name: run_scenario(driver, context, name, requests_count, concurrency,
+                                  0 if name in ('create_book', 'delete_book', 'delete_author') else warmup)
+               for name in names}
+
+    return {
+        'mode': driver.mode,
+        'books': books,
+        'requests_per_scenario': requests_count,
+        'concurrency': concurrency,
+        'warmup': warmup,
+        'seed': seed,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'json_backend': 'orjson' if orjson else 'json',
+        'db_backend': config['db_backend'],
+        'scenarios': results,
+    }
+
+
+def seeded_client_driver(books, seed, db_path=None):
+    """Драйвер тестового клиента на отдельной базе SQLite с синтетической библиотекой"""
+    from src.app import create_app
+
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='library-bench-'), 'library.db')
+    init_database(dict(config, db_backend='sqlite', db_path=db_path))
+    if not Book.table_exists():
+        # Сообщения заполнения - в stderr, чтобы в stdout был только JSON результата
+        with redirect_stdout(sys.stderr):
+            create_tables()
+            seed_database(books, seed)
+    return ClientDriver(create_app())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры производительности Books Library API')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serialization = subparsers.add_parser('serialization', help='скорость сериализации списка книг')
+    serialization.add_argument('--rows', type=int, default=20000)
+    serialization.add_argument('--repeat', type=int, default=3)
+
+    seed = subparsers.add_parser('seed', help='заполнить базу из настроек синтетической библиотекой')
+    seed.add_argument('--books', type=int, default=10000)
+    seed.add_argument('--seed', type=int, default=42)
+
+    api = subparsers.add_parser('api', help='нагрузка на эндпоинты API: задержки, пропускная способность, SQL-запросы')
+    api.add_argument('--mode', choices=('client', 'http'), default='client',
+                     help='client - тестовый клиент Flask на временной базе, http - запущенный сервер')
+    api.add_argument('--url', default='http://localhost:5000', help='адрес сервера для режима http')
+    api.add_argument('--books', type=int, default=10000, help='размер синтетической библиотеки (режим client)')
+    api.add_argument('--db', help='файл базы для режима client: заполняется один раз и переиспользуется')
+    api.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    api.add_argument('--concurrency', type=int, default=8)
+    api.add_argument('--warmup', type=int, default=10)
+    api.add_argument('--seed', type=int, default=42)
+    api.add_argument('--scenarios', help=f"через запятую: {', '.join(SCENARIOS)}")
+    api.add_argument('--output', help='записать результат в JSON-файл')
+
+    args = parser.parse_args()
+    if args.command == 'serialization':
+        result = benchmark_serialization(args.rows, args.repeat)
+    elif args.command == 'seed':
+        create_tables()
+        seed_database(args.books, args.seed)
+        return
+    else:
+        if args.mode == 'client':
+            driver = seeded_client_driver(args.books, args.seed, args.db)
+        else:
+            driver = HttpDriver(args.url)
+        scenarios = args.scenarios.split(',') if args.scenarios else None
+        result = benchmark_api(driver, scenarios, args.requests, args.concurrency, args.warmup, args.seed,
+                               args.books if args.mode == 'client' else None)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
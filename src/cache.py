@@ -0,0 +1,250 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from src.config import config
+
+
+class LRUCache:
+    """Кэш в памяти процесса: вытесняет давно не использованные записи и записи старше ttl секунд.
+
+    Значения хранятся как есть, поэтому полученные из кэша объекты нельзя изменять.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()  # ключ -> (значение, момент устаревания)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Значение по ключу или None, если его нет в кэше"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[1] <= time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        return {
+            'backend': 'memory',
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class SharedCache:
+    """Кэш во внешнем хранилище, общем для нескольких процессов.
+
+    client - любой объект с методами get(key), set(key, value, ttl) и
+    delete(key), работающий с байтами (например, обертка над клиентом
+    memcached или Redis). Значения сериализуются через pickle.
+    """
+
+    def __init__(self, client, prefix='library:', ttl=300):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), self.ttl)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.client.delete(self.prefix + key)
+
+    def clear(self):
+        if hasattr(self.client, 'clear'):
+            self.client.clear()
+
+    def stats(self):
+        return {
+            'backend': type(self.client).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            # Вытеснением управляет внешнее хранилище
+            'evictions': None,
+        }
+
+
+class LocalCacheClient:
+    """Замена внешнего хранилища для SharedCache в пределах одного процесса (для тестов и разработки)"""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[1] <= time.monotonic():
+                self._items.pop(key, None)
+                return None
+            return item[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class NullCache:
+    """Отключенный кэш: ничего не хранит"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return None
+
+
+class RecordingCache:
+    """Обертка кэша, запоминающая ключи, которые записывались или удалялись (см. record_keys)"""
+
+    def __init__(self, cache, keys):
+        self.cache = cache
+        self.keys = keys
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.keys.append(key)
+        self.cache.set(key, value)
+
+    def delete(self, *keys):
+        self.keys.extend(keys)
+        self.cache.delete(*keys)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class RedisCacheClient:
+    """Клиент Redis с интерфейсом, который ожидает SharedCache"""
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def set(self, key, value, ttl):
+        self.redis.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self.redis.delete(key)
+
+
+def create_cache(settings=None):
+    """Кэш чтения по настройкам cache_enabled и cache_backend (memory или redis)"""
+    settings = settings or config
+    if not settings['cache_enabled']:
+        return NullCache()
+    backend = settings['cache_backend']
+    if backend == 'redis':
+        return SharedCache(RedisCacheClient(settings['cache_url']), ttl=settings['cache_ttl'])
+    if backend != 'memory':
+        raise ValueError(f"Неизвестный cache_backend: {backend}")
+    return LRUCache(settings['cache_max_size'], settings['cache_ttl'])
+
+
+_cache = create_cache()
+
+# Список ключей, которые запоминает текущий поток (внутри record_keys)
+_recording = threading.local()
+
+
+def get_cache():
+    """Текущий кэш чтения DatabaseManager"""
+    keys = getattr(_recording, 'keys', None)
+    return _cache if keys is None else RecordingCache(_cache, keys)
+
+
+@contextmanager
+def record_keys():
+    """Запоминать ключи кэша, измененные в этом потоке внутри блока with.
+
+    Нужно, когда транзакция фиксируется позже, чем методы записи сбрасывают
+    кэш (write_transaction в src/database.py): между сбросом и фиксацией
+    другой поток может закэшировать старые данные, поэтому после фиксации
+    ключи сбрасываются еще раз. Вложенный блок пополняет список внешнего.
+    """
+    keys = getattr(_recording, 'keys', None)
+    if keys is not None:
+        yield keys
+        return
+    keys = []
+    _recording.keys = keys
+    try:
+        yield keys
+    finally:
+        _recording.keys = None
+
+
+def set_cache(cache):
+    """Заменить кэш чтения (например, на SharedCache для нескольких процессов)"""
+    global _cache
+    _cache = cache
+    return cache
@@ -0,0 +1,81 @@
+import gzip
+
+from src.config import config
+
+# brotli - необязательная зависимость: без нее ответы сжимаются только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Поддерживаемые кодировки в порядке предпочтения сервера
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+# Типы ответов, которые имеет смысл сжимать
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain')
+
+# Степень сжатия ответов на лету: быстрее, но хуже
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Степень сжатия заранее подготовленных ответов: они сжимаются один раз на версию данных
+PRECOMPRESSED_GZIP_LEVEL = 9
+PRECOMPRESSED_BROTLI_QUALITY = 11
+
+
+def choose_encoding(accept_encodings):
+    """Выбрать кодировку по заголовку Accept-Encoding (werkzeug Accept) или None"""
+    if not config['compression_enabled']:
+        return None
+    best = None
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+def compress(body, encoding, precomputed=False):
+    """Сжать тело ответа (bytes) выбранной кодировкой"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=PRECOMPRESSED_BROTLI_QUALITY if precomputed else BROTLI_QUALITY)
+    # mtime=0 - одинаковое тело дает одинаковый результат
+    return gzip.compress(body, compresslevel=PRECOMPRESSED_GZIP_LEVEL if precomputed else GZIP_LEVEL, mtime=0)
+
+
+def encoded_etag(etag, encoding):
+    """ETag сжатого представления: у разных кодировок одного ответа ETag должны различаться"""
+    return f'{etag}-{encoding}'
+
+
+def is_compressible(response):
+    return (response.status_code == 200
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+            and 'Content-Encoding' not in response.headers)
+
+
+def set_encoding(response, body, encoding):
+    """Записать в ответ сжатое тело и поправить заголовки, включая ETag"""
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+
+
+def compress_response(response, accept_encodings):
+    """Сжать ответ after_request, если клиент это поддерживает и тело не меньше порога.
+
+    Потоковые ответы не сжимаются: их тело еще не сформировано, а буферизация
+    лишила бы их смысла.
+    """
+    if not is_compressible(response) or response.direct_passthrough or response.is_streamed:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None or len(response.get_data()) < config['compression_min_size']:
+        return response
+
+    set_encoding(response, compress(response.get_data(), encoding), encoding)
+    return response
@@ -1,7 +1,388 @@
 from peewee import *
 from src.models import *
 import json
-from playhouse.shortcuts import model_to_dict
+import base64
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from itertools import islice
+from src.cache import LRUCache, get_cache, record_keys
+from src.config import config
+from src.serializers import (AUTHOR_SERIALIZER, BOOK_SERIALIZER, EMBEDDED_AUTHOR_SERIALIZER,
+                             GENRE_SERIALIZER, TAG_SERIALIZER, ModelSerializer, dumps_document,
+                             loads_document)
+from src.writer import write
+
+# Сколько книг загружать за один IN-запрос (SQLite ограничивает число параметров запроса)
+RELATION_CHUNK_SIZE = 500
+
+# Связи книги: ключ в ответе, сериализатор связанной модели и промежуточная таблица
+BOOK_RELATIONS = (
+    ('authors', EMBEDDED_AUTHOR_SERIALIZER, BookAuthor),
+    ('genres', GENRE_SERIALIZER, BookGenre),
+    ('tags', TAG_SERIALIZER, BookTag),
+)
+
+
+
+class BookProjection:
+    """Какие поля книги и какие связи возвращать (параметры ?fields= и ?include=).
+
+    fields - имена полей книги (None - все поля), relations - словарь
+    {связь: имена полей связанной записи или None - все поля}; связи,
+    которых нет в словаре, не загружаются. id возвращается всегда.
+    """
+
+    def __init__(self, fields=None, relations=None):
+        self.fields = fields
+        if relations is None:
+            relations = {key: None for key, _, _ in BOOK_RELATIONS}
+        self.relations = relations
+
+    @property
+    def is_full(self):
+        return (self.fields is None and len(self.relations) == len(BOOK_RELATIONS)
+                and all(fields is None for fields in self.relations.values()))
+
+    @classmethod
+    def parse(cls, fields=None, include=None):
+        """Разобрать строки параметров fields ("id,title,authors.name") и include ("authors,tags").
+
+        Без include загружаются связи, упомянутые в fields, а если не задан
+        и fields - все связи. При неизвестном имени выбрасывает ValueError.
+        """
+        relation_names = {key: serializer.names for key, serializer, _ in BOOK_RELATIONS}
+        book_fields = None
+        relation_fields = {}
+
+        if fields is not None:
+            book_fields = ['id']
+            for name in (name.strip() for name in fields.split(',')):
+                relation, _, field = name.partition('.')
+                if not name or name in book_fields:
+                    continue
+                if relation in relation_names:
+                    if not field:
+                        relation_fields[relation] = None
+                    elif field not in relation_names[relation]:
+                        raise ValueError(f'Неизвестное поле "{name}"')
+                    elif relation_fields.get(relation, ['id']) is not None:
+                        relation_fields[relation] = relation_fields.get(relation, ['id']) + [field]
+                elif name in Book._meta.fields:
+                    book_fields.append(name)
+                else:
+                    raise ValueError(f'Неизвестное поле "{name}"')
+
+        if include is not None:
+            relations = {}
+            for relation in (relation.strip() for relation in include.split(',')):
+                if not relation:
+                    continue
+                if relation not in relation_names:
+                    raise ValueError(f'Неизвестная связь "{relation}"')
+                relations[relation] = relation_fields.get(relation)
+        elif fields is not None:
+            relations = relation_fields
+        else:
+            relations = None
+
+        return cls(book_fields, relations)
+
+    def book_serializer(self, *extra):
+        """Сериализатор книги по выбранным полям; extra - поля, нужные серверу (например, для курсора)"""
+        if self.fields is None:
+            return BOOK_SERIALIZER
+        return ModelSerializer(Book, self.fields + [name for name in extra if name not in self.fields])
+
+    def relation_loaders(self):
+        """(ключ, сериализатор, промежуточная таблица) для загружаемых связей"""
+        loaders = []
+        for key, serializer, link_model in BOOK_RELATIONS:
+            if key not in self.relations:
+                continue
+            fields = self.relations[key]
+            if fields is not None:
+                serializer = ModelSerializer(serializer.model, fields)
+            loaders.append((key, serializer, link_model))
+        return loaders
+
+    def apply(self, book_data):
+        """Выбрать из полного словаря книги только запрошенные поля и связи"""
+        relation_keys = [key for key, _, _ in BOOK_RELATIONS]
+        names = self.fields if self.fields is not None else [
+            name for name in book_data if name not in relation_keys]
+        result = {name: book_data[name] for name in names}
+        for key, fields in self.relations.items():
+            items = book_data.get(key, [])
+            result[key] = items if fields is None else [
+                {name: item[name] for name in fields} for item in items]
+        return result
+
+
+# Полный набор полей и связей книги
+FULL_BOOK = BookProjection()
+
+# Связи книги при записи: поле запроса со списком id, промежуточная таблица и ее внешний ключ
+BOOK_LINKS = (
+    ('author_ids', BookAuthor, 'author'),
+    ('genre_ids', BookGenre, 'genre'),
+    ('tag_ids', BookTag, 'tag'),
+)
+
+# Поля, которые ведет сама база и которые нельзя задать в запросе
+READ_ONLY_FIELDS = ('id', 'version', 'updated_at', 'book_count')
+
+# Сколько книг массового импорта обрабатывать в одной транзакции
+BULK_BATCH_SIZE = 500
+
+# Сколько строк вставлять одним INSERT (ограничение SQLite на число параметров запроса)
+INSERT_CHUNK_SIZE = 100
+
+# Веса полей полнотекстового индекса для BM25: название, описание, авторы, теги
+SEARCH_WEIGHTS = (10.0, 1.0, 5.0, 2.0)
+
+# Замена "ё" на "е" в индексе и запросе: токенизатор unicode61 считает их разными буквами
+SEARCH_TRANSLATION = str.maketrans('ёЁ', 'еЕ')
+
+# Сколько секунд хранить посчитанное общее количество записей
+COUNT_CACHE_TTL = 60
+
+# Сколько разных наборов фильтров хранить в кэше количеств
+COUNT_CACHE_SIZE = 1000
+
+# Кэш общего количества записей: (таблица, поколение, фильтры) -> значение.
+# forget_counts не перебирает ключи, а меняет поколение таблицы; старые записи вытесняет LRU
+_count_cache = LRUCache(COUNT_CACHE_SIZE, COUNT_CACHE_TTL)
+_count_generations = {}
+
+# Фильтры списка книг: имя фильтра -> (промежуточная таблица, ее внешний ключ)
+BOOK_LINK_FILTERS = {
+    'author_id': (BookAuthor, 'author'),
+    'genre_id': (BookGenre, 'genre'),
+    'tag_id': (BookTag, 'tag'),
+}
+
+# Фильтры-диапазоны: имя фильтра -> (поле книги, является ли граница нижней)
+BOOK_RANGE_FILTERS = {
+    'year_from': (Book.publication_year, True),
+    'year_to': (Book.publication_year, False),
+    'pages_from': (Book.page_count, True),
+    'pages_to': (Book.page_count, False),
+}
+
+# Доступные фасеты списка книг
+BOOK_FACETS = ('genre', 'tag', 'author', 'year')
+
+# Сортировки списка авторов: значение ?sort= -> (поле ключа сортировки, по убыванию ли)
+AUTHOR_SORTS = {
+    'name': (Author.name, False),
+    'book_count': (Author.book_count, False),
+    '-book_count': (Author.book_count, True),
+}
+
+# Фильтры списка авторов по числу книг: имя фильтра -> является ли граница нижней
+AUTHOR_RANGE_FILTERS = {
+    'min_books': True,
+    'max_books': False,
+}
+
+# Сколько id можно запросить одним мультизапросом и сколько операций передать в одном пакете
+MAX_MULTI_GET_IDS = 1000
+MAX_BATCH_OPERATIONS = 100
+
+# Объекты журнала изменений (имена совпадают с именами таблиц в touch_tables)
+CHANGE_ENTITIES = ('book', 'author', 'genre', 'tag')
+
+# Имя счетчика в TableVersion, хранящего позицию последней удаленной при сжатии записи об удалении
+CHANGES_PURGED = 'changelog_purged'
+
+# Сколько записей журнала добавил процесс с последнего сжатия и до какой позиции журнал уже сжат
+_changes_state = {'pending': 0, 'compacted': 0}
+
+
+def encode_cursor(values):
+    """Упаковать значения ключа сортировки последней записи в непрозрачный курсор"""
+    raw = json.dumps(values, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Распаковать курсор; при некорректном значении выбрасывает ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Некорректный курсор")
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], int):
+        raise ValueError("Некорректный курсор")
+    return values
+
+
+def forget_counts(table):
+    """Сбросить закэшированные количества записей таблицы (для всех наборов фильтров)"""
+    _count_generations[table] = _count_generations.get(table, 0) + 1
+
+
+def book_conditions(filters):
+    """Условия WHERE для списка книг по словарю фильтров.
+
+    Фильтры по авторам, жанрам и тегам принимают список id (книга подходит,
+    если связана хотя бы с одним) и превращаются в подзапрос к промежуточной
+    таблице, который SQLite выполняет по индексу (author, book).
+    """
+    conditions = []
+    for name, value in (filters or {}).items():
+        if name in BOOK_LINK_FILTERS:
+            link_model, fk_name = BOOK_LINK_FILTERS[name]
+            fk_field = link_model._meta.fields[fk_name]
+            book_ids = link_model.select(link_model.book).where(fk_field.in_(value))
+            conditions.append(Book.id.in_(book_ids))
+        elif name in BOOK_RANGE_FILTERS:
+            field, is_lower = BOOK_RANGE_FILTERS[name]
+            conditions.append(field >= value if is_lower else field <= value)
+    return conditions
+
+
+def filter_books(query, filters):
+    """Применить к запросу книг условия из book_conditions"""
+    conditions = book_conditions(filters)
+    return query.where(*conditions) if conditions else query
+
+
+def filter_authors(query, filters):
+    """Применить к запросу авторов фильтры min_books и max_books (по Author.book_count)"""
+    conditions = [Author.book_count >= value if AUTHOR_RANGE_FILTERS[name] else Author.book_count <= value
+                  for name, value in (filters or {}).items() if name in AUTHOR_RANGE_FILTERS]
+    return query.where(*conditions) if conditions else query
+
+
+def filters_key(filters):
+    """Фильтры в виде, пригодном для ключа кэша количеств"""
+    return tuple(sorted((name, str(value)) for name, value in (filters or {}).items()))
+
+
+def with_documents(query):
+    """Добавить к запросу книг актуальный документ книги последним столбцом (NULL, если его нет или он устарел)"""
+    return (query
+            .select_extend(BookDocument.data)
+            .join(BookDocument, JOIN.LEFT_OUTER,
+                  on=(BookDocument.id == Book.id) & (BookDocument.version == Book.version)))
+
+
+def log_changes(entity, entity_ids, op='upsert'):
+    """Записать в журнал изменений объекты entity_ids (op: upsert или delete).
+
+    Вызывается в транзакции, изменяющей данные. Каждые changes_compact_every
+    записей процесс сжимает часть журнала, добавленную после прошлого сжатия.
+    """
+    entity_ids = list(dict.fromkeys(entity_ids))
+    if not entity_ids:
+        return
+    now = datetime.now()
+    rows = [{'entity': entity, 'entity_id': entity_id, 'op': op, 'changed_at': now}
+            for entity_id in entity_ids]
+    for chunk in chunked(rows, INSERT_CHUNK_SIZE):
+        ChangeLog.insert_many(chunk).execute()
+
+    _changes_state['pending'] += len(rows)
+    if _changes_state['pending'] >= config['changes_compact_every']:
+        _changes_state['pending'] = 0
+        DatabaseManager.compact_changes(after=_changes_state['compacted'])
+
+
+def log_model_changes(model, entity, *conditions):
+    """Записать в журнал изменение всех строк model, подходящих под conditions, одним INSERT ... SELECT"""
+    now = Value(datetime.now(), converter=ChangeLog.changed_at.db_value)
+    query = model.select(Value(entity), model.id, Value('upsert'), now)
+    if conditions:
+        query = query.where(*conditions)
+    (ChangeLog
+     .insert_from(query, [ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op, ChangeLog.changed_at])
+     .execute())
+
+
+def normalize_search_text(text):
+    """Текст для полнотекстового индекса и запроса поиска ("ё" заменяется на "е")"""
+    return text.translate(SEARCH_TRANSLATION)
+
+
+def is_id_list(value):
+    """Является ли значение списком целочисленных id"""
+    return isinstance(value, list) and all(
+        isinstance(item, int) and not isinstance(item, bool) for item in value)
+
+
+def link_fields_error(book_data):
+    """Ошибка в полях связей книги (author_ids, genre_ids, tag_ids) или None"""
+    for key, _, _ in BOOK_LINKS:
+        if not is_id_list(book_data.get(key) or []):
+            return f'Поле "{key}" должно быть списком id'
+    return None
+
+
+def book_cache_key(book_id, version):
+    """Ключ кэша книги версии version.
+
+    Версия входит в ключ, поэтому изменение не нужно сбрасывать из кэша:
+    читатель, прочитавший книгу до фиксации изменения и закэшировавший ее
+    после, запишет ее под старой версией, которую больше никто не запросит.
+    Устаревшие записи вытесняются по TTL.
+    """
+    return f'book:{book_id}:{version}'
+
+
+def author_cache_key(author_id, version, book_count):
+    """Ключ кэша автора; book_count меняется без новой версии и тоже входит в ключ"""
+    return f'author:{author_id}:{version}:{book_count}'
+
+
+def current_versions(model, ids, *fields):
+    """{id: (версия, *fields)} существующих записей model из ids (IN-запросами по пачкам)"""
+    versions = {}
+    for chunk in chunked(ids, RELATION_CHUNK_SIZE):
+        query = model.select(model.id, model.version, *fields).where(model.id.in_(chunk)).tuples()
+        versions.update((row[0], row[1:]) for row in query)
+    return versions
+
+
+def supports_returning():
+    """Поддерживает ли база INSERT ... RETURNING (SQLite - начиная с версии 3.35)"""
+    if isinstance(database.obj, SqliteDatabase):
+        return sqlite3.sqlite_version_info >= (3, 35, 0)
+    return isinstance(database.obj, PostgresqlDatabase)
+
+
+@contextmanager
+def write_transaction():
+    """Транзакция метода записи; в SQLite начинается с BEGIN IMMEDIATE.
+
+    Обычная (DEFERRED) транзакция берет блокировку на запись только при
+    первом изменении, после чтений. Если к этому моменту пишет другое
+    соединение, SQLite не ждет busy_timeout, а сразу возвращает "database is
+    locked". IMMEDIATE берет блокировку в начале, и конкурирующие писатели ждут
+    ее по очереди. Внутри уже открытой транзакции (пакет, поток-писатель) это
+    точка сохранения.
+
+    Ключи кэша, сброшенные или записанные внутри внешней транзакции,
+    сбрасываются еще раз после ее фиксации или отката: до фиксации другие
+    потоки (и сам метод записи) могли закэшировать незафиксированные данные.
+    """
+    if isinstance(database.obj, SqliteDatabase):
+        transaction = database.obj.atomic(lock_type='IMMEDIATE')
+    else:
+        transaction = database.atomic()
+    if database.transaction_depth() > 0:
+        with transaction as txn:
+            yield txn
+        return
+
+    keys = []
+    try:
+        with record_keys() as keys:
+            with transaction as txn:
+                yield txn
+    finally:
+        get_cache().delete(*dict.fromkeys(keys))
 
 
 class DatabaseManager:
@@ -10,39 +391,117 @@ class DatabaseManager:
     # ===== CRUD для Авторов =====
 
     @staticmethod
-    def get_all_authors():
-        """Получить всех авторов"""
+    def get_all_authors(filters=None, sort='name'):
+        """Получить всех авторов (filters - см. filter_authors, sort - ключ AUTHOR_SORTS)"""
         try:
-            authors = Author.select().order_by(Author.name)
-            return [model_to_dict(author) for author in authors]
+            field, descending = AUTHOR_SORTS[sort]
+            order = (field.desc(), Author.id.desc()) if descending else (field, Author.id)
+            authors = filter_authors(AUTHOR_SERIALIZER.select(), filters).order_by(*order)
+            return AUTHOR_SERIALIZER.rows(authors)
         except Exception as e:
             print(f"Ошибка при получении авторов: {e}")
             return []
 
+    @staticmethod
+    def get_authors_page(limit, cursor=None, filters=None, sort='name'):
+        """Получить страницу авторов, отсортированных по (name, id) или (book_count, id).
+
+        Возвращает список авторов и курсор следующей страницы (None, если
+        страница последняя). Переход по курсору - это поиск по индексу,
+        а не OFFSET, поэтому дальние страницы стоят столько же, сколько первая.
+        Курсор хранит значение ключа сортировки и id последнего автора страницы.
+        """
+        field, descending = AUTHOR_SORTS[sort]
+        order = (field.desc(), Author.id.desc()) if descending else (field, Author.id)
+        query = (filter_authors(AUTHOR_SERIALIZER.select(), filters)
+                 .order_by(*order)
+                 .limit(limit + 1))
+        if cursor:
+            value, last_id = decode_cursor(cursor)
+            if not isinstance(value, str if field is Author.name else int):
+                raise ValueError("Некорректный курсор")
+            key = Tuple(field, Author.id)
+            query = query.where(key < Tuple(value, last_id) if descending else key > Tuple(value, last_id))
+
+        authors = AUTHOR_SERIALIZER.rows(query)
+        next_cursor = None
+        if len(authors) > limit:
+            authors = authors[:limit]
+            next_cursor = encode_cursor([authors[-1][field.name], authors[-1]['id']])
+        return authors, next_cursor
+
+    @staticmethod
+    def count_authors(filters=None):
+        """Общее количество авторов с учетом фильтров (кэшируется на COUNT_CACHE_TTL секунд)"""
+        return DatabaseManager._cached_count(('authors', filters_key(filters)),
+                                             filter_authors(Author.select(), filters))
+
     @staticmethod
     def get_author_by_id(author_id):
-        """Получить автора по ID"""
+        """Получить автора по ID (через кэш чтения, ключ - по текущей версии автора)"""
         try:
-            author = Author.get_by_id(author_id)
-            return model_to_dict(author)
-        except Author.DoesNotExist:
-            return None
+            cache = get_cache()
+            version = DatabaseManager.get_author_version(author_id)
+            if version is None:
+                return None
+            author_data = cache.get(author_cache_key(author_id, version[0], version[2]))
+            if author_data is None:
+                authors = AUTHOR_SERIALIZER.rows(AUTHOR_SERIALIZER.select().where(Author.id == author_id))
+                if not authors:
+                    return None
+                author_data = authors[0]
+                cache.set(author_cache_key(author_id, author_data['version'], author_data['book_count']),
+                          author_data)
+            return author_data
         except Exception as e:
             print(f"Ошибка при получении автора {author_id}: {e}")
             return None
 
+    @staticmethod
+    def get_authors_by_ids(author_ids):
+        """Получить авторов по списку id (через кэш чтения, недостающих - IN-запросами).
+
+        Версии авторов читаются одним запросом на пачку: по ним строятся ключи
+        кэша, а несуществующие авторы сразу попадают в ненайденные.
+        Возвращает (авторы в порядке author_ids, id ненайденных авторов).
+        """
+        cache = get_cache()
+        author_ids = list(dict.fromkeys(author_ids))
+        versions = current_versions(Author, author_ids, Author.book_count)
+        found = {}
+        for author_id, (version, book_count) in versions.items():
+            author_data = cache.get(author_cache_key(author_id, version, book_count))
+            if author_data is not None:
+                found[author_id] = author_data
+
+        missing = [author_id for author_id in author_ids if author_id in versions and author_id not in found]
+        for chunk in chunked(missing, RELATION_CHUNK_SIZE):
+            query = AUTHOR_SERIALIZER.select().where(Author.id.in_(chunk))
+            for author_data in AUTHOR_SERIALIZER.rows(query):
+                found[author_data['id']] = author_data
+                cache.set(author_cache_key(author_data['id'], author_data['version'], author_data['book_count']),
+                          author_data)
+
+        return ([found[author_id] for author_id in author_ids if author_id in found],
+                [author_id for author_id in author_ids if author_id not in found])
+
     @staticmethod
     def create_author(author_data):
         """Создать нового автора"""
         try:
-            # Проверяем, нет ли уже автора с таким именем
-            existing_author = Author.select().where(Author.name == author_data['name']).first()
-            if existing_author:
-                return None, "Автор с таким именем уже существует"
-
-            # Создаем автора
-            author = Author.create(**author_data)
-            return model_to_dict(author), None
+            with write_transaction():
+                # Проверяем, нет ли уже автора с таким именем
+                existing_author = Author.select().where(Author.name == author_data['name']).first()
+                if existing_author:
+                    return None, "Автор с таким именем уже существует"
+
+                # Создаем автора
+                author = Author.create(**{k: v for k, v in author_data.items()
+                                          if k not in READ_ONLY_FIELDS})
+                touch_tables('author')
+                log_changes('author', [author.id])
+            forget_counts('authors')
+            return AUTHOR_SERIALIZER.instance(author), None
         except Exception as e:
             print(f"Ошибка при создании автора: {e}")
             return None, str(e)
@@ -51,23 +510,61 @@ class DatabaseManager:
     def update_author(author_id, author_data):
         """Обновить данные автора"""
         try:
-            author = Author.get_by_id(author_id)
-
-            # Проверяем, не пытаемся ли изменить имя на уже существующее
-            if 'name' in author_data:
-                existing_author = Author.select().where(
-                    (Author.name == author_data['name']) &
-                    (Author.id != author_id)
-                ).first()
-                if existing_author:
-                    return None, "Автор с таким именем уже существует"
+            with write_transaction():
+                author = Author.get_by_id(author_id)
 
-            # Обновляем поля
-            for key, value in author_data.items():
-                setattr(author, key, value)
+                # Проверяем, не пытаемся ли изменить имя на уже существующее
+                if 'name' in author_data:
+                    existing_author = Author.select().where(
+                        (Author.name == author_data['name']) &
+                        (Author.id != author_id)
+                    ).first()
+                    if existing_author:
+                        return None, "Автор с таким именем уже существует"
+
+                name_changed = 'name' in author_data and author_data['name'] != author.name
+
+                # Находим действительно изменившиеся поля, как в update_book
+                changed_fields = []
+                for key, value in author_data.items():
+                    field = Author._meta.fields.get(key)
+                    if field is None or key in READ_ONLY_FIELDS:
+                        continue
+                    if field.python_value(field.db_value(value)) != getattr(author, key):
+                        setattr(author, key, value)
+                        changed_fields.append(field)
+
+                # Без изменений не меняются ни автор, ни версии его книг, ни журнал
+                if not changed_fields:
+                    return AUTHOR_SERIALIZER.instance(author), None
+
+                author.version += 1
+                author.updated_at = datetime.now()
+                author.save(only=changed_fields + [Author.version, Author.updated_at])
+
+                book_ids = [book_id for book_id, in (BookAuthor
+                                                     .select(BookAuthor.book)
+                                                     .where(BookAuthor.author == author_id)
+                                                     .tuples())]
+
+                # Автор встроен в ответы по его книгам, поэтому их версии тоже меняются
+                touch_tables('author')
+                log_changes('author', [author_id])
+                log_changes('book', book_ids)
+                if book_ids:
+                    for chunk in chunked(book_ids, RELATION_CHUNK_SIZE):
+                        (Book
+                         .update(version=Book.version + 1, updated_at=author.updated_at)
+                         .where(Book.id.in_(chunk))
+                         .execute())
+                    touch_tables('book')
+
+                # Имя автора входит в полнотекстовый индекс его книг, а все поля - в их документы
+                if name_changed:
+                    DatabaseManager.reindex_books(book_ids)
+                DatabaseManager.refresh_book_documents(book_ids)
 
-            author.save()
-            return model_to_dict(author), None
+            return AUTHOR_SERIALIZER.instance(author), None
         except Author.DoesNotExist:
             return None, "Автор не найден"
         except Exception as e:
@@ -78,14 +575,17 @@ class DatabaseManager:
     def delete_author(author_id):
         """Удалить автора"""
         try:
-            author = Author.get_by_id(author_id)
+            with write_transaction():
+                author = Author.get_by_id(author_id)
 
-            # Проверяем, есть ли у автора книги
-            book_count = BookAuthor.select().where(BookAuthor.author == author_id).count()
-            if book_count > 0:
-                return False, f"Нельзя удалить автора, у которого есть книги ({book_count} книг)"
+                # Проверяем, есть ли у автора книги
+                if author.book_count > 0:
+                    return False, f"Нельзя удалить автора, у которого есть книги ({author.book_count} книг)"
 
-            author.delete_instance()
+                author.delete_instance()
+                touch_tables('author')
+                log_changes('author', [author_id], 'delete')
+            forget_counts('authors')
             return True, None
         except Author.DoesNotExist:
             return False, "Автор не найден"
@@ -93,86 +593,357 @@ class DatabaseManager:
             print(f"Ошибка при удалении автора {author_id}: {e}")
             return False, str(e)
 
+    @staticmethod
+    def get_author_books(author_id, limit, cursor=None, projection=FULL_BOOK):
+        """Страница книг автора в порядке id: (автор, книги, курсор следующей страницы).
+
+        id книг страницы читаются только из индекса (author, book) промежуточной
+        таблицы, а сами книги - через get_books_by_ids (кэш чтения и IN-запросы).
+        Курсор хранит id автора и id последней книги. Если автора нет,
+        возвращает (None, [], None).
+        """
+        author = DatabaseManager.get_author_by_id(author_id)
+        if author is None:
+            return None, [], None
+
+        query = (BookAuthor
+                 .select(BookAuthor.book)
+                 .where(BookAuthor.author == author_id)
+                 .order_by(BookAuthor.book)
+                 .limit(limit + 1)
+                 .tuples())
+        if cursor:
+            cursor_author_id, last_id = decode_cursor(cursor)
+            if cursor_author_id != author_id:
+                raise ValueError("Курсор относится к другому автору")
+            query = query.where(BookAuthor.book > last_id)
+
+        book_ids = [book_id for book_id, in query]
+        next_cursor = None
+        if len(book_ids) > limit:
+            book_ids = book_ids[:limit]
+            next_cursor = encode_cursor([author_id, book_ids[-1]])
+
+        books, _ = DatabaseManager.get_books_by_ids(book_ids, projection)
+        return author, books, next_cursor
+
+    @staticmethod
+    def adjust_book_counts(deltas):
+        """Изменить Author.book_count на величину из словаря {author_id: изменение}.
+
+        Вызывается методами записи книг внутри их транзакций. Авторы с
+        одинаковым изменением обновляются одним UPDATE на пачку. Версия автора
+        не меняется: book_count не встроен в книги, а в ETag автора он входит сам.
+        """
+        by_delta = {}
+        for author_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(author_id)
+        if not by_delta:
+            return
+
+        for delta, author_ids in by_delta.items():
+            for chunk in chunked(author_ids, RELATION_CHUNK_SIZE):
+                (Author
+                 .update(book_count=Author.book_count + delta)
+                 .where(Author.id.in_(chunk))
+                 .execute())
+        touch_tables('author')
+        log_changes('author', [author_id for author_ids in by_delta.values() for author_id in author_ids])
+        forget_counts('authors')
+
+    @staticmethod
+    def recount_book_counts():
+        """Пересчитать Author.book_count по связям (миграции, заполнение базы, исправление расхождений).
+
+        Обновляются только авторы, у которых счетчик разошелся со связями;
+        возвращает их количество.
+        """
+        count = (BookAuthor
+                 .select(fn.COUNT(BookAuthor.id))
+                 .where(BookAuthor.author == Author.id))
+        updated = (Author
+                   .update(book_count=count)
+                   .where(Author.book_count != count)
+                   .execute())
+        if updated:
+            touch_tables('author')
+        return updated
+
     # ===== CRUD для Книг =====
 
     @staticmethod
-    def get_all_books():
+    def get_all_books(filters=None, projection=FULL_BOOK):
         """Получить все книги с информацией об авторах, жанрах и тегах"""
         try:
-            books = Book.select().order_by(Book.title)
-            result = []
-
-            for book in books:
-                book_data = model_to_dict(book)
-
-                # Получаем авторов книги
-                authors = (Author
-                           .select()
-                           .join(BookAuthor)
-                           .where(BookAuthor.book == book.id))
-                book_data['authors'] = [model_to_dict(author) for author in authors]
-
-                # Получаем жанры книги
-                genres = (Genre
-                          .select()
-                          .join(BookGenre)
-                          .where(BookGenre.book == book.id))
-                book_data['genres'] = [model_to_dict(genre) for genre in genres]
-
-                # Получаем теги книги
-                tags = (Tag
-                        .select()
-                        .join(BookTag)
-                        .where(BookTag.book == book.id))
-                book_data['tags'] = [model_to_dict(tag) for tag in tags]
-
-                result.append(book_data)
-
-            return result
+            serializer = projection.book_serializer()
+            books = filter_books(serializer.select(), filters).order_by(Book.title)
+
+            # Авторы, жанры и теги подгружаются пакетно, а не по запросу на каждую книгу
+            return DatabaseManager.read_books(books, serializer, projection)
         except Exception as e:
             print(f"Ошибка при получении книг: {e}")
             return []
 
     @staticmethod
-    def get_book_by_id(book_id):
-        """Получить книгу по ID с полной информацией"""
+    def get_books_page(limit, cursor=None, filters=None, projection=FULL_BOOK):
+        """Получить страницу книг, отсортированных по (title, id), со связями.
+
+        Работает так же, как get_authors_page: курсор хранит (title, id)
+        последней книги страницы. filters - см. book_conditions,
+        projection - набор полей и связей (BookProjection).
+        """
+        serializer = projection.book_serializer('title')
+        query = (filter_books(serializer.select(), filters)
+                 .order_by(Book.title, Book.id)
+                 .limit(limit + 1))
+        if cursor:
+            title, last_id = decode_cursor(cursor)
+            if not isinstance(title, str):
+                raise ValueError("Некорректный курсор")
+            query = query.where(Tuple(Book.title, Book.id) > Tuple(title, last_id))
+
+        books = DatabaseManager.read_books(query, serializer, projection)
+        next_cursor = None
+        if len(books) > limit:
+            books = books[:limit]
+            next_cursor = encode_cursor([books[-1]['title'], books[-1]['id']])
+
+        # Название нужно только для курсора, если клиент его не запрашивал
+        if projection.fields is not None and 'title' not in projection.fields:
+            for book_data in books:
+                del book_data['title']
+
+        return books, next_cursor
+
+    @staticmethod
+    def count_books(filters=None):
+        """Общее количество книг с учетом фильтров (кэшируется на COUNT_CACHE_TTL секунд)"""
+        key = ('books', filters_key(filters))
+        return DatabaseManager._cached_count(key, filter_books(Book.select(), filters))
+
+    @staticmethod
+    def get_book_facets(filters=None, facets=BOOK_FACETS):
+        """Количество книг по жанрам, тегам, авторам и годам для текущего набора фильтров.
+
+        Каждый фасет считается одним запросом с GROUP BY.
+        """
+        conditions = book_conditions(filters)
+        book_ids = filter_books(Book.select(Book.id), filters)
+        result = {}
+
+        for facet, model, link_model in (('genre', Genre, BookGenre),
+                                         ('tag', Tag, BookTag),
+                                         ('author', Author, BookAuthor)):
+            if facet not in facets:
+                continue
+            count = fn.COUNT(link_model.id)
+            query = (model
+                     .select(model.id, model.name, count)
+                     .join(link_model)
+                     .group_by(model.id, model.name)
+                     .order_by(count.desc(), model.name)
+                     .tuples())
+            if conditions:
+                query = query.where(link_model.book.in_(book_ids))
+            result[facet] = [{'id': item_id, 'name': name, 'count': total}
+                             for item_id, name, total in query]
+
+        if 'year' in facets:
+            query = (Book
+                     .select(Book.publication_year, fn.COUNT(Book.id))
+                     .where(Book.publication_year.is_null(False), *conditions)
+                     .group_by(Book.publication_year)
+                     .order_by(Book.publication_year)
+                     .tuples())
+            result['year'] = [{'year': year, 'count': total} for year, total in query]
+
+        return result
+
+    @staticmethod
+    def _cached_count(key, query):
+        """Посчитать записи запроса, используя ранее сохраненное значение, пока оно не устарело"""
+        table, filters = key
+        # Поколение берется до подсчета: сброс во время подсчета не даст сохранить старое значение
+        key = (table, _count_generations.get(table, 0), filters)
+        count = _count_cache.get(key)
+        if count is None:
+            count = query.count()
+            _count_cache.set(key, count)
+        return count
+
+    @staticmethod
+    def iter_books(filters=None, projection=FULL_BOOK, batch_size=RELATION_CHUNK_SIZE):
+        """Перебрать все книги со связями, не загружая таблицу в память целиком.
+
+        Книги читаются серверным курсором (.iterator() не кэширует строки),
+        связи подгружаются пачками по batch_size книг.
+        """
+        serializer = projection.book_serializer()
+        query = filter_books(serializer.select(), filters).order_by(Book.title, Book.id)
+        books = serializer.iterate(query)
+        while True:
+            batch = list(islice(books, batch_size))
+            if not batch:
+                break
+            DatabaseManager.attach_relations(batch, projection)
+            yield from batch
+
+    @staticmethod
+    def read_books(query, serializer, projection=FULL_BOOK):
+        """Книги по запросу serializer.select() со связями из projection.
+
+        Если включены документы книг и нужна полная книга, документ
+        присоединяется к тому же запросу (LEFT JOIN по id и версии), и связи
+        загружаются только для книг без актуального документа.
+        """
+        if not (projection.is_full and documents_enabled()):
+            books = serializer.rows(query)
+            DatabaseManager.attach_relations(books, projection)
+            return books
+
+        books, assembled = [], []
+        for values in with_documents(query).tuples():
+            if values[-1] is not None:
+                books.append(loads_document(values[-1]))
+            else:
+                book_data = serializer.row(values)
+                books.append(book_data)
+                assembled.append(book_data)
+        DatabaseManager.attach_relations(assembled, projection)
+        return books
+
+    @staticmethod
+    def iter_books_json(filters=None, batch_size=RELATION_CHUNK_SIZE):
+        """Перебрать полные книги JSON-текстом для потокового ответа.
+
+        Актуальные документы отдаются как есть, без разбора и повторной
+        сериализации; книги без документа собираются пачками, как в iter_books.
+        """
+        query = with_documents(filter_books(BOOK_SERIALIZER.select(), filters).order_by(Book.title, Book.id))
+        rows = query.tuples().iterator()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            assembled = [BOOK_SERIALIZER.row(values) for values in batch if values[-1] is None]
+            DatabaseManager.attach_relations(assembled)
+            assembled = iter(assembled)
+            for values in batch:
+                yield values[-1] if values[-1] is not None else dumps_document(next(assembled))
+
+    @staticmethod
+    def get_book_by_id(book_id, projection=FULL_BOOK):
+        """Получить книгу по ID с полной информацией (через кэш чтения).
+
+        В кэше хранится только полная книга; неполный набор полей берется
+        из нее, а при промахе кэша читается из базы только нужное. Ключ кэша
+        строится по текущей версии книги (см. book_cache_key), а закэшированная
+        книга записывается под версией, с которой она прочитана.
+        """
         try:
-            book = Book.get_by_id(book_id)
-            book_data = model_to_dict(book)
-
-            # Получаем авторов
-            authors = (Author
-                       .select()
-                       .join(BookAuthor)
-                       .where(BookAuthor.book == book.id))
-            book_data['authors'] = [model_to_dict(author) for author in authors]
-
-            # Получаем жанры
-            genres = (Genre
-                      .select()
-                      .join(BookGenre)
-                      .where(BookGenre.book == book.id))
-            book_data['genres'] = [model_to_dict(genre) for genre in genres]
-
-            # Получаем теги
-            tags = (Tag
-                    .select()
-                    .join(BookTag)
-                    .where(BookTag.book == book.id))
-            book_data['tags'] = [model_to_dict(tag) for tag in tags]
+            # Документ книги - один запрос по первичному ключу вместо четырех,
+            # столько же стоит и проверка версии для кэша, поэтому документ читается без кэша
+            document = DatabaseManager.get_book_json(book_id)
+            if document is not None:
+                book_data = loads_document(document)
+                return book_data if projection.is_full else projection.apply(book_data)
 
+            cache = get_cache()
+            version = DatabaseManager.get_book_version(book_id)
+            if version is None:
+                return None
+            book_data = cache.get(book_cache_key(book_id, version[0]))
+            if book_data is not None:
+                return book_data if projection.is_full else projection.apply(book_data)
+
+            serializer = projection.book_serializer()
+            books = serializer.rows(serializer.select().where(Book.id == book_id))
+            if not books:
+                return None
+            book_data = books[0]
+
+            # Получаем авторов, жанры и теги
+            DatabaseManager.attach_relations([book_data], projection)
+
+            if projection.is_full:
+                cache.set(book_cache_key(book_id, book_data['version']), book_data)
             return book_data
-        except Book.DoesNotExist:
-            return None
         except Exception as e:
             print(f"Ошибка при получении книги {book_id}: {e}")
             return None
 
+    @staticmethod
+    def get_books_by_ids(book_ids, projection=FULL_BOOK):
+        """Получить книги по списку id: 1 + 3 IN-запроса на пачку вместо четырех запросов на книгу.
+
+        Полные книги берутся из кэша чтения по текущим версиям (один запрос
+        версий на пачку), недостающие читаются из базы и кэшируются.
+        Возвращает (книги в порядке book_ids, id ненайденных книг).
+        """
+        cache = get_cache()
+        book_ids = list(dict.fromkeys(book_ids))
+        versions = current_versions(Book, book_ids)
+        found = {}
+        for book_id, (version,) in versions.items():
+            book_data = cache.get(book_cache_key(book_id, version))
+            if book_data is not None:
+                found[book_id] = book_data if projection.is_full else projection.apply(book_data)
+
+        missing = [book_id for book_id in book_ids if book_id in versions and book_id not in found]
+        serializer = projection.book_serializer()
+        for chunk in chunked(missing, RELATION_CHUNK_SIZE):
+            books = DatabaseManager.read_books(serializer.select().where(Book.id.in_(chunk)),
+                                               serializer, projection)
+            for book_data in books:
+                found[book_data['id']] = book_data
+                if projection.is_full:
+                    cache.set(book_cache_key(book_data['id'], book_data['version']), book_data)
+
+        return ([found[book_id] for book_id in book_ids if book_id in found],
+                [book_id for book_id in book_ids if book_id not in found])
+
+    @staticmethod
+    def attach_relations(books, projection=FULL_BOOK):
+        """Добавить авторов, жанры и теги к списку книг (словарей с ключом 'id').
+
+        Связи загружаются IN-запросами по пачкам из RELATION_CHUNK_SIZE книг,
+        поэтому число запросов не зависит от количества книг в пачке:
+        три запроса на пачку вместо трех запросов на каждую книгу.
+        Незапрошенные в projection связи не загружаются.
+        """
+        loaders = projection.relation_loaders()
+        by_id = {}
+        for book_data in books:
+            by_id[book_data['id']] = book_data
+            for key, _, _ in loaders:
+                book_data[key] = []
+
+        book_ids = list(by_id) if loaders else []
+        for start in range(0, len(book_ids), RELATION_CHUNK_SIZE):
+            chunk = book_ids[start:start + RELATION_CHUNK_SIZE]
+
+            for key, serializer, link_model in loaders:
+                # id книги - последний столбец строки, row() его отбрасывает
+                query = (serializer
+                         .select(link_model.book)
+                         .join(link_model)
+                         .where(link_model.book.in_(chunk))
+                         .order_by(link_model.id)
+                         .tuples())
+                for values in query:
+                    by_id[values[-1]][key].append(serializer.row(values))
+
+        return books
+
     @staticmethod
     def create_book(book_data):
         """Создать новую книгу"""
+        error = link_fields_error(book_data)
+        if error:
+            return None, error
         try:
-            with database.atomic():  # Все операции в одной транзакции
+            with write_transaction():  # Все операции в одной транзакции
                 # Проверяем ISBN на уникальность
                 if 'isbn' in book_data and book_data['isbn']:
                     existing_book = Book.select().where(Book.isbn == book_data['isbn']).first()
@@ -180,25 +951,34 @@ class DatabaseManager:
                         return None, "Книга с таким ISBN уже существует"
 
                 # Создаем книгу (убираем поля для связей, так как их нет в модели Book)
-                book_fields = {k: v for k, v in book_data.items() if k in Book._meta.fields}
+                book_fields = {k: v for k, v in book_data.items()
+                               if k in Book._meta.fields and k not in READ_ONLY_FIELDS}
                 book = Book.create(**book_fields)
 
                 # Добавляем авторов (если указаны)
                 if 'author_ids' in book_data:
-                    for author_id in book_data['author_ids']:
+                    author_ids = list(dict.fromkeys(book_data['author_ids']))
+                    for author_id in author_ids:
                         BookAuthor.create(book=book.id, author=author_id)
+                    DatabaseManager.adjust_book_counts({author_id: 1 for author_id in author_ids})
 
                 # Добавляем жанры (если указаны)
                 if 'genre_ids' in book_data:
-                    for genre_id in book_data['genre_ids']:
+                    for genre_id in dict.fromkeys(book_data['genre_ids']):
                         BookGenre.create(book=book.id, genre=genre_id)
 
                 # Добавляем теги (если указаны)
                 if 'tag_ids' in book_data:
-                    for tag_id in book_data['tag_ids']:
+                    for tag_id in dict.fromkeys(book_data['tag_ids']):
                         BookTag.create(book=book.id, tag=tag_id)
 
-                return DatabaseManager.get_book_by_id(book.id), None
+                touch_tables('book')
+                log_changes('book', [book.id])
+                DatabaseManager.reindex_books([book.id])
+                DatabaseManager.refresh_book_documents([book.id])
+
+            forget_counts('books')
+            return DatabaseManager.get_book_by_id(book.id), None
 
         except Exception as e:
             print(f"Ошибка при создании книги: {e}")
@@ -206,9 +986,17 @@ class DatabaseManager:
 
     @staticmethod
     def update_book(book_id, book_data):
-        """Обновить данные книги"""
+        """Обновить данные книги
+
+        Записываются только действительно изменившиеся поля и связи.
+        Возвращает (книга, изменения, ошибка), где изменения - словарь
+        вида {'fields': [...], 'author_ids': {'added': [...], 'removed': [...]}}.
+        """
+        error = link_fields_error(book_data)
+        if error:
+            return None, None, error
         try:
-            with database.atomic():
+            with write_transaction():
                 book = Book.get_by_id(book_id)
 
                 # Проверяем ISBN на уникальность (если он меняется)
@@ -218,55 +1006,108 @@ class DatabaseManager:
                         (Book.id != book_id)
                     ).first()
                     if existing_book:
-                        return None, "Книга с таким ISBN уже существует"
+                        return None, None, "Книга с таким ISBN уже существует"
 
-                # Обновляем поля книги
-                book_fields = {k: v for k, v in book_data.items() if k in Book._meta.fields}
-                for key, value in book_fields.items():
-                    setattr(book, key, value)
-                book.save()
+                changes = {}
 
-                # Обновляем связи (если указаны)
-                if 'author_ids' in book_data:
-                    # Удаляем старых авторов
-                    BookAuthor.delete().where(BookAuthor.book == book_id).execute()
-                    # Добавляем новых
-                    for author_id in book_data['author_ids']:
-                        BookAuthor.create(book=book_id, author=author_id)
+                # Находим действительно изменившиеся поля книги
+                changed_fields = []
+                for key, value in book_data.items():
+                    field = Book._meta.fields.get(key)
+                    if field is None or key in READ_ONLY_FIELDS:
+                        continue
+                    # Приводим значение к тому виду, в котором оно вернется из базы
+                    if field.python_value(field.db_value(value)) != getattr(book, key):
+                        setattr(book, key, value)
+                        changed_fields.append(field)
+                if changed_fields:
+                    changes['fields'] = [field.name for field in changed_fields]
 
-                if 'genre_ids' in book_data:
-                    BookGenre.delete().where(BookGenre.book == book_id).execute()
-                    for genre_id in book_data['genre_ids']:
-                        BookGenre.create(book=book_id, genre=genre_id)
+                # Обновляем связи (если указаны)
+                for key, link_model, fk_name in BOOK_LINKS:
+                    if key not in book_data:
+                        continue
+                    added, removed = DatabaseManager.sync_book_links(
+                        link_model, fk_name, book_id, book_data[key] or [])
+                    if added or removed:
+                        changes[key] = {'added': added, 'removed': removed}
+                    if link_model is BookAuthor:
+                        DatabaseManager.adjust_book_counts(
+                            {**{author_id: 1 for author_id in added},
+                             **{author_id: -1 for author_id in removed}})
 
-                if 'tag_ids' in book_data:
-                    BookTag.delete().where(BookTag.book == book_id).execute()
-                    for tag_id in book_data['tag_ids']:
-                        BookTag.create(book=book_id, tag=tag_id)
+                # Одно UPDATE на изменившиеся поля и новую версию; без изменений книга не записывается
+                if changes:
+                    book.version += 1
+                    book.updated_at = datetime.now()
+                    book.save(only=changed_fields + [Book.version, Book.updated_at])
+                    touch_tables('book')
+                    log_changes('book', [book_id])
+                    DatabaseManager.reindex_books([book_id])
+                    DatabaseManager.refresh_book_documents([book_id])
 
-                return DatabaseManager.get_book_by_id(book_id), None
+            return DatabaseManager.get_book_by_id(book_id), changes, None
 
         except Book.DoesNotExist:
-            return None, "Книга не найден"
+            return None, None, "Книга не найдена"
         except Exception as e:
             print(f"Ошибка при обновлении книги {book_id}: {e}")
-            return None, str(e)
+            return None, None, str(e)
+
+    @staticmethod
+    def sync_book_links(link_model, fk_name, book_id, related_ids):
+        """Привести связи книги в промежуточной таблице к списку related_ids.
+
+        Удаляются только исчезнувшие связи и добавляются только новые,
+        не более одного DELETE и одного INSERT. Возвращает (добавленные, удаленные).
+        """
+        fk_field = link_model._meta.fields[fk_name]
+        existing = set(fk_id for fk_id, in (link_model
+                                            .select(fk_field)
+                                            .where(link_model.book == book_id)
+                                            .tuples()))
+        requested = list(dict.fromkeys(related_ids))
+
+        added = [related_id for related_id in requested if related_id not in existing]
+        removed = sorted(existing.difference(requested))
+
+        if removed:
+            (link_model
+             .delete()
+             .where((link_model.book == book_id) & fk_field.in_(removed))
+             .execute())
+        if added:
+            link_model.insert_many(
+                [{'book': book_id, fk_name: related_id} for related_id in added]).execute()
+
+        return added, removed
 
     @staticmethod
     def delete_book(book_id):
         """Удалить книгу"""
         try:
-            with database.atomic():
+            with write_transaction():
                 book = Book.get_by_id(book_id)
 
-                # Удаляем все связи книги
+                # Удаляем все связи книги (и книгу из счетчиков ее авторов)
+                author_ids = [author_id for author_id, in (BookAuthor
+                                                           .select(BookAuthor.author)
+                                                           .where(BookAuthor.book == book_id)
+                                                           .tuples())]
+                DatabaseManager.adjust_book_counts({author_id: -1 for author_id in author_ids})
                 BookAuthor.delete().where(BookAuthor.book == book_id).execute()
                 BookGenre.delete().where(BookGenre.book == book_id).execute()
                 BookTag.delete().where(BookTag.book == book_id).execute()
 
                 # Удаляем саму книгу
                 book.delete_instance()
-                return True, None
+                touch_tables('book')
+                log_changes('book', [book_id], 'delete')
+                DatabaseManager.reindex_books([book_id])
+                DatabaseManager.refresh_book_documents([book_id])
+
+            forget_counts('books')
+            return True, None
 
         except Book.DoesNotExist:
             return False, "Книга не найдена"
@@ -274,24 +1115,558 @@ class DatabaseManager:
             print(f"Ошибка при удалении книги {book_id}: {e}")
             return False, str(e)
 
+    @staticmethod
+    def bulk_create_books(books_data, upsert=False, batch_size=BULK_BATCH_SIZE):
+        """Массово создать книги (или обновить существующие по ISBN при upsert=True).
+
+        books_data - любой итерируемый набор словарей в формате create_book,
+        он читается пачками по batch_size книг. Для каждой пачки уникальность
+        ISBN и существование авторов, жанров и тегов проверяются одним запросом
+        на каждую таблицу, а книги и их связи вставляются через insert_many в
+        одной транзакции. Книга с ошибкой отклоняется, остальные книги пачки
+        записываются. Каждая пачка передается через write (поток-писатель при
+        group_commit_enabled), а данные читаются в вызывающем потоке.
+        Возвращает результат по каждой книге в порядке входных данных, не
+        перечитывая книги из базы.
+        """
+        results = []
+        seen_isbns = set()
+        items = iter(books_data)
+
+        while True:
+            batch = list(islice(items, batch_size))
+            if not batch:
+                break
+            results.extend(write(DatabaseManager._bulk_create_batch,
+                                 batch, len(results), upsert, seen_isbns))
+
+        if any(result['success'] for result in results):
+            forget_counts('books')
+        return results
+
+    @staticmethod
+    def _bulk_create_batch(batch, offset, upsert, seen_isbns):
+        """Обработать одну пачку bulk_create_books в отдельной транзакции"""
+        results = [None] * len(batch)
+        valid = []
+
+        # Проверяем данные без обращения к базе
+        for position, book_data in enumerate(batch):
+            index = offset + position
+            if not isinstance(book_data, dict):
+                results[position] = {'index': index, 'success': False,
+                                     'error': 'Некорректные данные книги'}
+                continue
+            if not book_data.get('title'):
+                results[position] = {'index': index, 'success': False,
+                                     'error': 'Обязательное поле "title" отсутствует'}
+                continue
+            error = link_fields_error(book_data)
+            if error:
+                results[position] = {'index': index, 'success': False, 'error': error}
+                continue
+            isbn = book_data.get('isbn')
+            if isbn:
+                if isbn in seen_isbns:
+                    results[position] = {'index': index, 'success': False,
+                                         'error': 'ISBN повторяется в загружаемых данных'}
+                    continue
+                seen_isbns.add(isbn)
+            valid.append(position)
+
+        to_create, to_update = [], []
+        try:
+            with write_transaction():
+                # Один запрос на таблицу: книги со ссылками на несуществующие записи отклоняются по одной
+                for key, link_model, fk_name in BOOK_LINKS:
+                    related_model = link_model._meta.fields[fk_name].rel_model
+                    requested = list({related_id for position in valid
+                                      for related_id in batch[position].get(key) or []})
+                    found = set()
+                    for chunk in chunked(requested, RELATION_CHUNK_SIZE):
+                        found.update(related_id for related_id, in (related_model
+                                                                    .select(related_model.id)
+                                                                    .where(related_model.id.in_(chunk))
+                                                                    .tuples()))
+                    for position in list(valid):
+                        missing = [related_id for related_id in dict.fromkeys(batch[position].get(key) or [])
+                                   if related_id not in found]
+                        if missing:
+                            valid.remove(position)
+                            seen_isbns.discard(batch[position].get('isbn'))
+                            results[position] = {'index': offset + position, 'success': False,
+                                                 'error': f'Не найдены id в "{key}": '
+                                                          f'{", ".join(map(str, missing))}'}
+
+                # Один запрос на проверку уникальности всех ISBN пачки
+                isbns = [batch[position]['isbn'] for position in valid if batch[position].get('isbn')]
+                existing = {}
+                if isbns:
+                    query = Book.select(Book.id, Book.isbn).where(Book.isbn.in_(isbns)).tuples()
+                    existing = {isbn: book_id for book_id, isbn in query}
+
+                for position in valid:
+                    book_id = existing.get(batch[position].get('isbn'))
+                    if book_id is None:
+                        to_create.append(position)
+                    elif upsert:
+                        to_update.append((position, book_id))
+                    else:
+                        results[position] = {'index': offset + position, 'success': False,
+                                             'error': 'Книга с таким ISBN уже существует'}
+
+                book_ids = {}
+                fields = [field for field in Book._meta.sorted_fields if field.name != 'id']
+
+                # insert_many требует одинаковый набор полей во всех строках
+                rows = []
+                for position in to_create:
+                    book_data = batch[position]
+                    row = {}
+                    for field in fields:
+                        if field.name in book_data and field.name not in READ_ONLY_FIELDS:
+                            row[field.name] = book_data[field.name]
+                        elif callable(field.default):
+                            row[field.name] = field.default()
+                        else:
+                            row[field.name] = field.default
+                    rows.append(row)
+
+                if supports_returning():
+                    created_ids = []
+                    for chunk in chunked(rows, INSERT_CHUNK_SIZE):
+                        query = Book.insert_many(chunk).returning(Book.id).tuples()
+                        created_ids.extend(book_id for book_id, in query.execute())
+                else:
+                    created_ids = [Book.insert(row).execute() for row in rows]
+                for position, book_id in zip(to_create, created_ids):
+                    book_ids[position] = book_id
+
+                for position, book_id in to_update:
+                    book_fields = {k: v for k, v in batch[position].items()
+                                   if k in Book._meta.fields and k not in READ_ONLY_FIELDS}
+                    book_fields['version'] = Book.version + 1
+                    book_fields['updated_at'] = datetime.now()
+                    Book.update(**book_fields).where(Book.id == book_id).execute()
+                    book_ids[position] = book_id
+
+                # Связи обновляемых книг заменяются целиком, если переданы
+                book_counts = {}
+                for key, link_model, fk_name in BOOK_LINKS:
+                    replaced = [book_id for position, book_id in to_update
+                                if key in batch[position]]
+                    for chunk in chunked(replaced, RELATION_CHUNK_SIZE):
+                        if link_model is BookAuthor:
+                            for author_id, in (BookAuthor
+                                               .select(BookAuthor.author)
+                                               .where(BookAuthor.book.in_(chunk))
+                                               .tuples()):
+                                book_counts[author_id] = book_counts.get(author_id, 0) - 1
+                        link_model.delete().where(link_model.book.in_(chunk)).execute()
+
+                    links = [{'book': book_ids[position], fk_name: related_id}
+                             for position in sorted(book_ids)
+                             for related_id in dict.fromkeys(batch[position].get(key) or [])]
+                    for chunk in chunked(links, INSERT_CHUNK_SIZE):
+                        link_model.insert_many(chunk).execute()
+                    if link_model is BookAuthor:
+                        for link in links:
+                            book_counts[link['author']] = book_counts.get(link['author'], 0) + 1
+                DatabaseManager.adjust_book_counts(book_counts)
+
+                if book_ids:
+                    touch_tables('book')
+                log_changes('book', list(book_ids.values()))
+                DatabaseManager.reindex_books(list(book_ids.values()))
+                DatabaseManager.refresh_book_documents(list(book_ids.values()))
+
+        except Exception as e:
+            print(f"Ошибка при массовом создании книг: {e}")
+            for position in valid:
+                if results[position] is None:
+                    results[position] = {'index': offset + position, 'success': False,
+                                         'error': str(e)}
+                    # Пачка откачена: ISBN ее книг не заняты, и их можно загрузить дальше в запросе
+                    seen_isbns.discard(batch[position].get('isbn'))
+            return results
+
+        for position in to_create:
+            results[position] = {'index': offset + position, 'success': True,
+                                 'id': book_ids[position], 'action': 'created'}
+        for position, book_id in to_update:
+            results[position] = {'index': offset + position, 'success': True,
+                                 'id': book_id, 'action': 'updated'}
+        return results
+
+    # ===== Пакетные операции =====
+
+    @staticmethod
+    def execute_batch(operations, atomic=False):
+        """Выполнить операции записи одной транзакцией, вернуть результат каждой в порядке запроса.
+
+        Операция - словарь {"op": "create" | "update" | "delete", "type": "book" | "author",
+        "id": ..., "data": {...}}. Каждая операция выполняется в своей точке
+        сохранения (SAVEPOINT): неудачная откатывается, остальные сохраняются.
+        С atomic=True первая же ошибка отменяет весь пакет, а следующие
+        операции не выполняются.
+        """
+        results = []
+        failed = False
+        with write_transaction() as transaction:
+            for index, operation in enumerate(operations):
+                if failed and atomic:
+                    results.append({'index': index, 'success': False, 'status': 424,
+                                    'error': 'Не выполнено: пакет отменен из-за ошибки'})
+                    continue
+                result = DatabaseManager._batch_operation(operation)
+                result['index'] = index
+                results.append(result)
+                failed = failed or not result['success']
+
+            if failed and atomic:
+                # Откаченные операции успели закэшировать книги и авторов, которых не будет
+                # в базе (а id созданных записей SQLite может выдать снова): эти ключи
+                # write_transaction сбросит сам, а счетчики сбрасываются здесь
+                forget_counts('books')
+                forget_counts('authors')
+                transaction.rollback()
+                for result in results:
+                    if result['success']:
+                        result.update(success=False, status=409, error='Отменено: пакет не выполнен целиком')
+                        result.pop('data', None)
+
+        return results
+
+    @staticmethod
+    def _batch_operation(operation):
+        """Одна операция пакета: словарь с success, status и data или error"""
+        if not isinstance(operation, dict):
+            return {'success': False, 'status': 400, 'error': 'Операция должна быть объектом'}
+        op, kind = operation.get('op'), operation.get('type')
+        object_id, data = operation.get('id'), operation.get('data')
+        if kind not in ('book', 'author') or op not in ('create', 'update', 'delete'):
+            return {'success': False, 'status': 400,
+                    'error': 'Ожидается op: create, update или delete и type: book или author'}
+        if op != 'create' and not isinstance(object_id, int):
+            return {'success': False, 'status': 400, 'error': 'Для update и delete нужен целочисленный "id"'}
+        if op != 'delete' and (not isinstance(data, dict) or not data):
+            return {'success': False, 'status': 400, 'error': 'Данные операции "data" отсутствуют'}
+        required = 'title' if kind == 'book' else 'name'
+        if op == 'create' and required not in data:
+            return {'success': False, 'status': 400, 'error': f'Обязательное поле "{required}" отсутствует'}
+
+        not_found = 'Книга не найдена' if kind == 'book' else 'Автор не найден'
+        if op == 'create':
+            create = DatabaseManager.create_book if kind == 'book' else DatabaseManager.create_author
+            result, error = create(data)
+            status = 201
+        elif op == 'update' and kind == 'book':
+            result, _, error = DatabaseManager.update_book(object_id, data)
+            status = 200
+        elif op == 'update':
+            result, error = DatabaseManager.update_author(object_id, data)
+            status = 200
+        else:
+            delete = DatabaseManager.delete_book if kind == 'book' else DatabaseManager.delete_author
+            result, error = delete(object_id)
+            status = 200
+
+        if error:
+            return {'success': False, 'status': 404 if error == not_found else 400, 'error': error}
+        response = {'success': True, 'status': status}
+        if op != 'delete':
+            response['data'] = result
+        return response
+
+    # ===== Журнал изменений =====
+
+    @staticmethod
+    def get_changes(since, limit):
+        """Изменения после позиции журнала since: (изменения, позиция последней прочитанной записи, есть ли еще).
+
+        Изменение - словарь {seq, type, id, op, data}: для upsert в data текущее
+        состояние объекта, для delete (tombstone) data нет. Из нескольких записей
+        об одном объекте на странице возвращается только последняя, а объект,
+        удаленный после записи upsert, сразу возвращается как delete.
+        """
+        rows = list(ChangeLog
+                    .select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+                    .where(ChangeLog.seq > since)
+                    .order_by(ChangeLog.seq)
+                    .limit(limit + 1)
+                    .tuples())
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        latest = {(entity, entity_id): seq for seq, entity, entity_id, _ in rows}
+        upserts = {}
+        for seq, entity, entity_id, op in rows:
+            if op == 'upsert' and latest[(entity, entity_id)] == seq:
+                upserts.setdefault(entity, []).append(entity_id)
+
+        loaders = {
+            'book': lambda ids: DatabaseManager.get_books_by_ids(ids)[0],
+            'author': lambda ids: DatabaseManager.get_authors_by_ids(ids)[0],
+            'genre': lambda ids: [genre for genre in DatabaseManager.get_all_genres() if genre['id'] in ids],
+            'tag': lambda ids: [tag for tag in DatabaseManager.get_all_tags() if tag['id'] in ids],
+        }
+        current = {}
+        for entity, entity_ids in upserts.items():
+            for item in loaders[entity](set(entity_ids)):
+                current[(entity, item['id'])] = item
+
+        changes = []
+        for seq, entity, entity_id, op in rows:
+            if latest[(entity, entity_id)] != seq:
+                continue
+            change = {'seq': seq, 'type': entity, 'id': entity_id, 'op': op}
+            data = current.get((entity, entity_id))
+            if op == 'upsert' and data is None:
+                change['op'] = 'delete'
+            elif op == 'upsert':
+                change['data'] = data
+            changes.append(change)
+
+        return changes, rows[-1][0] if rows else since, has_more
+
+    @staticmethod
+    def get_changes_horizon():
+        """Позиция журнала, до которой записи об удалении уже удалены сжатием (0 - не удалялись)"""
+        return get_table_versions(CHANGES_PURGED)[CHANGES_PURGED][0]
+
+    @staticmethod
+    def compact_changes(after=0, purge_tombstones=False):
+        """Сжать журнал изменений: удалить записи, замененные более поздними записями о том же объекте.
+
+        after > 0 - сжимать только объекты, менявшиеся после этой позиции
+        (инкрементальное сжатие из log_changes). С purge_tombstones удаляются
+        и записи об удалении старше changes_tombstone_days дней; позиция
+        последней из них сохраняется, и клиенты, отставшие сильнее, должны
+        синхронизироваться заново. Вызывается в транзакции; возвращает число удаленных записей.
+        """
+        head = ChangeLog.select(fn.MAX(ChangeLog.seq)).scalar() or 0
+        newer = ChangeLog.alias()
+        latest = (newer
+                  .select(fn.MAX(newer.seq))
+                  .where((newer.entity == ChangeLog.entity) & (newer.entity_id == ChangeLog.entity_id)))
+        query = ChangeLog.delete().where(ChangeLog.seq < latest)
+        if after:
+            recent = ChangeLog.select(ChangeLog.entity, ChangeLog.entity_id).where(ChangeLog.seq > after)
+            query = query.where(Tuple(ChangeLog.entity, ChangeLog.entity_id).in_(recent))
+        removed = query.execute()
+
+        if purge_tombstones and config['changes_tombstone_days']:
+            horizon = datetime.now() - timedelta(days=config['changes_tombstone_days'])
+            # Последняя запись журнала не удаляется: по ней продолжается нумерация
+            expired = ((ChangeLog.op == 'delete') & (ChangeLog.changed_at < horizon) &
+                       (ChangeLog.seq < head))
+            purged = ChangeLog.select(fn.MAX(ChangeLog.seq)).where(expired).scalar()
+            if purged:
+                removed += ChangeLog.delete().where(expired).execute()
+                (TableVersion
+                 .insert(table_name=CHANGES_PURGED, version=purged, updated_at=datetime.now())
+                 .on_conflict(conflict_target=[TableVersion.table_name],
+                              update={TableVersion.version: purged,
+                                      TableVersion.updated_at: datetime.now()})
+                 .execute())
+
+        _changes_state['compacted'] = max(_changes_state['compacted'], head)
+        return removed
+
+    # ===== Документы книг =====
+
+    @staticmethod
+    def refresh_book_documents(book_ids):
+        """Пересобрать документы книг book_ids.
+
+        Вызывается методами записи внутри их транзакций, поэтому документ
+        меняется вместе с книгой. Старые документы удаляются всегда (в том
+        числе при выключенной настройке - чтобы не остались документы удаленных
+        книг), а новые собираются, только если book_documents_enabled.
+        """
+        if not book_ids:
+            return
+
+        for chunk in chunked(list(dict.fromkeys(book_ids)), RELATION_CHUNK_SIZE):
+            BookDocument.delete().where(BookDocument.id.in_(chunk)).execute()
+            if not documents_enabled():
+                continue
+            books = BOOK_SERIALIZER.rows(BOOK_SERIALIZER.select().where(Book.id.in_(chunk)))
+            DatabaseManager.attach_relations(books)
+            rows = [{'id': book_data['id'], 'version': book_data['version'],
+                     'data': dumps_document(book_data)} for book_data in books]
+            for rows_chunk in chunked(rows, INSERT_CHUNK_SIZE):
+                BookDocument.insert_many(rows_chunk).execute()
+
+    @staticmethod
+    def refresh_stale_book_documents():
+        """Собрать документы книг, у которых их нет или они устарели (например, после включения настройки).
+
+        Возвращает число пересобранных документов.
+        """
+        if not documents_enabled():
+            return 0
+        refreshed = 0
+        last_id = 0
+        while True:
+            book_ids = [book_id for book_id, _ in (with_documents(Book.select(Book.id))
+                                                 .where(Book.id > last_id, BookDocument.data.is_null())
+                                                 .order_by(Book.id)
+                                                 .limit(RELATION_CHUNK_SIZE)
+                                                 .tuples())]
+            if not book_ids:
+                return refreshed
+            with write_transaction():
+                DatabaseManager.refresh_book_documents(book_ids)
+            refreshed += len(book_ids)
+            last_id = book_ids[-1]
+
+    @staticmethod
+    def get_book_json(book_id):
+        """JSON-текст актуального документа книги или None (документов нет, книги нет, документ устарел)"""
+        if not documents_enabled():
+            return None
+        document = (BookDocument
+                    .select(BookDocument.data)
+                    .join(Book, on=(Book.id == BookDocument.id) & (Book.version == BookDocument.version))
+                    .where(BookDocument.id == book_id)
+                    .tuples()
+                    .first())
+        return document[0] if document else None
+
+    # ===== Полнотекстовый поиск =====
+
+    @staticmethod
+    def reindex_books(book_ids):
+        """Обновить записи полнотекстового индекса для книг book_ids.
+
+        Книги, которых больше нет в базе, удаляются из индекса.
+        Вызывается из методов записи внутри их транзакций.
+        """
+        if not search_enabled() or not book_ids:
+            return
+
+        for chunk in chunked(list(dict.fromkeys(book_ids)), RELATION_CHUNK_SIZE):
+            documents = {}
+            for book_id, title, description in (Book
+                                                 .select(Book.id, Book.title, Book.description)
+                                                 .where(Book.id.in_(chunk))
+                                                 .tuples()):
+                documents[book_id] = {'rowid': book_id, 'title': normalize_search_text(title),
+                                      'description': normalize_search_text(description or ''),
+                                      'authors': [], 'tags': []}
+
+            for key, name_field, link_model in (('authors', Author.name, BookAuthor),
+                                                ('tags', Tag.name, BookTag)):
+                query = (link_model
+                         .select(link_model.book, name_field)
+                         .join(name_field.model)
+                         .where(link_model.book.in_(chunk))
+                         .tuples())
+                for book_id, name in query:
+                    documents[book_id][key].append(normalize_search_text(name))
+
+            BookSearch.delete().where(BookSearch.rowid.in_(chunk)).execute()
+            rows = []
+            for document in documents.values():
+                document['authors'] = ' '.join(document['authors'])
+                document['tags'] = ' '.join(document['tags'])
+                rows.append(document)
+            for rows_chunk in chunked(rows, INSERT_CHUNK_SIZE):
+                BookSearch.insert_many(rows_chunk).execute()
+
+    @staticmethod
+    def search_books(text, limit, offset=0):
+        """Найти книги по названию, описанию, авторам и тегам.
+
+        Каждое слово запроса ищется как префикс, результаты упорядочены
+        по релевантности BM25; "ё" и "е" не различаются. Возвращает (книги,
+        есть ли следующая страница).
+        """
+        words = re.findall(r'\w+', normalize_search_text(text))
+        if not words:
+            return [], False
+        match = ' '.join(f'"{word}"*' for word in words)
+
+        rank = BookSearch.bm25(*SEARCH_WEIGHTS)
+        rows = list(BookSearch
+                    .select(BookSearch.rowid, rank)
+                    .where(BookSearch.match(match))
+                    .order_by(rank)
+                    .limit(limit + 1)
+                    .offset(offset)
+                    .tuples())
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        books = {}
+        if rows:
+            query = BOOK_SERIALIZER.select().where(Book.id.in_([book_id for book_id, _ in rows]))
+            books = {book['id']: book for book in BOOK_SERIALIZER.rows(query)}
+
+        result = []
+        for book_id, score in rows:
+            if book_id in books:
+                # bm25 в SQLite отрицательный: чем меньше, тем релевантнее
+                books[book_id]['score'] = -score
+                result.append(books[book_id])
+
+        DatabaseManager.attach_relations(result)
+        return result, has_more
+
+    # ===== Версии данных (для ETag и Last-Modified) =====
+
+    @staticmethod
+    def get_table_versions(*tables):
+        """Счетчики изменений таблиц: {таблица: (версия, время изменения)}"""
+        return get_table_versions(*tables)
+
+    @staticmethod
+    def get_book_version(book_id):
+        """(версия, время изменения) книги или None, если книги нет"""
+        return (Book
+                .select(Book.version, Book.updated_at)
+                .where(Book.id == book_id)
+                .tuples()
+                .first())
+
+    @staticmethod
+    def get_author_version(author_id):
+        """(версия, время изменения, количество книг) автора или None, если автора нет"""
+        return (Author
+                .select(Author.version, Author.updated_at, Author.book_count)
+                .where(Author.id == author_id)
+                .tuples()
+                .first())
+
     # ===== Вспомогательные методы =====
 
     @staticmethod
     def get_all_genres():
-        """Получить все жанры"""
+        """Получить все жанры (через кэш чтения, ключ - по счетчику изменений таблицы)"""
         try:
-            genres = Genre.select().order_by(Genre.name)
-            return [model_to_dict(genre) for genre in genres]
+            cache = get_cache()
+            key = f"genres:{get_table_versions('genre')['genre'][0]}"
+            genres = cache.get(key)
+            if genres is None:
+                genres = GENRE_SERIALIZER.rows(GENRE_SERIALIZER.select().order_by(Genre.name))
+                cache.set(key, genres)
+            return genres
         except Exception as e:
             print(f"Ошибка при получении жанров: {e}")
             return []
 
     @staticmethod
     def get_all_tags():
-        """Получить все теги"""
+        """Получить все теги (через кэш чтения, ключ - по счетчику изменений таблицы)"""
         try:
-            tags = Tag.select().order_by(Tag.name)
-            return [model_to_dict(tag) for tag in tags]
+            cache = get_cache()
+            key = f"tags:{get_table_versions('tag')['tag'][0]}"
+            tags = cache.get(key)
+            if tags is None:
+                tags = TAG_SERIALIZER.rows(TAG_SERIALIZER.select().order_by(Tag.name))
+                cache.set(key, tags)
+            return tags
         except Exception as e:
             print(f"Ошибка при получении тегов: {e}")
             return []
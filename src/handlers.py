@@ -1,15 +1,381 @@
-from flask import jsonify, request
-from src.database import DatabaseManager
+import json
+import threading
+import time
+from datetime import timezone
+from functools import wraps
+from flask import Response, current_app, jsonify, make_response, request, stream_with_context
+from src.cache import get_cache
+from src.compression import ENCODINGS, choose_encoding, compress, encoded_etag, set_encoding
+from src.config import config
+from src.database import (AUTHOR_RANGE_FILTERS, AUTHOR_SORTS, BOOK_FACETS, BOOK_LINK_FILTERS,
+                          BOOK_RANGE_FILTERS, MAX_BATCH_OPERATIONS, MAX_MULTI_GET_IDS, BookProjection,
+                          DatabaseManager)
+from src.models import database, documents_enabled, search_enabled
+from src.profiling import endpoint_stats, reset_stats
+from src.writer import commit_count, wait_for_commit, write
+
+# Размер страницы по умолчанию и максимальный размер страницы
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Сколько записей сериализовать перед отправкой очередного фрагмента потокового ответа
+STREAM_FLUSH_SIZE = 100
+
+# Журнал изменений: размер страницы по умолчанию, максимальное ожидание long-poll (секунды),
+# как часто перечитывать журнал без сигнала о записи (записи других процессов) и как часто
+# слать комментарий в пустой поток SSE (секунды), через сколько миллисекунд EventSource
+# переподключается и через сколько секунд повторить запрос, если ожидающих слишком много
+DEFAULT_CHANGES_LIMIT = 100
+MAX_CHANGES_WAIT = 30
+CHANGES_CHECK_INTERVAL = 2
+SSE_KEEPALIVE = 15
+SSE_RETRY_MS = 1000
+CHANGES_RETRY_AFTER = 5
+
+# Сколько запросов сейчас ждут изменений в журнале (см. changes_max_waiters)
+_changes_waiters = {'count': 0}
+_changes_waiters_lock = threading.Lock()
+
+
+def get_page_args():
+    """Разобрать параметры постраничного вывода limit и cursor.
+
+    Возвращает (limit, cursor, error). Если ни один из параметров не передан,
+    limit равен None - клиент запросил список целиком.
+    """
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return None, None, None
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None, None, 'Параметр "limit" должен быть целым числом'
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return None, None, f'Параметр "limit" должен быть от 1 до {MAX_PAGE_SIZE}'
+
+    return limit, request.args.get('cursor') or None, None
+
+
+def get_stream_format():
+    """Определить потоковый режим ответа: 'ndjson', 'json' или None.
+
+    NDJSON включается заголовком Accept: application/x-ndjson или
+    параметром ?stream=ndjson, потоковый JSON-массив - параметром ?stream=1.
+    """
+    stream = request.args.get('stream', '').lower()
+    if stream == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        return 'ndjson'
+    if stream in ('1', 'true', 'yes', 'json'):
+        return 'json'
+    return None
+
+
+def stream_items(items, stream_format, serialized=False):
+    """Потоковый ответ из итератора словарей (или готовых JSON-строк при serialized=True).
+
+    Записи сериализуются по одной и отправляются фрагментами, поэтому
+    память сервера не зависит от размера выборки.
+    """
+    dumps = (lambda item: item) if serialized else current_app.json.dumps
+
+    def generate():
+        if stream_format == 'json':
+            yield '{"success": true, "data": ['
+        buffer = []
+        first = True
+        for item in items:
+            if stream_format == 'ndjson':
+                buffer.append(dumps(item) + '\n')
+            else:
+                buffer.append(('' if first else ',') + dumps(item))
+                first = False
+            if len(buffer) >= STREAM_FLUSH_SIZE:
+                yield ''.join(buffer)
+                buffer = []
+        if buffer:
+            yield ''.join(buffer)
+        if stream_format == 'json':
+            yield ']}'
+
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def document_response(document):
+    """Ответ с книгой из готового JSON-текста документа, без разбора и повторной сериализации"""
+    return Response('{"data":' + document + ',"success":true}\n', mimetype='application/json')
+
+
+def iter_ndjson(stream):
+    """Читать объекты из тела запроса в формате NDJSON по одной строке.
+
+    Некорректная строка превращается в None - она будет отклонена при
+    проверке как отдельная запись, не прерывая остальную загрузку.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def get_book_filters():
+    """Разобрать фильтры списка книг из параметров запроса.
+
+    author_id, genre_id, tag_id принимают один id или несколько через запятую,
+    year_from/year_to и pages_from/pages_to - границы диапазонов включительно.
+    Возвращает (filters, error).
+    """
+    filters = {}
+    try:
+        for name in BOOK_LINK_FILTERS:
+            if request.args.get(name):
+                filters[name] = [int(value) for value in request.args[name].split(',')]
+        for name in BOOK_RANGE_FILTERS:
+            if request.args.get(name):
+                filters[name] = int(request.args[name])
+    except ValueError:
+        return None, f'Параметр "{name}" должен быть целым числом или списком чисел через запятую'
+    return filters, None
+
+
+def get_author_filters():
+    """Разобрать фильтры и сортировку списка авторов: min_books, max_books и sort.
+
+    Возвращает (filters, sort, error).
+    """
+    sort = request.args.get('sort') or 'name'
+    if sort not in AUTHOR_SORTS:
+        return None, None, f'Параметр "sort" должен быть одним из: {", ".join(AUTHOR_SORTS)}'
+    filters = {}
+    for name in AUTHOR_RANGE_FILTERS:
+        if request.args.get(name):
+            try:
+                filters[name] = int(request.args[name])
+            except ValueError:
+                return None, None, f'Параметр "{name}" должен быть целым числом'
+    return filters, sort, None
+
+
+def parse_ids(value, name='ids'):
+    """Список id из строки через запятую или JSON-массива. Возвращает (ids, error)"""
+    if isinstance(value, str):
+        value = [item for item in value.split(',') if item.strip()]
+    if not isinstance(value, list):
+        return None, f'Параметр "{name}" должен быть списком id'
+    try:
+        ids = [int(item) for item in value]
+    except (TypeError, ValueError):
+        return None, f'Параметр "{name}" должен содержать целые числа'
+    if len(ids) > MAX_MULTI_GET_IDS:
+        return None, f'Не больше {MAX_MULTI_GET_IDS} id в одном запросе'
+    return ids, None
+
+
+def get_book_projection():
+    """Разобрать ?fields= и ?include= в BookProjection. Возвращает (projection, error)"""
+    try:
+        return BookProjection.parse(request.args.get('fields'), request.args.get('include')), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def get_facets():
+    """Список запрошенных фасетов: ?facets=genre,tag (или ?facets=1 - все)"""
+    value = request.args.get('facets', '').lower()
+    if not value:
+        return ()
+    if value in ('1', 'true', 'yes', 'all'):
+        return BOOK_FACETS
+    return tuple(facet for facet in value.split(',') if facet in BOOK_FACETS)
+
+
+def http_time(value):
+    """Время из базы (локальное, без часового пояса) в UTC с точностью до секунды, как в HTTP-заголовках"""
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def precompressed_response(handler, args, kwargs, etag, encoding):
+    """Ответ обработчика, сжатый заранее и сохраненный в кэше по ETag.
+
+    Ключ включает ETag, поэтому после изменения данных сжатое тело
+    вычисляется заново, а старое вытесняется из кэша по времени жизни.
+    Возвращает (response, compressed_body или None).
+    """
+    cache = get_cache()
+    key = f'response:{etag}:{encoding}:{request.full_path}'
+    body = cache.get(key)
+    if body is not None:
+        return current_app.response_class(body, mimetype='application/json'), body
+
+    response = make_response(handler(*args, **kwargs))
+    if response.status_code != 200:
+        return response, None
+    data = response.get_data()
+    if len(data) < config['compression_min_size']:
+        return response, None
+    body = compress(data, encoding, precomputed=True)
+    cache.set(key, body)
+    return response, body
+
+
+def conditional(validators, precompressed=False, vary=()):
+    """Декоратор GET-обработчика с поддержкой If-None-Match и If-Modified-Since.
+
+    validators(*args) возвращает (etag, last_modified) по счетчикам версий,
+    не выполняя основной запрос. Если у клиента актуальная версия, отвечаем
+    304 без вызова обработчика, иначе добавляем ETag и Last-Modified к ответу.
+
+    Сжатый ответ получает ETag с суффиксом кодировки (books-3-gzip), и
+    If-None-Match принимает любой из вариантов одной версии. С precompressed=True
+    сжатое тело кэшируется, и повторные запросы не сжимают его заново.
+    Заголовки запроса, от которых зависит ответ, перечисляются в vary.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = validators(*args, **kwargs)
+            if etag is None:
+                return handler(*args, **kwargs)
+            last_modified = http_time(last_modified) if last_modified else None
+
+            matched = None
+            if request.if_none_match:
+                matched = next((tag for tag in [etag] + [encoded_etag(etag, encoding) for encoding in ENCODINGS]
+                                if request.if_none_match.contains(tag)), None)
+                fresh = matched is not None
+            else:
+                fresh = bool(last_modified and request.if_modified_since
+                             and last_modified <= request.if_modified_since)
+
+            encoding = choose_encoding(request.accept_encodings)
+            body = None
+            if fresh:
+                response = Response(status=304)
+            elif precompressed and encoding:
+                response, body = precompressed_response(handler, args, kwargs, etag, encoding)
+                if response.status_code != 200:
+                    return response
+            else:
+                response = make_response(handler(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(matched or etag)
+            if last_modified:
+                response.last_modified = last_modified
+            if body is not None:
+                set_encoding(response, body, encoding)
+            if config['compression_enabled']:
+                response.vary.add('Accept-Encoding')
+            for header in vary:
+                response.vary.add(header)
+            return response
+        return wrapper
+    return decorator
+
+
+def table_validators(name, *tables, streamed=False):
+    """ETag списка по счетчикам изменений таблиц, из которых он собирается.
+
+    Для списка с потоковыми форматами (streamed=True) формат ответа тоже
+    входит в ETag (books-ndjson-3-...): у NDJSON, потокового и обычного
+    JSON одного URL разные тела.
+    """
+    def validators(*args, **kwargs):
+        versions = DatabaseManager.get_table_versions(*tables)
+        stream_format = get_stream_format() if streamed else None
+        prefix = [name, stream_format] if stream_format else [name]
+        etag = '-'.join(prefix + [str(versions[table][0]) for table in tables])
+        last_modified = max((updated_at for _, updated_at in versions.values() if updated_at),
+                            default=None)
+        return etag, last_modified
+    return validators
+
+
+def book_validators(book_id):
+    version = DatabaseManager.get_book_version(book_id)
+    return (f'book-{book_id}-{version[0]}', version[1]) if version else (None, None)
+
+
+def author_validators(author_id):
+    # book_count меняется без новой версии автора, поэтому входит в ETag отдельно
+    version = DatabaseManager.get_author_version(author_id)
+    return (f'author-{author_id}-{version[0]}-{version[2]}', version[1]) if version else (None, None)
+
+
+def author_books_validators(author_id):
+    """ETag книг автора - по счетчикам таблиц, из которых собираются книги"""
+    return table_validators(f'author-{author_id}-books', 'book', 'author', 'genre', 'tag')()
+
+
+def is_flag_set(name):
+    """Включен ли булев параметр запроса (?name=1)"""
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def wants_total():
+    """Нужно ли добавить в ответ общее количество записей (?with_total=1)"""
+    return is_flag_set('with_total')
 
 
 class AuthorHandlers:
     """Обработчики запросов для авторов"""
 
     @staticmethod
+    @conditional(table_validators('authors', 'author'), precompressed=True)
     def get_authors():
-        """GET /api/authors - Получить всех авторов"""
+        """GET /api/authors - Получить всех авторов (или страницу: ?limit=&cursor=, или несколько: ?ids=1,2,3)
+
+        ?sort=name|book_count|-book_count - порядок, ?min_books= и ?max_books= - фильтр по числу книг.
+        """
         try:
-            authors = DatabaseManager.get_all_authors()
+            if 'ids' in request.args:
+                ids, error = parse_ids(request.args['ids'])
+                if error:
+                    return jsonify({
+                        'success': False,
+                        'error': error
+                    }), 400
+                authors, missing = DatabaseManager.get_authors_by_ids(ids)
+                return jsonify({
+                    'success': True,
+                    'data': authors,
+                    'count': len(authors),
+                    'missing': missing
+                }), 200
+
+            filters, sort, error = get_author_filters()
+            if not error:
+                limit, cursor, error = get_page_args()
+            if error:
+                return jsonify({
+                    'success': False,
+                    'error': error
+                }), 400
+
+            if limit:
+                try:
+                    authors, next_cursor = DatabaseManager.get_authors_page(limit, cursor, filters, sort)
+                except ValueError as e:
+                    return jsonify({
+                        'success': False,
+                        'error': str(e)
+                    }), 400
+
+                response = {
+                    'success': True,
+                    'data': authors,
+                    'count': len(authors),
+                    'next_cursor': next_cursor
+                }
+                if wants_total():
+                    response['total'] = DatabaseManager.count_authors(filters)
+                return jsonify(response), 200
+
+            authors = DatabaseManager.get_all_authors(filters, sort)
             return jsonify({
                 'success': True,
                 'data': authors,
@@ -22,6 +388,7 @@ class AuthorHandlers:
             }), 500
 
     @staticmethod
+    @conditional(author_validators)
     def get_author(author_id):
         """GET /api/authors/<id> - Получить автора по ID"""
         try:
@@ -42,6 +409,47 @@ class AuthorHandlers:
                 'error': f'Ошибка сервера: {str(e)}'
             }), 500
 
+    @staticmethod
+    @conditional(author_books_validators)
+    def get_author_books(author_id):
+        """GET /api/authors/<id>/books - Книги автора постранично (?limit=&cursor=, ?fields= и ?include=)"""
+        try:
+            projection, error = get_book_projection()
+            if not error:
+                limit, cursor, error = get_page_args()
+            if error:
+                return jsonify({
+                    'success': False,
+                    'error': error
+                }), 400
+
+            try:
+                author, books, next_cursor = DatabaseManager.get_author_books(
+                    author_id, limit or DEFAULT_PAGE_SIZE, cursor, projection)
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            if author is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Автор не найден'
+                }), 404
+
+            return jsonify({
+                'success': True,
+                'data': books,
+                'count': len(books),
+                'total': author['book_count'],
+                'next_cursor': next_cursor
+            }), 200
+        except Exception as e:
+            return jsonify({
+                'success': False,
+                'error': f'Ошибка сервера: {str(e)}'
+            }), 500
+
     @staticmethod
     def create_author():
         """POST /api/authors - Создать нового автора"""
@@ -57,7 +465,7 @@ class AuthorHandlers:
                 }), 400
 
             # Создаем автора
-            author, error = DatabaseManager.create_author(data)
+            author, error = write(DatabaseManager.create_author, data)
 
             if author:
                 return jsonify({
@@ -89,7 +497,7 @@ class AuthorHandlers:
                     'error': 'Данные для обновления отсутствуют'
                 }), 400
 
-            author, error = DatabaseManager.update_author(author_id, data)
+            author, error = write(DatabaseManager.update_author, author_id, data)
 
             if author:
                 return jsonify({
@@ -113,7 +521,7 @@ class AuthorHandlers:
     def delete_author(author_id):
         """DELETE /api/authors/<id> - Удалить автора"""
         try:
-            success, error = DatabaseManager.delete_author(author_id)
+            success, error = write(DatabaseManager.delete_author, author_id)
 
             if success:
                 return jsonify({
@@ -137,15 +545,83 @@ class BookHandlers:
     """Обработчики запросов для книг"""
 
     @staticmethod
+    @conditional(table_validators('books', 'book', 'author', 'genre', 'tag', streamed=True), vary=('Accept',))
     def get_books():
-        """GET /api/books - Получить все книги"""
+        """GET /api/books - Получить все книги (или страницу: ?limit=&cursor=)
+
+        ?fields=id,title,authors.name и ?include=authors,genres,tags сужают ответ.
+        ?ids=1,2,3 - книги по списку id в том же порядке (ненайденные - в "missing").
+        Фильтры: author_id, genre_id, tag_id, year_from, year_to, pages_from, pages_to.
+        ?facets=genre,tag,author,year добавляет в ответ количество книг по фасетам.
+        """
         try:
-            books = DatabaseManager.get_all_books()
-            return jsonify({
-                'success': True,
-                'data': books,
-                'count': len(books)
-            }), 200
+            filters, error = get_book_filters()
+            if not error:
+                projection, error = get_book_projection()
+            if error:
+                return jsonify({
+                    'success': False,
+                    'error': error
+                }), 400
+
+            if 'ids' in request.args:
+                ids, error = parse_ids(request.args['ids'])
+                if error:
+                    return jsonify({
+                        'success': False,
+                        'error': error
+                    }), 400
+                books, missing = DatabaseManager.get_books_by_ids(ids, projection)
+                return jsonify({
+                    'success': True,
+                    'data': books,
+                    'count': len(books),
+                    'missing': missing
+                }), 200
+
+            stream_format = get_stream_format()
+            if stream_format and projection.is_full and documents_enabled():
+                return stream_items(DatabaseManager.iter_books_json(filters), stream_format, serialized=True)
+            if stream_format:
+                return stream_items(DatabaseManager.iter_books(filters, projection), stream_format)
+
+            limit, cursor, error = get_page_args()
+            if error:
+                return jsonify({
+                    'success': False,
+                    'error': error
+                }), 400
+
+            if limit:
+                try:
+                    books, next_cursor = DatabaseManager.get_books_page(
+                        limit, cursor, filters, projection)
+                except ValueError as e:
+                    return jsonify({
+                        'success': False,
+                        'error': str(e)
+                    }), 400
+
+                response = {
+                    'success': True,
+                    'data': books,
+                    'count': len(books),
+                    'next_cursor': next_cursor
+                }
+                if wants_total():
+                    response['total'] = DatabaseManager.count_books(filters)
+            else:
+                books = DatabaseManager.get_all_books(filters, projection)
+                response = {
+                    'success': True,
+                    'data': books,
+                    'count': len(books)
+                }
+
+            facets = get_facets()
+            if facets:
+                response['facets'] = DatabaseManager.get_book_facets(filters, facets)
+            return jsonify(response), 200
         except Exception as e:
             return jsonify({
                 'success': False,
@@ -153,10 +629,23 @@ class BookHandlers:
             }), 500
 
     @staticmethod
+    @conditional(book_validators)
     def get_book(book_id):
-        """GET /api/books/<id> - Получить книгу по ID"""
+        """GET /api/books/<id> - Получить книгу по ID (поддерживает ?fields= и ?include=)"""
         try:
-            book = DatabaseManager.get_book_by_id(book_id)
+            projection, error = get_book_projection()
+            if error:
+                return jsonify({
+                    'success': False,
+                    'error': error
+                }), 400
+
+            # Полную книгу из документа отдаем сохраненным текстом
+            document = DatabaseManager.get_book_json(book_id) if projection.is_full else None
+            if document is not None:
+                return document_response(document)
+
+            book = DatabaseManager.get_book_by_id(book_id, projection)
             if book:
                 return jsonify({
                     'success': True,
@@ -186,7 +675,7 @@ class BookHandlers:
                     'error': 'Обязательное поле "title" отсутствует'
                 }), 400
 
-            book, error = DatabaseManager.create_book(data)
+            book, error = write(DatabaseManager.create_book, data)
 
             if book:
                 return jsonify({
@@ -206,6 +695,46 @@ class BookHandlers:
                 'error': f'Ошибка сервера: {str(e)}'
             }), 500
 
+    @staticmethod
+    def bulk_create_books():
+        """POST /api/books/bulk - Массово создать книги (?upsert=1 - обновлять по ISBN)
+
+        Тело запроса - JSON-массив книг, объект {"books": [...], "upsert": true}
+        или поток NDJSON (Content-Type: application/x-ndjson).
+        """
+        try:
+            upsert = is_flag_set('upsert')
+
+            if request.mimetype == 'application/x-ndjson':
+                books = iter_ndjson(request.stream)
+            else:
+                data = request.get_json(silent=True)
+                if isinstance(data, dict):
+                    upsert = upsert or bool(data.get('upsert'))
+                    data = data.get('books')
+                if not isinstance(data, list):
+                    return jsonify({
+                        'success': False,
+                        'error': 'Ожидается массив книг'
+                    }), 400
+                books = data
+
+            # Тело читается здесь, а каждая пачка записывается через write (см. bulk_create_books)
+            results = DatabaseManager.bulk_create_books(books, upsert=upsert)
+            return jsonify({
+                'success': True,
+                'data': results,
+                'created': sum(1 for r in results if r.get('action') == 'created'),
+                'updated': sum(1 for r in results if r.get('action') == 'updated'),
+                'failed': sum(1 for r in results if not r['success'])
+            }), 200
+
+        except Exception as e:
+            return jsonify({
+                'success': False,
+                'error': f'Ошибка сервера: {str(e)}'
+            }), 500
+
     @staticmethod
     def update_book(book_id):
         """PUT /api/books/<id> - Обновить книгу"""
@@ -218,13 +747,14 @@ class BookHandlers:
                     'error': 'Данные для обновления отсутствуют'
                 }), 400
 
-            book, error = DatabaseManager.update_book(book_id, data)
+            book, changes, error = write(DatabaseManager.update_book, book_id, data)
 
             if book:
                 return jsonify({
                     'success': True,
                     'data': book,
-                    'message': 'Книга успешно обновлена'
+                    'changes': changes,
+                    'message': 'Книга успешно обновлена' if changes else 'Изменений нет'
                 }), 200
             else:
                 return jsonify({
@@ -242,7 +772,7 @@ class BookHandlers:
     def delete_book(book_id):
         """DELETE /api/books/<id> - Удалить книгу"""
         try:
-            success, error = DatabaseManager.delete_book(book_id)
+            success, error = write(DatabaseManager.delete_book, book_id)
 
             if success:
                 return jsonify({
@@ -262,10 +792,224 @@ class BookHandlers:
             }), 500
 
 
+class BatchHandlers:
+    """Обработчик пакетных запросов"""
+
+    @staticmethod
+    def batch():
+        """POST /api/batch - Несколько операций записи и чтений по id за один запрос
+
+        Тело: {"operations": [{"op": "create", "type": "book", "data": {...}},
+                              {"op": "update", "type": "author", "id": 1, "data": {...}},
+                              {"op": "delete", "type": "book", "id": 2}],
+               "atomic": false, "books": [1, 2, 3], "authors": [1, 2]}
+        Операции выполняются одной транзакцией по порядку (с atomic=true - все
+        или ничего), затем читаются книги и авторы по спискам id.
+        """
+        try:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({
+                    'success': False,
+                    'error': 'Ожидается объект с полями operations, books, authors'
+                }), 400
+
+            operations = data.get('operations') or []
+            if not isinstance(operations, list):
+                return jsonify({
+                    'success': False,
+                    'error': 'Поле "operations" должно быть массивом'
+                }), 400
+            if len(operations) > MAX_BATCH_OPERATIONS:
+                return jsonify({
+                    'success': False,
+                    'error': f'Не больше {MAX_BATCH_OPERATIONS} операций в одном пакете'
+                }), 400
+
+            ids = {}
+            for name in ('books', 'authors'):
+                ids[name], error = parse_ids(data.get(name) or [], name)
+                if error:
+                    return jsonify({
+                        'success': False,
+                        'error': error
+                    }), 400
+
+            response = {'success': True}
+            if operations:
+                results = write(DatabaseManager.execute_batch, operations, atomic=bool(data.get('atomic')))
+                response['operations'] = results
+                response['success'] = all(result['success'] for result in results)
+            if ids['books']:
+                response['books'], response['missing_books'] = DatabaseManager.get_books_by_ids(ids['books'])
+            if ids['authors']:
+                response['authors'], response['missing_authors'] = DatabaseManager.get_authors_by_ids(ids['authors'])
+            return jsonify(response), 200
+
+        except Exception as e:
+            return jsonify({
+                'success': False,
+                'error': f'Ошибка сервера: {str(e)}'
+            }), 500
+
+
+def acquire_changes_waiter():
+    """Занять место ожидающего изменений; False, если заняты все changes_max_waiters мест"""
+    with _changes_waiters_lock:
+        if _changes_waiters['count'] >= config['changes_max_waiters']:
+            return False
+        _changes_waiters['count'] += 1
+        return True
+
+
+def release_changes_waiter():
+    with _changes_waiters_lock:
+        _changes_waiters['count'] -= 1
+
+
+def client_disconnected():
+    """Событие отключения клиента (его выставляет src/asgi.py); на сервере WSGI не выставляется"""
+    return request.environ.get('library.disconnected') or threading.Event()
+
+
+def wait_for_changes(since, limit, wait, disconnected):
+    """get_changes, но если изменений нет - ждать их до wait секунд (long-poll).
+
+    Ожидание просыпается по записи в этом процессе (wait_for_commit), а
+    записи других процессов замечает не позже чем через CHANGES_CHECK_INTERVAL
+    секунд. На время ожидания соединение с базой возвращается в пул.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        commits = commit_count()
+        changes, last_seq, has_more = DatabaseManager.get_changes(since, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0 or disconnected.is_set():
+            return changes, last_seq, has_more
+        database.close()
+        wait_for_commit(commits, min(remaining, CHANGES_CHECK_INTERVAL))
+        database.connect(reuse_if_open=True)
+
+
+def stream_changes(since, limit, disconnected):
+    """Поток Server-Sent Events: событие change на каждое изменение, id события - позиция журнала.
+
+    Поток закрывается через changes_stream_seconds секунд или при отключении
+    клиента; EventSource переподключается сам и передает последнюю позицию
+    в Last-Event-ID. Место ожидающего освобождается при закрытии ответа.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        position = since
+        deadline = time.monotonic() + config['changes_stream_seconds']
+        last_sent = time.monotonic()
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        while not disconnected.is_set():
+            commits = commit_count()
+            database.connect(reuse_if_open=True)
+            try:
+                changes, position, _ = DatabaseManager.get_changes(position, limit)
+            finally:
+                database.close()
+            now = time.monotonic()
+            if changes:
+                last_sent = now
+                yield ''.join(f"id: {change['seq']}\nevent: change\ndata: {dumps(change)}\n\n"
+                              for change in changes)
+                continue
+            if now >= deadline:
+                return
+            if now - last_sent >= SSE_KEEPALIVE:
+                last_sent = now
+                yield ': keepalive\n\n'
+            wait_for_commit(commits, min(deadline - now, CHANGES_CHECK_INTERVAL))
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(release_changes_waiter)
+    return response
+
+
+class ChangeHandlers:
+    """Обработчики журнала изменений"""
+
+    @staticmethod
+    def get_changes():
+        """GET /api/changes?since=<seq>&limit= - Изменения каталога после позиции since.
+
+        Возвращает upsert (с текущими данными объекта) и delete по порядку
+        журнала и last_seq - позицию для следующего запроса. ?wait=<секунды> -
+        long-poll: если изменений нет, ответ ждет их до wait секунд. ?stream=sse
+        или Accept: text/event-stream - поток Server-Sent Events. Ждущих
+        запросов не больше changes_max_waiters, сверх этого - ответ 503.
+        Ответ 410 значит, что записи об удалении после since уже удалены
+        сжатием журнала: нужно синхронизироваться заново с since=0.
+        """
+        try:
+            try:
+                since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+                limit = int(request.args.get('limit', DEFAULT_CHANGES_LIMIT))
+                wait = min(float(request.args.get('wait', 0)), MAX_CHANGES_WAIT)
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Параметры "since" и "limit" должны быть целыми числами, "wait" - числом'
+                }), 400
+            if since < 0 or limit < 1 or limit > MAX_PAGE_SIZE:
+                return jsonify({
+                    'success': False,
+                    'error': f'Параметр "since" не может быть отрицательным, "limit" должен быть от 1 до {MAX_PAGE_SIZE}'
+                }), 400
+
+            horizon = DatabaseManager.get_changes_horizon()
+            if 0 < since < horizon:
+                return jsonify({
+                    'success': False,
+                    'error': 'Журнал изменений сжат после этой позиции, нужна полная синхронизация с since=0',
+                    'horizon': horizon
+                }), 410
+
+            stream = (request.args.get('stream', '').lower() == 'sse'
+                      or 'text/event-stream' in request.headers.get('Accept', ''))
+            if stream or wait > 0:
+                # Ожидающий занимает поток обработки: их число ограничено, чтобы остальные запросы обслуживались
+                if not acquire_changes_waiter():
+                    return jsonify({
+                        'success': False,
+                        'error': 'Слишком много клиентов ждут изменений, повторите запрос позже'
+                    }), 503, {'Retry-After': str(CHANGES_RETRY_AFTER)}
+                if stream:
+                    try:
+                        return stream_changes(since, limit, client_disconnected())
+                    except Exception:
+                        release_changes_waiter()
+                        raise
+                try:
+                    changes, last_seq, has_more = wait_for_changes(since, limit, wait, client_disconnected())
+                finally:
+                    release_changes_waiter()
+            else:
+                changes, last_seq, has_more = DatabaseManager.get_changes(since, limit)
+            return jsonify({
+                'success': True,
+                'data': changes,
+                'count': len(changes),
+                'last_seq': last_seq,
+                'has_more': has_more
+            }), 200
+        except Exception as e:
+            return jsonify({
+                'success': False,
+                'error': f'Ошибка сервера: {str(e)}'
+            }), 500
+
+
 class UtilityHandlers:
     """Вспомогательные обработчики"""
 
     @staticmethod
+    @conditional(table_validators('genres', 'genre'), precompressed=True)
     def get_genres():
         """GET /api/genres - Получить все жанры"""
         try:
@@ -281,6 +1025,7 @@ class UtilityHandlers:
             }), 500
 
     @staticmethod
+    @conditional(table_validators('tags', 'tag'), precompressed=True)
     def get_tags():
         """GET /api/tags - Получить все теги"""
         try:
@@ -294,3 +1039,62 @@ class UtilityHandlers:
                 'success': False,
                 'error': f'Ошибка сервера: {str(e)}'
             }), 500
+
+    @staticmethod
+    def get_profiling():
+        """GET /api/profiling - Время и число SQL-запросов по эндпоинтам (?reset=1 - обнулить после чтения)"""
+        stats = endpoint_stats()
+        if is_flag_set('reset'):
+            reset_stats()
+        return jsonify({
+            'success': True,
+            'data': stats
+        }), 200
+
+
+class SearchHandlers:
+    """Обработчики полнотекстового поиска"""
+
+    @staticmethod
+    def search():
+        """GET /api/search?q=&limit=&offset= - Поиск книг по названию, описанию, авторам и тегам"""
+        try:
+            if not search_enabled():
+                return jsonify({
+                    'success': False,
+                    'error': 'Полнотекстовый поиск доступен только для SQLite'
+                }), 501
+
+            text = request.args.get('q', '').strip()
+            if not text:
+                return jsonify({
+                    'success': False,
+                    'error': 'Параметр "q" отсутствует'
+                }), 400
+
+            try:
+                limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+                offset = int(request.args.get('offset', 0))
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Параметры "limit" и "offset" должны быть целыми числами'
+                }), 400
+            if limit < 1 or limit > MAX_PAGE_SIZE or offset < 0:
+                return jsonify({
+                    'success': False,
+                    'error': f'Параметр "limit" должен быть от 1 до {MAX_PAGE_SIZE}, "offset" - не меньше 0'
+                }), 400
+
+            books, has_more = DatabaseManager.search_books(text, limit, offset)
+            return jsonify({
+                'success': True,
+                'data': books,
+                'count': len(books),
+                'next_offset': offset + len(books) if has_more else None
+            }), 200
+        except Exception as e:
+            return jsonify({
+                'success': False,
+                'error': f'Ошибка сервера: {str(e)}'
+            }), 500
@@ -0,0 +1,296 @@
+"""Запуск API в production: несколько рабочих процессов (pre-fork) и плавная перезагрузка.
+
+    python -m src.launcher --workers 4 --threads 8 --port 5000
+    python -m src.launcher --server asgi    # рабочие процессы на uvicorn (src/asgi.py)
+
+Мастер-процесс один раз создает таблицы и применяет миграции, открывает
+слушающий сокет и запускает рабочие процессы; каждый из них создает свое
+приложение через create_app() и принимает соединения с общего сокета.
+
+Сигналы мастеру:
+    SIGHUP          - перечитать настройки, применить миграции и плавно заменить рабочие процессы
+    SIGTERM, SIGINT - плавно остановить рабочие процессы и выйти
+
+Плавная остановка: рабочий процесс перестает принимать соединения и
+завершает начатые запросы, но не дольше graceful_timeout секунд.
+Упавший рабочий процесс перезапускается; если процессы падают сразу после
+запуска, задержка перезапуска удваивается, а после MAX_FAST_FAILURES таких
+падений подряд мастер останавливается с кодом 1. Адрес и порт при SIGHUP не меняются.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+from src.config import config, reload_config
+from src.models import create_tables, database, init_database
+from src.writer import stop_writer
+
+# Как часто мастер проверяет рабочие процессы и сигналы, секунды
+MASTER_TICK = 0.5
+
+# Рабочий процесс, завершившийся раньше WORKER_MIN_UPTIME секунд после запуска, упал при запуске
+WORKER_MIN_UPTIME = 5
+
+# Задержка перезапуска после падений при запуске: от RESPAWN_DELAY, удваивается до RESPAWN_MAX_DELAY секунд
+RESPAWN_DELAY = 0.5
+RESPAWN_MAX_DELAY = 30
+
+# Сколько падений при запуске подряд мастер терпит, прежде чем остановиться
+MAX_FAST_FAILURES = 10
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI-сервер werkzeug, обрабатывающий запросы в пуле из threads потоков.
+
+    Пока все потоки заняты, сервер не принимает новые соединения: они ждут
+    в очереди слушающего сокета (backlog), а не в неограниченной очереди
+    пула, и их принимают свободные рабочие процессы. При переполнении
+    backlog клиенты получают отказ в соединении, а не растущую задержку.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, fd=fd)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='worker')
+        self.idle_threads = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        # Ждем свободный поток до того, как принять следующее соединение
+        self.idle_threads.acquire()
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.idle_threads.release()
+
+
+def run_wsgi_worker(sock, threads):
+    from src.app import create_app
+    host, port = sock.getsockname()[:2]
+    server = PooledWSGIServer(host, port, create_app(), threads, fd=sock.fileno())
+
+    # serve_forever выполняется в главном потоке, поэтому shutdown() - из другого
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.serve_forever()
+    server.executor.shutdown(wait=True)
+
+
+def run_asgi_worker(sock, threads):
+    import uvicorn
+    from src.app import create_app
+    from src.asgi import WsgiToAsgi
+
+    # Миграции уже применены мастером, поэтому без on_startup и lifespan
+    app = WsgiToAsgi(create_app(), threads)
+    uvicorn.Server(uvicorn.Config(app, fd=sock.fileno(), lifespan='off')).run()
+
+
+def run_worker(sock, server, threads):
+    """Тело рабочего процесса после fork"""
+    # Обработчики сигналов мастера унаследованы при fork - возвращаем свои
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # Собственный пул соединений, не разделяемый с мастером и другими процессами
+    init_database()
+    try:
+        if server == 'asgi':
+            run_asgi_worker(sock, threads)
+        else:
+            run_wsgi_worker(sock, threads)
+    finally:
+        # os._exit не вызывает atexit, поэтому очередь писателя дописываем явно
+        stop_writer()
+        database.close_all()
+
+
+class Launcher:
+    """Мастер-процесс: миграции, слушающий сокет и управление рабочими процессами"""
+
+    def __init__(self, host, port, workers=None, threads=None, server='wsgi'):
+        self.host = host
+        self.port = port
+        self.server = server
+        # Значения из командной строки важнее настроек и сохраняются при SIGHUP
+        self.options = {'workers': workers, 'threads': threads}
+        self.workers = {}  # pid -> момент, до которого процесс должен завершиться (None - работает)
+        self.started = {}  # pid -> момент запуска
+        self.respawns = []  # моменты отложенных перезапусков
+        self.fast_failures = 0  # падений при запуске подряд
+        self.signals = []
+        self.stopping = False
+        self.failed = False
+        self.sock = None
+
+    def setting(self, name):
+        value = self.options[name] if self.options[name] is not None else config[name]
+        if name == 'workers' and not value:
+            value = os.cpu_count() or 1
+        return value
+
+    def prepare_database(self):
+        """Создать таблицы и применить миграции; соединения закрываются до fork"""
+        create_tables()
+        database.close_all()
+
+    def run(self):
+        self.prepare_database()
+        self.sock = socket.create_server((self.host, self.port), backlog=2048)
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self.signals.append(signum))
+
+        print(f"Мастер {os.getpid()}: http://{self.host}:{self.port}, "
+              f"рабочих процессов {self.setting('workers')}, потоков в каждом {self.setting('threads')}, "
+              f"сервер {self.server}")
+        self.spawn_workers()
+
+        while self.workers or not self.stopping:
+            while self.signals:
+                self.handle_signal(self.signals.pop(0))
+            self.reap_workers()
+            self.spawn_due_workers()
+            time.sleep(MASTER_TICK)
+
+        self.sock.close()
+        print(f"Мастер {os.getpid()}: остановлен")
+        return 1 if self.failed else 0
+
+    def handle_signal(self, signum):
+        if signum == signal.SIGHUP and not self.stopping:
+            self.reload()
+        elif signum in (signal.SIGTERM, signal.SIGINT) and not self.stopping:
+            print(f"Мастер {os.getpid()}: остановка")
+            self.stopping = True
+            self.stop_workers(list(self.workers))
+
+    def reload(self):
+        """Новое поколение рабочих процессов с новыми настройками; старое завершается плавно"""
+        print(f"Мастер {os.getpid()}: перезагрузка")
+        try:
+            reload_config()
+            init_database()
+            self.prepare_database()
+        except Exception as e:
+            print(f"Ошибка перезагрузки, рабочие процессы не заменены: {e}")
+            return
+        old_workers = [pid for pid, deadline in self.workers.items() if deadline is None]
+        # Новое поколение запускается целиком, отложенные перезапуски старого не нужны
+        self.respawns.clear()
+        self.fast_failures = 0
+        self.spawn_workers()
+        self.stop_workers(old_workers)
+
+    def spawn_workers(self):
+        for _ in range(self.setting('workers')):
+            self.spawn_worker()
+
+    def spawn_worker(self):
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.sock, self.server, self.setting('threads'))
+            except Exception as e:
+                print(f"Ошибка рабочего процесса {os.getpid()}: {e}")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        self.workers[pid] = None
+        self.started[pid] = time.monotonic()
+        print(f"Рабочий процесс {pid} запущен")
+
+    def spawn_due_workers(self):
+        """Запустить рабочие процессы, отложенные перезапуски которых подошли"""
+        if self.stopping:
+            self.respawns.clear()
+            return
+        now = time.monotonic()
+        due = [moment for moment in self.respawns if moment <= now]
+        self.respawns = [moment for moment in self.respawns if moment > now]
+        for _ in due:
+            self.spawn_worker()
+
+    def stop_workers(self, pids):
+        deadline = time.monotonic() + config['graceful_timeout']
+        for pid in pids:
+            self.workers[pid] = deadline
+            self.kill(pid, signal.SIGTERM)
+
+    def reap_workers(self):
+        """Убрать завершившиеся процессы, перезапустить упавшие, добить не уложившиеся в graceful_timeout"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                self.started.clear()
+                break
+            if pid == 0:
+                break
+            if pid not in self.workers:
+                continue
+            retiring = self.workers.pop(pid) is not None
+            uptime = time.monotonic() - self.started.pop(pid)
+            if not retiring and not self.stopping:
+                self.schedule_respawn(pid, os.waitstatus_to_exitcode(status), uptime)
+
+        now = time.monotonic()
+        for pid, deadline in list(self.workers.items()):
+            if deadline is not None and deadline <= now:
+                print(f"Рабочий процесс {pid} не завершился за {config['graceful_timeout']} с")
+                self.kill(pid, signal.SIGKILL)
+                self.workers[pid] = float('inf')
+
+    def schedule_respawn(self, pid, code, uptime):
+        """Отложить перезапуск упавшего процесса; при падениях при запуске - с растущей задержкой"""
+        self.fast_failures = self.fast_failures + 1 if uptime < WORKER_MIN_UPTIME else 0
+        if self.fast_failures >= MAX_FAST_FAILURES:
+            print(f"Рабочий процесс {pid} завершился (код {code}); рабочие процессы упали при запуске "
+                  f"{self.fast_failures} раз подряд, остановка")
+            self.stopping = True
+            self.failed = True
+            self.stop_workers(list(self.workers))
+            return
+        delay = min(RESPAWN_DELAY * 2 ** (self.fast_failures - 1), RESPAWN_MAX_DELAY) if self.fast_failures else 0
+        print(f"Рабочий процесс {pid} завершился (код {code}), перезапуск через {delay:g} с")
+        self.respawns.append(time.monotonic() + delay)
+
+    def kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Запуск Books Library API с несколькими рабочими процессами')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, help='рабочих процессов (по умолчанию - настройка workers или число ядер)')
+    parser.add_argument('--threads', type=int, help='потоков в рабочем процессе (по умолчанию - настройка threads)')
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default=None,
+                        help='сервер рабочих процессов (по умолчанию - настройка server)')
+    args = parser.parse_args()
+
+    sys.exit(Launcher(args.host, args.port, args.workers, args.threads, args.server or config['server']).run())
+
+
+if __name__ == '__main__':
+    main()
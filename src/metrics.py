@@ -0,0 +1,237 @@
+"""Метрики в формате Prometheus: GET /metrics.
+
+Счетчики и гистограммы хранятся по потокам: каждый поток пишет только в
+свой словарь, без блокировок, а при чтении /metrics словари всех потоков
+складываются. Словари завершившихся потоков при этом сливаются в общий.
+
+Метрики относятся к одному процессу; при запуске через src/launcher.py
+каждый рабочий процесс отдает свои значения.
+"""
+import bisect
+import os
+import threading
+import time
+
+from flask import Response, g, request
+
+from src import profiling
+from src.cache import get_cache
+from src.config import config
+from src.models import database, pool_stats
+from src.writer import writer_stats
+
+# Границы корзин гистограмм длительности, секунды
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+START_TIME = time.time()
+
+
+class ShardedMetrics:
+    """Счетчики и гистограммы с отдельным хранилищем на каждый поток"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (поток, словарь потока)
+        self._retired = {}  # сумма словарей завершившихся потоков
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def inc(self, name, labels=(), value=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name, labels, buckets, value):
+        """Добавить значение в гистограмму: счетчики корзин, затем сумма и количество"""
+        shard = self._shard()
+        key = (name, labels)
+        histogram = shard.get(key)
+        if histogram is None:
+            histogram = shard[key] = [0] * (len(buckets) + 3)
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    @staticmethod
+    def _merge(total, shard):
+        for key, value in shard.copy().items():
+            if isinstance(value, list):
+                merged = total.get(key)
+                total[key] = [a + b for a, b in zip(merged, value)] if merged else list(value)
+            else:
+                total[key] = total.get(key, 0) + value
+
+    def snapshot(self):
+        """Сумма значений всех потоков: (имя, метки) -> число или список гистограммы"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = alive
+            total = {}
+            self._merge(total, self._retired)
+        for _, shard in alive:
+            self._merge(total, shard)
+        return total
+
+    def reset(self):
+        with self._lock:
+            self._shards = []
+            self._retired = {}
+        self._local = threading.local()
+
+
+metrics = ShardedMetrics()
+
+
+def record_query(elapsed):
+    metrics.inc('library_db_queries_total')
+    metrics.observe('library_db_query_duration_seconds', (), QUERY_BUCKETS, elapsed)
+
+
+def start_request():
+    profiling.instrument(database.obj)
+    g.metrics_started = time.perf_counter()
+
+
+def remember_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish_request(exc):
+    """Учесть запрос (для потоковых ответов - после отправки всего тела)"""
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    status = g.pop('metrics_status', 500) if exc is None else 500
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('library_http_requests_total', (('method', request.method), ('route', route), ('status', str(status))))
+    metrics.observe('library_http_request_duration_seconds', (('method', request.method), ('route', route)),
+                    REQUEST_BUCKETS, time.perf_counter() - started)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    values = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                      for name, value in labels)
+    return '{' + values + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Описание и тип метрик для строк # HELP и # TYPE
+METRICS = {
+    'library_http_requests_total': ('counter', 'HTTP-запросы по маршруту, методу и статусу', None),
+    'library_http_request_duration_seconds': ('histogram', 'Длительность HTTP-запросов', REQUEST_BUCKETS),
+    'library_db_queries_total': ('counter', 'Выполненные SQL-запросы', None),
+    'library_db_query_duration_seconds': ('histogram', 'Длительность SQL-запросов (execute)', QUERY_BUCKETS),
+}
+
+
+def collect_gauges():
+    """Текущие значения: пул соединений, кэш, размер файлов SQLite. Список (имя, тип, описание, [(метки, значение)])"""
+    gauges = [('library_process_start_time_seconds', 'gauge', 'Время запуска процесса (Unix)', [((), START_TIME)])]
+
+    pool = pool_stats()
+    if pool:
+        gauges.append(('library_db_pool_connections', 'gauge', 'Соединения пула',
+                       [((('state', 'in_use'),), pool['in_use']), ((('state', 'idle'),), pool['idle'])]))
+        gauges.append(('library_db_pool_max_connections', 'gauge', 'Размер пула соединений',
+                       [((), pool['max_connections'])]))
+
+    writer = writer_stats()
+    if writer:
+        gauges.append(('library_group_commit_operations_total', 'counter',
+                       'Операции записи, выполненные потоком-писателем', [((), writer['operations'])]))
+        gauges.append(('library_group_commit_transactions_total', 'counter',
+                       'Транзакции потока-писателя', [((), writer['transactions'])]))
+        gauges.append(('library_group_commit_queued', 'gauge',
+                       'Операции записи в очереди потока-писателя', [((), writer['queued'])]))
+
+    cache = get_cache().stats()
+    if cache:
+        hits, misses = cache['hits'], cache['misses']
+        gauges.append(('library_cache_hits_total', 'counter', 'Попадания в кэш чтения', [((), hits)]))
+        gauges.append(('library_cache_misses_total', 'counter', 'Промахи кэша чтения', [((), misses)]))
+        gauges.append(('library_cache_hit_ratio', 'gauge', 'Доля попаданий в кэш чтения',
+                       [((), hits / (hits + misses) if hits + misses else 0.0)]))
+        if cache.get('evictions') is not None:
+            gauges.append(('library_cache_evictions_total', 'counter', 'Вытеснения из кэша чтения',
+                           [((), cache['evictions'])]))
+        if cache.get('size') is not None:
+            gauges.append(('library_cache_entries', 'gauge', 'Записей в кэше чтения', [((), cache['size'])]))
+
+    if config['db_backend'] == 'sqlite':
+        sizes = []
+        for name, suffix in (('db', ''), ('wal', '-wal'), ('shm', '-shm')):
+            path = config['db_path'] + suffix
+            if os.path.exists(path):
+                sizes.append(((('file', name),), os.path.getsize(path)))
+        gauges.append(('library_sqlite_file_bytes', 'gauge', 'Размер файлов базы SQLite', sizes))
+    return gauges
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    snapshot = snapshot_by_name()
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(snapshot.get(name, {}).items()):
+            if kind != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), value):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(value[-2])}')
+            lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+
+    for name, kind, description, samples in collect_gauges():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot_by_name():
+    by_name = {}
+    for (name, labels), value in metrics.snapshot().items():
+        by_name.setdefault(name, {})[labels] = value
+    return by_name
+
+
+def metrics_response():
+    return Response(render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    """Собирать метрики запросов приложения Flask (если metrics_enabled)"""
+    if not config['metrics_enabled']:
+        return
+    if record_query not in profiling.QUERY_LISTENERS:
+        profiling.QUERY_LISTENERS.append(record_query)
+    app.before_request(start_request)
+    app.after_request(remember_status)
+    app.teardown_request(finish_request)
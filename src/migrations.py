@@ -0,0 +1,151 @@
+from peewee import fn
+from playhouse.migrate import SchemaMigrator, migrate
+from src.models import *
+from src.database import DatabaseManager, RELATION_CHUNK_SIZE, log_model_changes
+
+# Зарегистрированные миграции: (версия, описание, функция), по возрастанию версии
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Декоратор, регистрирующий функцию migrate_func(migrator) как миграцию схемы"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+
+def migrate_database():
+    """Создать недостающие таблицы и применить непримененные миграции.
+
+    Новая база создается сразу по текущим моделям, и все миграции
+    отмечаются как примененные. В существующей базе миграции применяются
+    по порядку, каждая в своей транзакции. Возвращает список примененных версий.
+    """
+    with database.connection_context():
+        fresh = not database.table_exists(Book._meta.table_name)
+
+        # В существующей базе создаем только новые таблицы: индексы старых таблиц
+        # добавляют миграции, иначе уникальный индекс упадет на дубликатах
+        models = MODELS + ([BookSearch] if search_enabled() else []) + [SchemaVersion]
+        missing = [model for model in models
+                   if fresh or not database.table_exists(model._meta.table_name)]
+        database.create_tables(missing)
+
+        done = set(version for version, in SchemaVersion.select(SchemaVersion.version).tuples())
+        migrator = SchemaMigrator.from_database(database.obj)
+        applied = []
+
+        # SQLite изменяет столбцы, пересоздавая таблицу; внешние ключи на время
+        # миграций отключаются (это возможно только вне транзакции)
+        foreign_keys = isinstance(database.obj, SqliteDatabase) and database.obj.foreign_keys
+        if foreign_keys:
+            database.obj.foreign_keys = False
+        try:
+            for version, description, func in MIGRATIONS:
+                if version in done:
+                    continue
+                with database.atomic():
+                    if not fresh:
+                        func(migrator)
+                    SchemaVersion.create(version=version, description=description)
+                applied.append(version)
+        finally:
+            if foreign_keys:
+                database.obj.foreign_keys = True
+
+    return [] if fresh else applied
+
+
+def remove_duplicate_links(link_model, fk_name):
+    """Удалить повторяющиеся связи из промежуточной таблицы, оставив самую раннюю"""
+    fk_field = link_model._meta.fields[fk_name]
+    keep = (link_model
+            .select(fn.MIN(link_model.id))
+            .group_by(link_model.book, fk_field))
+    link_model.delete().where(link_model.id.not_in(keep)).execute()
+
+
+@migration(1, 'Индексы для поиска авторов и книг и связей книг')
+def add_lookup_indexes(migrator):
+    for link_model, fk_name in ((BookAuthor, 'author'), (BookGenre, 'genre'), (BookTag, 'tag')):
+        remove_duplicate_links(link_model, fk_name)
+
+        table = link_model._meta.table_name
+        fk_column = link_model._meta.fields[fk_name].column_name
+        migrate(
+            migrator.add_index(table, ('book_id', fk_column), True),
+            migrator.add_index(table, (fk_column, 'book_id'), False),
+        )
+
+    migrate(
+        migrator.add_index('author', ('name',), False),
+        migrator.add_index('book', ('title',), False),
+    )
+
+
+@migration(2, 'Полнотекстовый индекс книг')
+def fill_book_search(migrator):
+    # Таблица book_search создается вместе с остальными недостающими таблицами
+    if not search_enabled():
+        return
+    BookSearch.delete().execute()
+    last_id = 0
+    while True:
+        book_ids = [book_id for book_id, in (Book
+                                             .select(Book.id)
+                                             .where(Book.id > last_id)
+                                             .order_by(Book.id)
+                                             .limit(RELATION_CHUNK_SIZE)
+                                             .tuples())]
+        if not book_ids:
+            break
+        DatabaseManager.reindex_books(book_ids)
+        last_id = book_ids[-1]
+
+
+@migration(3, 'Индексы для фильтров книг по году и числу страниц')
+def add_book_filter_indexes(migrator):
+    migrate(
+        migrator.add_index('book', ('publication_year',), False),
+        migrator.add_index('book', ('page_count',), False),
+    )
+
+
+@migration(4, 'Версии авторов и книг, счетчики изменений таблиц')
+def add_versions(migrator):
+    # Таблица tableversion создается вместе с остальными недостающими таблицами
+    for model in (Author, Book):
+        table = model._meta.table_name
+        migrate(
+            migrator.add_column(table, 'version', IntegerField(default=1)),
+            migrator.add_column(table, 'updated_at', DateTimeField(null=True)),
+        )
+        model.update(updated_at=model.created_at).execute()
+        migrate(migrator.add_not_null(table, 'updated_at'))
+    touch_tables('author', 'book', 'genre', 'tag')
+
+
+@migration(5, 'Количество книг авторов')
+def add_author_book_count(migrator):
+    migrate(
+        migrator.add_column('author', 'book_count', IntegerField(default=0)),
+        migrator.add_index('author', ('book_count',), False),
+    )
+    DatabaseManager.recount_book_counts()
+    touch_tables('author')
+
+
+@migration(6, 'Журнал изменений')
+def fill_change_log(migrator):
+    # Таблица changelog создается вместе с остальными недостающими таблицами. Существующие
+    # объекты записываются как upsert, чтобы синхронизация с since=0 получила весь каталог
+    for model, entity in ((Genre, 'genre'), (Tag, 'tag'), (Author, 'author'), (Book, 'book')):
+        log_model_changes(model, entity)
+
+
+@migration(7, 'Замена "ё" на "е" в полнотекстовом индексе книг')
+def normalize_book_search(migrator):
+    # Индекс заполняется заново уже с normalize_search_text
+    fill_book_search(migrator)
@@ -1,8 +1,107 @@
 from peewee import *
 from datetime import datetime
-
-# Создаем подключение к SQLite базе данных
-database = SqliteDatabase('library.db')
+from playhouse.db_url import parse as parse_db_url
+from playhouse.pool import PooledDatabase, PooledPostgresqlDatabase, PooledSqliteDatabase
+from playhouse.sqlite_ext import FTS5Model, RowIDField, SearchField
+from src.config import config
+
+# Подключение к базе данных. Конкретная база (SQLite или PostgreSQL) выбирается
+# в init_database по настройкам, модели работают через этот прокси.
+database = DatabaseProxy()
+
+
+def sqlite_pragmas(settings):
+    """PRAGMA для SQLite в зависимости от профиля настроек"""
+    # Ожидание блокировки задается через PRAGMA: параметр timeout у пула означает другое
+    busy_timeout = {'busy_timeout': int(settings['db_busy_timeout'] * 1000)}
+    if settings['db_profile'] != 'production':
+        return busy_timeout
+    return {
+        **busy_timeout,
+        # WAL: читатели не блокируются пишущим соединением
+        'journal_mode': 'wal',
+        # В режиме WAL NORMAL не теряет целостность, но не делает fsync на каждый коммит
+        'synchronous': 'normal',
+        # Отрицательное значение - размер кэша в КБ, а не в страницах
+        'cache_size': -settings['db_cache_size_mb'] * 1024,
+        'mmap_size': settings['db_mmap_size_mb'] * 1024 * 1024,
+        'temp_store': 'memory',
+        'foreign_keys': 1,
+    }
+
+
+def init_database(settings=config):
+    """Создать пул подключений к базе данных по настройкам и привязать к нему модели"""
+    pool_settings = {
+        'max_connections': settings['db_max_connections'],
+        'stale_timeout': settings['db_stale_timeout'],
+        'timeout': settings['db_pool_wait_timeout'],
+    }
+    if settings['db_backend'] == 'postgresql':
+        params = parse_db_url(settings['database_url'])
+        db = PooledPostgresqlDatabase(params.pop('database'), **pool_settings, **params)
+    elif settings['db_backend'] == 'sqlite':
+        # check_same_thread=False: соединение из пула может достаться другому потоку
+        db = PooledSqliteDatabase(
+            settings['db_path'],
+            pragmas=sqlite_pragmas(settings),
+            check_same_thread=False,
+            **pool_settings)
+    else:
+        raise ValueError(f"Неизвестный тип базы данных: {settings['db_backend']}")
+
+    database.initialize(db)
+    return db
+
+
+def touch_tables(*tables):
+    """Увеличить счетчики изменений таблиц; вызывается в транзакции, изменяющей данные"""
+    now = datetime.now()
+    for table in tables:
+        (TableVersion
+         .insert(table_name=table, version=1, updated_at=now)
+         .on_conflict(conflict_target=[TableVersion.table_name],
+                      update={TableVersion.version: TableVersion.version + 1,
+                              TableVersion.updated_at: now})
+         .execute())
+
+
+def get_table_versions(*tables):
+    """Счетчики изменений таблиц одним запросом: {таблица: (версия, время изменения)}"""
+    versions = {table: (0, None) for table in tables}
+    query = (TableVersion
+             .select(TableVersion.table_name, TableVersion.version, TableVersion.updated_at)
+             .where(TableVersion.table_name.in_(tables))
+             .tuples())
+    for table, version, updated_at in query:
+        versions[table] = (version, updated_at)
+    return versions
+
+
+def documents_enabled():
+    """Ведутся ли готовые документы книг (BookDocument)"""
+    return config['book_documents_enabled']
+
+
+def search_enabled():
+    """Доступен ли полнотекстовый поиск (FTS5 есть только в SQLite)"""
+    return isinstance(database.obj, SqliteDatabase)
+
+
+def pool_stats():
+    """Состояние пула соединений текущего процесса (None, если пул не используется)"""
+    db = database.obj
+    if not isinstance(db, PooledDatabase):
+        return None
+    return {
+        'max_connections': db._max_connections,
+        'in_use': len(db._in_use),
+        'idle': len(db._connections),
+        'stale_timeout': db._stale_timeout,
+    }
+
+
+init_database()
 
 
 # Базовая модель, от которой наследуются все остальные
@@ -16,8 +115,8 @@ class Author(BaseModel):
     # Первичный ключ - автоматически увеличивающийся идентификатор
     id = AutoField(primary_key=True)
 
-    # Имя автора (обязательное поле, максимум 100 символов)
-    name = CharField(max_length=100, null=False)
+    # Имя автора (обязательное поле, максимум 100 символов; индекс для поиска по имени и сортировки)
+    name = CharField(max_length=100, null=False, index=True)
 
     # Биография автора (может быть пустой)
     biography = TextField(null=True)
@@ -28,9 +127,17 @@ class Author(BaseModel):
     # Страна (может быть пустой)
     country = CharField(max_length=50, null=True)
 
+    # Количество книг автора: ведется методами записи книг, а не считается по связям
+    # (индекс - для сортировки и фильтра списка авторов по числу книг)
+    book_count = IntegerField(default=0, index=True)
+
     # Когда запись была создана (автоматически при создании)
     created_at = DateTimeField(default=datetime.now)
 
+    # Номер версии и время последнего изменения (для ETag и Last-Modified)
+    version = IntegerField(default=1)
+    updated_at = DateTimeField(default=datetime.now)
+
     def __str__(self):
         return f"Автор: {self.name}"
 
@@ -64,24 +171,28 @@ class Tag(BaseModel):
 class Book(BaseModel):
     id = AutoField(primary_key=True)
 
-    # Название книги (обязательное поле)
-    title = CharField(max_length=200, null=False)
+    # Название книги (обязательное поле; индекс для сортировки списка книг)
+    title = CharField(max_length=200, null=False, index=True)
 
     # ISBN книги (уникальный идентификатор)
     isbn = CharField(max_length=13, unique=True, null=True)
 
-    # Год публикации
-    publication_year = IntegerField(null=True)
+    # Год публикации (индекс для фильтра и фасета по году)
+    publication_year = IntegerField(null=True, index=True)
 
     # Описание книги
     description = TextField(null=True)
 
-    # Количество страниц
-    page_count = IntegerField(null=True)
+    # Количество страниц (индекс для фильтра по объему)
+    page_count = IntegerField(null=True, index=True)
 
     # Когда книга была добавлена в базу
     created_at = DateTimeField(default=datetime.now)
 
+    # Номер версии и время последнего изменения книги, ее связей или ее авторов
+    version = IntegerField(default=1)
+    updated_at = DateTimeField(default=datetime.now)
+
     def __str__(self):
         return f"Книга: {self.title}"
 
@@ -99,6 +210,12 @@ class BookAuthor(BaseModel):
     # Можно добавить дополнительную информацию, например, тип авторства
     authorship_type = CharField(max_length=50, default='автор')  # автор, соавтор, переводчик и т.д.
 
+    class Meta:
+        indexes = (
+            (('book', 'author'), True),  # одна связь на пару книга-автор
+            (('author', 'book'), False),  # книги автора
+        )
+
 
 # Промежуточная таблица для связи Книг и Жанров
 class BookGenre(BaseModel):
@@ -106,6 +223,12 @@ class BookGenre(BaseModel):
     book = ForeignKeyField(Book, backref='book_genres')
     genre = ForeignKeyField(Genre, backref='genre_books')
 
+    class Meta:
+        indexes = (
+            (('book', 'genre'), True),
+            (('genre', 'book'), False),
+        )
+
 
 # Промежуточная таблица для связи Книг и Тегов
 class BookTag(BaseModel):
@@ -113,20 +236,105 @@ class BookTag(BaseModel):
     book = ForeignKeyField(Book, backref='book_tags')
     tag = ForeignKeyField(Tag, backref='tag_books')
 
+    class Meta:
+        indexes = (
+            (('book', 'tag'), True),
+            (('tag', 'book'), False),
+        )
+
+
+# Готовый документ книги: JSON книги со всеми связями в том виде, в каком его отдает API.
+# id совпадает с id книги, version - версия книги, по которой собран документ: документ,
+# версия которого отстала от книги, не используется. Записи поддерживает
+# DatabaseManager.refresh_book_documents, если включена настройка book_documents_enabled.
+class BookDocument(BaseModel):
+    id = IntegerField(primary_key=True)
+    version = IntegerField()
+    data = TextField()
+
 
-# Функция для создания всех таблиц в базе данных
+# Полнотекстовый индекс книг (виртуальная таблица FTS5, только для SQLite).
+# rowid совпадает с id книги, записи поддерживает DatabaseManager.reindex_books.
+class BookSearch(FTS5Model):
+    rowid = RowIDField()
+    title = SearchField()
+    description = SearchField()
+
+    # Имена авторов и названия тегов книги через пробел
+    authors = SearchField()
+    tags = SearchField()
+
+    class Meta:
+        database = database
+        table_name = 'book_search'
+        # unicode61 приводит к нижнему регистру и кириллицу, remove_diacritics 2 убирает диакритику
+        # латиницы. "ё" для него отдельная буква, поэтому DatabaseManager заменяет ее на "е" сам
+        # (normalize_search_text); prefix - индексы префиксов из 2 и 3 символов для поиска по началу слова
+        options = {'tokenize': 'unicode61 remove_diacritics 2', 'prefix': '2 3'}
+
+
+# Журнал изменений для синхронизации клиентов (GET /api/changes): запись о каждом создании,
+# изменении (upsert) или удалении (delete) книги, автора, жанра или тега в той же транзакции.
+# Сжатие журнала (DatabaseManager.compact_changes) оставляет по последней записи на объект.
+class ChangeLog(BaseModel):
+    seq = AutoField()
+    entity = CharField(max_length=20)  # book, author, genre, tag
+    entity_id = IntegerField()
+    op = CharField(max_length=10)
+    changed_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = (
+            (('entity', 'entity_id', 'seq'), False),  # последняя запись об объекте при сжатии
+        )
+
+
+# Счетчик изменений таблицы: увеличивается при каждой записи в нее (для ETag списков)
+class TableVersion(BaseModel):
+    table_name = CharField(max_length=50, primary_key=True)
+    version = IntegerField(default=0)
+    updated_at = DateTimeField(default=datetime.now)
+
+
+# Версия схемы базы данных: по одной записи на каждую примененную миграцию (см. migrations.py)
+class SchemaVersion(BaseModel):
+    version = IntegerField(primary_key=True)
+    description = CharField(max_length=200)
+    applied_at = DateTimeField(default=datetime.now)
+
+
+# Все таблицы в порядке создания (сначала основные, потом связующие)
+MODELS = [
+    Author, Genre, Tag, Book,  # Основные таблицы
+    BookAuthor, BookGenre, BookTag,  # Связующие таблицы
+    BookDocument, ChangeLog, TableVersion  # Служебные таблицы
+]
+
+
+# Функция для создания всех таблиц в базе данных и обновления схемы существующей базы
 def create_tables():
-    with database:
-        # Создаем таблицы в правильном порядке (сначала основные, потом связующие)
-        database.create_tables([
-            Author, Genre, Tag, Book,  # Основные таблицы
-            BookAuthor, BookGenre, BookTag  # Связующие таблицы
-        ])
+    from src.migrations import migrate_database
+    applied = migrate_database()
+    if applied:
+        print(f"Применены миграции: {', '.join(str(version) for version in applied)}")
+
+    from src.database import DatabaseManager
+    with database.connection_context():
+        # Документы книг могли быть включены на уже заполненной базе
+        refreshed = DatabaseManager.refresh_stale_book_documents()
+        if refreshed:
+            print(f"Собраны документы книг: {refreshed}")
+
+        # Полное сжатие журнала изменений и удаление старых записей об удалении
+        with database.atomic():
+            removed = DatabaseManager.compact_changes(purge_tombstones=True)
+        if removed:
+            print(f"Журнал изменений сжат: удалено записей {removed}")
     print("Все таблицы созданы успешно!")
 
 
-# Функция для заполнения базы тестовыми данными
-def seed_database():
+# Функция для заполнения базы тестовыми данными; books > 0 - еще и синтетическая библиотека такого размера
+def seed_database(books=0, seed=42):
     # Создаем авторов
     authors = [
         {'name': 'Лев Толстой', 'country': 'Россия', 'birth_date': '1828-09-09'},
@@ -153,5 +361,117 @@ def seed_database():
         Author.insert_many(authors).execute()
         Genre.insert_many(genres).execute()
         Tag.insert_many(tags).execute()
+        touch_tables('author', 'genre', 'tag')
+
+        from src.database import log_model_changes
+        log_model_changes(Author, 'author', Author.name.in_([author['name'] for author in authors]))
+        log_model_changes(Genre, 'genre', Genre.name.in_([genre['name'] for genre in genres]))
+        log_model_changes(Tag, 'tag', Tag.name.in_([tag['name'] for tag in tags]))
+
+    if books:
+        seed_synthetic_library(books, seed)
 
     print("Тестовые данные добавлены!")
+
+
+# Слова для синтетических названий и описаний книг
+SYNTHETIC_ADJECTIVES = ['Тихий', 'Последний', 'Северный', 'Старый', 'Белый', 'Золотой', 'Дальний',
+                        'Русский', 'Вечный', 'Темный', 'Летний', 'Потерянный']
+SYNTHETIC_NOUNS = ['дом', 'сад', 'берег', 'город', 'путь', 'лес', 'сон', 'век', 'мост', 'остров',
+                   'голос', 'ветер']
+SYNTHETIC_WORDS = ['история', 'семья', 'война', 'любовь', 'дорога', 'память', 'судьба', 'море',
+                   'зима', 'деревня', 'революция', 'письмо', 'тайна', 'наследство', 'детство']
+SYNTHETIC_COUNTRIES = ['Россия', 'Франция', 'Англия', 'Германия', 'США', 'Италия', 'Испания', 'Япония']
+
+# Связей у книги: авторов, жанров, тегов (от и до включительно)
+SYNTHETIC_FAN_OUT = {'author': (1, 3), 'genre': (1, 2), 'tag': (0, 5)}
+
+
+def seed_synthetic_library(books, seed=42):
+    """Добавить books синтетических книг с авторами (по одному на 10 книг), 20 жанрами и 100 тегами.
+
+    Данные детерминированы seed, поэтому замеры на одинаковом размере
+    сравнимы между запусками. Связи и полнотекстовый индекс заполняются
+    пачками, как при массовой загрузке.
+    """
+    import random
+    from src.cache import get_cache
+    from src.database import (INSERT_CHUNK_SIZE, RELATION_CHUNK_SIZE, DatabaseManager, forget_counts,
+                              log_changes, log_model_changes)
+
+    rng = random.Random(seed)
+
+    def next_id(model):
+        return (model.select(fn.MAX(model.id)).scalar() or 0) + 1
+
+    def insert(model, rows):
+        # SQL строится peewee один раз на пачку, а строки уходят одним executemany:
+        # генерация INSERT на каждую строку заняла бы большую часть времени заполнения.
+        # Значения полей по умолчанию (created_at и т.д.) берутся из первой строки пачки.
+        for batch in chunked(rows, INSERT_CHUNK_SIZE * 10):
+            fields = [model._meta.fields[name] for name in batch[0]]
+            sql, params = model.insert_many([tuple(batch[0].values())], fields=fields).sql()
+            defaults = tuple(params[len(fields):])
+            database.cursor().executemany(sql, [tuple(row.values()) + defaults for row in batch])
+
+    def sync_sequence(model):
+        # Id вставлены явно, поэтому последовательность SERIAL в PostgreSQL сама не сдвинулась:
+        # без этого следующий INSERT без id получил бы уже занятый id
+        table = model._meta.table_name
+        database.execute_sql(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                             f"COALESCE((SELECT MAX(id) FROM \"{table}\"), 1), "
+                             f"(SELECT MAX(id) FROM \"{table}\") IS NOT NULL)")
+
+    def pick(model_ids, kind):
+        low, high = SYNTHETIC_FAN_OUT[kind]
+        return rng.sample(model_ids, min(rng.randint(low, high), len(model_ids)))
+
+    with database.atomic():
+        first = next_id(Author)
+        insert(Author, ({'id': first + i, 'name': f'Автор {first + i}',
+                         'country': rng.choice(SYNTHETIC_COUNTRIES),
+                         'birth_date': f'{rng.randint(1750, 1990)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                         'biography': ' '.join(rng.choices(SYNTHETIC_WORDS, k=20))}
+                        for i in range(max(books // 10, 1))))
+        first = next_id(Genre)
+        insert(Genre, ({'id': first + i, 'name': f'Жанр {first + i}'} for i in range(20)))
+        log_model_changes(Genre, 'genre', Genre.id >= first)
+        first = next_id(Tag)
+        insert(Tag, ({'id': first + i, 'name': f'тег {first + i}'} for i in range(100)))
+        log_model_changes(Tag, 'tag', Tag.id >= first)
+        touch_tables('author', 'genre', 'tag')
+
+    ids = {'author': [row_id for row_id, in Author.select(Author.id).tuples()],
+           'genre': [row_id for row_id, in Genre.select(Genre.id).tuples()],
+           'tag': [row_id for row_id, in Tag.select(Tag.id).tuples()]}
+    links = {'author': BookAuthor, 'genre': BookGenre, 'tag': BookTag}
+
+    first = next_id(Book)
+    for start in range(0, books, RELATION_CHUNK_SIZE):
+        book_ids = list(range(first + start, first + min(start + RELATION_CHUNK_SIZE, books)))
+        with database.atomic():
+            insert(Book, [{'id': book_id,
+                           'title': f'{rng.choice(SYNTHETIC_ADJECTIVES)} {rng.choice(SYNTHETIC_NOUNS)} {book_id}',
+                           'isbn': f'{book_id:013d}',
+                           'publication_year': rng.randint(1800, 2024),
+                           'page_count': rng.randint(50, 1500),
+                           'description': ' '.join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(10, 60)))}
+                          for book_id in book_ids])
+            for kind, link_model in links.items():
+                insert(link_model, [{'book': book_id, kind: other_id}
+                                    for book_id in book_ids for other_id in pick(ids[kind], kind)])
+            DatabaseManager.reindex_books(book_ids)
+            DatabaseManager.refresh_book_documents(book_ids)
+            log_changes('book', book_ids)
+
+    # Количество книг меняется и у существовавших авторов, поэтому в журнал попадают все авторы
+    with database.atomic():
+        DatabaseManager.recount_book_counts()
+        log_model_changes(Author, 'author')
+        if isinstance(database.obj, PostgresqlDatabase):
+            for model in (Author, Genre, Tag, Book):
+                sync_sequence(model)
+    touch_tables('book', 'author', 'genre', 'tag')
+    forget_counts('books')
+    forget_counts('authors')
+    get_cache().clear()
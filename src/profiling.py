@@ -0,0 +1,168 @@
+"""Профилирование запросов к базе: сколько SQL-запросов выполнил каждый HTTP-запрос и сколько они заняли.
+
+К каждому ответу добавляются заголовки X-DB-Queries, X-DB-Time (мс) и
+Server-Timing (db и app - их видно в инструментах разработчика браузера).
+Запросы медленнее slow_query_ms печатаются вместе с параметрами и планом
+выполнения (EXPLAIN QUERY PLAN в SQLite, EXPLAIN в PostgreSQL). Итоги по
+эндпоинтам доступны через endpoint_stats() и GET /api/profiling.
+
+Время запроса - это время execute_sql: у SELECT в SQLite оно включает поиск
+первой строки, но не чтение остальных.
+"""
+import threading
+import time
+
+from flask import g, has_request_context, request
+from peewee import PostgresqlDatabase
+
+from src.config import config
+from src.models import database
+
+# Какие запросы можно передавать в EXPLAIN
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+# Функции listener(elapsed), вызываемые после каждого SQL-запроса (например, метрики)
+QUERY_LISTENERS = []
+
+# Итоги по эндпоинтам: "GET /api/books" -> словарь счетчиков
+_endpoint_stats = {}
+_stats_lock = threading.Lock()
+
+
+class RequestStats:
+    """Счетчики SQL-запросов одного HTTP-запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slow_queries = 0
+        self.status = None
+
+    def record(self, elapsed, slow):
+        self.queries += 1
+        self.db_time += elapsed
+        if slow:
+            self.slow_queries += 1
+
+
+def explain(db, execute_sql, sql, params):
+    """План выполнения запроса строками текста; None, если его не получить"""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    prefix = 'EXPLAIN ' if isinstance(db, PostgresqlDatabase) else 'EXPLAIN QUERY PLAN '
+    try:
+        rows = execute_sql(prefix + sql, params).fetchall()
+    except Exception as e:
+        return [f'не удалось получить план: {e}']
+    # SQLite: (id, parent, notused, detail), PostgreSQL: (строка плана,)
+    return [str(row[-1]) for row in rows]
+
+
+def log_slow_query(db, execute_sql, sql, params, elapsed):
+    endpoint = current_endpoint() if has_request_context() else None
+    print(f"Медленный запрос ({elapsed * 1000:.1f} мс{', ' + endpoint if endpoint else ''}): {sql}")
+    print(f"  параметры: {params}")
+    if config['slow_query_explain']:
+        plan = explain(db, execute_sql, sql, params)
+        if plan:
+            print('  план:\n' + '\n'.join(f'    {line}' for line in plan))
+
+
+def instrument(db):
+    """Обернуть execute_sql базы db подсчетом и замером времени (один раз на объект базы)"""
+    if getattr(db, '_profiling_original', None) is not None:
+        return
+    original = db.execute_sql
+
+    def execute_sql(sql, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(sql, params, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            slow = elapsed * 1000 >= config['slow_query_ms']
+            stats = g.get('db_stats') if has_request_context() else None
+            if stats is not None:
+                stats.record(elapsed, slow)
+            for listener in QUERY_LISTENERS:
+                listener(elapsed)
+            if slow:
+                log_slow_query(db, original, sql, params, elapsed)
+
+    db._profiling_original = original
+    db.execute_sql = execute_sql
+
+
+def current_endpoint():
+    """Эндпоинт запроса для статистики: метод и шаблон маршрута (GET /api/books/<int:book_id>)"""
+    rule = request.url_rule.rule if request.url_rule else '<не найден>'
+    return f'{request.method} {rule}'
+
+
+def start_request():
+    instrument(database.obj)
+    g.db_stats = RequestStats()
+
+
+def add_headers(response):
+    stats = g.get('db_stats')
+    if stats is None:
+        return response
+    stats.status = response.status_code
+    db_ms = stats.db_time * 1000
+    app_ms = (time.perf_counter() - stats.started) * 1000
+    response.headers['X-DB-Queries'] = str(stats.queries)
+    response.headers['X-DB-Time'] = f'{db_ms:.3f}'
+    response.headers['Server-Timing'] = (f'db;dur={db_ms:.3f};desc="{stats.queries} SQL", '
+                                         f'app;dur={app_ms:.3f}')
+    return response
+
+
+def finish_request(exc):
+    """Учесть запрос в итогах эндпоинта (для потоковых ответов - после отправки всего тела)"""
+    stats = g.pop('db_stats', None)
+    if stats is None:
+        return
+    elapsed = (time.perf_counter() - stats.started) * 1000
+    endpoint = current_endpoint()
+    with _stats_lock:
+        item = _endpoint_stats.setdefault(endpoint, {
+            'requests': 0, 'errors': 0, 'time_ms': 0.0, 'max_time_ms': 0.0,
+            'db_queries': 0, 'db_time_ms': 0.0, 'slow_queries': 0,
+        })
+        item['requests'] += 1
+        item['errors'] += 1 if exc is not None or (stats.status or 500) >= 500 else 0
+        item['time_ms'] += elapsed
+        item['max_time_ms'] = max(item['max_time_ms'], elapsed)
+        item['db_queries'] += stats.queries
+        item['db_time_ms'] += stats.db_time * 1000
+        item['slow_queries'] += stats.slow_queries
+
+
+def endpoint_stats():
+    """Итоги по эндпоинтам со средними значениями на запрос"""
+    with _stats_lock:
+        items = {endpoint: dict(item) for endpoint, item in _endpoint_stats.items()}
+    for item in items.values():
+        requests = item['requests']
+        item['avg_time_ms'] = round(item['time_ms'] / requests, 3)
+        item['avg_db_queries'] = round(item['db_queries'] / requests, 2)
+        item['avg_db_time_ms'] = round(item['db_time_ms'] / requests, 3)
+        for key in ('time_ms', 'max_time_ms', 'db_time_ms'):
+            item[key] = round(item[key], 3)
+    return items
+
+
+def reset_stats():
+    with _stats_lock:
+        _endpoint_stats.clear()
+
+
+def init_app(app):
+    """Включить профилирование для приложения Flask (если profiling_enabled)"""
+    if not config['profiling_enabled']:
+        return
+    app.before_request(start_request)
+    app.after_request(add_headers)
+    app.teardown_request(finish_request)
@@ -0,0 +1,120 @@
+import decimal
+import json
+import uuid
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+from src.models import Author, Book, Genre, Tag
+
+# orjson - необязательная зависимость: без нее используется стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ModelSerializer:
+    """Преобразование строк модели в словари без model_to_dict.
+
+    Список полей определяется один раз при создании сериализатора, а строки
+    читаются из базы кортежами (.tuples()), поэтому на каждую строку
+    приходится только zip имен полей со значениями.
+    """
+
+    def __init__(self, model, fields=None):
+        self.model = model
+        if fields is None:
+            self.fields = list(model._meta.sorted_fields)
+        else:
+            self.fields = [model._meta.fields[name] for name in fields]
+        self.names = tuple(field.name for field in self.fields)
+
+    def select(self, *extra):
+        """SELECT только полей сериализатора (и дополнительных столбцов extra в конце строки)"""
+        return self.model.select(*self.fields, *extra)
+
+    def row(self, values):
+        return dict(zip(self.names, values))
+
+    def rows(self, query):
+        """Словари по запросу, построенному через select()"""
+        names = self.names
+        return [dict(zip(names, values)) for values in query.tuples()]
+
+    def iterate(self, query):
+        """То же, что rows(), но без кэширования строк запроса (серверный курсор)"""
+        names = self.names
+        for values in query.tuples().iterator():
+            yield dict(zip(names, values))
+
+    def instance(self, obj):
+        """Словарь по уже загруженному экземпляру модели"""
+        data = obj.__data__
+        return {name: data.get(name) for name in self.names}
+
+
+AUTHOR_SERIALIZER = ModelSerializer(Author)
+# Автор внутри книги - без book_count, иначе каждая новая книга автора меняла бы все его книги
+EMBEDDED_AUTHOR_SERIALIZER = ModelSerializer(
+    Author, [field.name for field in Author._meta.sorted_fields if field.name != 'book_count'])
+BOOK_SERIALIZER = ModelSerializer(Book)
+GENRE_SERIALIZER = ModelSerializer(Genre)
+TAG_SERIALIZER = ModelSerializer(Tag)
+
+
+def dumps_document(obj):
+    """JSON-текст документа книги в том же виде, что и в ответах API (ключи по алфавиту, даты в формате HTTP)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS).decode('utf-8')
+    return json.dumps(obj, default=json_default, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def loads_document(text):
+    """Словарь книги из JSON-текста документа (даты остаются строками)"""
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def json_default(value):
+    """Типы, которые не сериализуются в JSON напрямую; даты - в формате HTTP, как у Flask"""
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask на orjson (если установлен), иначе стандартный.
+
+    Формат дат тот же, что у стандартного провайдера Flask. orjson не
+    экранирует кириллицу (\\uXXXX), поэтому ответы еще и короче.
+    """
+
+    def _orjson_options(self):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=json_default, option=self._orjson_options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=json_default,
+                            option=self._orjson_options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
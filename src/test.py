@@ -1,4 +1,12 @@
+import os
 import requests
+import tempfile
+from contextlib import contextmanager
+from peewee import SqliteDatabase
+from src.cache import LocalCacheClient, SharedCache, get_cache, set_cache
+from src.config import config
+from src.models import Author, Genre, Tag, Book, BookAuthor, BookGenre, BookTag, BookSearch, MODELS, database
+from src.database import BookProjection, DatabaseManager, RELATION_CHUNK_SIZE, encode_cursor
 
 # отдельные методы для тестирования всех эндпойнтов, данные генерировать или запрашивать с клавиатуры
 def test_get_authors():
@@ -50,5 +58,841 @@ def test_delete_author():
 
 # отдельные тестовые методы для остальных моделей и хендлеров (кроме книги)
 
+
+@contextmanager
+def memory_database():
+    """Временно переключить модели на пустую базу в памяти"""
+    previous = database.obj
+    db = SqliteDatabase(':memory:')
+    database.initialize(db)
+    db.create_tables(MODELS + [BookSearch])
+    get_cache().clear()
+    try:
+        yield db
+    finally:
+        get_cache().clear()
+        database.initialize(previous)
+
+
+@contextmanager
+def file_database():
+    """Как memory_database, но база во временном файле: ее видят все соединения и потоки"""
+    previous = database.obj
+    db = SqliteDatabase(os.path.join(tempfile.mkdtemp(), 'library.db'))
+    database.initialize(db)
+    db.create_tables(MODELS + [BookSearch])
+    get_cache().clear()
+    try:
+        yield db
+    finally:
+        db.close()
+        get_cache().clear()
+        database.initialize(previous)
+
+
+class QueryCounter:
+    """Подсчет SQL-запросов, выполненных базой данных внутри блока with"""
+
+    def __init__(self, db):
+        self.db = db
+        self.count = 0
+
+    def __enter__(self):
+        original = self.db.execute_sql
+
+        def execute_sql(sql, params=None, *args, **kwargs):
+            self.count += 1
+            return original(sql, params, *args, **kwargs)
+
+        self.db.execute_sql = execute_sql
+        return self
+
+    def __exit__(self, *exc):
+        del self.db.execute_sql
+
+
+# Схема базы до миграций (как ее создавал исходный create_tables)
+BASELINE_SCHEMA = """
+CREATE TABLE "author" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(100) NOT NULL, "biography" TEXT,
+    "birth_date" DATE, "country" VARCHAR(50), "created_at" DATETIME NOT NULL);
+CREATE TABLE "book" ("id" INTEGER NOT NULL PRIMARY KEY, "title" VARCHAR(200) NOT NULL, "isbn" VARCHAR(13),
+    "publication_year" INTEGER, "description" TEXT, "page_count" INTEGER, "created_at" DATETIME NOT NULL);
+CREATE UNIQUE INDEX "book_isbn" ON "book" ("isbn");
+CREATE TABLE "bookauthor" ("id" INTEGER NOT NULL PRIMARY KEY, "book_id" INTEGER NOT NULL, "author_id" INTEGER NOT NULL,
+    "authorship_type" VARCHAR(50) NOT NULL, FOREIGN KEY ("book_id") REFERENCES "book" ("id"),
+    FOREIGN KEY ("author_id") REFERENCES "author" ("id"));
+CREATE INDEX "bookauthor_book_id" ON "bookauthor" ("book_id");
+CREATE INDEX "bookauthor_author_id" ON "bookauthor" ("author_id");
+CREATE TABLE "genre" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(50) NOT NULL, "description" TEXT);
+CREATE UNIQUE INDEX "genre_name" ON "genre" ("name");
+CREATE TABLE "bookgenre" ("id" INTEGER NOT NULL PRIMARY KEY, "book_id" INTEGER NOT NULL, "genre_id" INTEGER NOT NULL,
+    FOREIGN KEY ("book_id") REFERENCES "book" ("id"), FOREIGN KEY ("genre_id") REFERENCES "genre" ("id"));
+CREATE INDEX "bookgenre_book_id" ON "bookgenre" ("book_id");
+CREATE INDEX "bookgenre_genre_id" ON "bookgenre" ("genre_id");
+CREATE TABLE "tag" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(30) NOT NULL);
+CREATE UNIQUE INDEX "tag_name" ON "tag" ("name");
+CREATE TABLE "booktag" ("id" INTEGER NOT NULL PRIMARY KEY, "book_id" INTEGER NOT NULL, "tag_id" INTEGER NOT NULL,
+    FOREIGN KEY ("book_id") REFERENCES "book" ("id"), FOREIGN KEY ("tag_id") REFERENCES "tag" ("id"));
+CREATE INDEX "booktag_book_id" ON "booktag" ("book_id");
+CREATE INDEX "booktag_tag_id" ON "booktag" ("tag_id");
+INSERT INTO "author" VALUES (1, 'Лев Толстой', NULL, NULL, 'Россия', '2024-01-01 10:00:00');
+INSERT INTO "author" VALUES (2, 'Пётр Ершов', NULL, NULL, 'Россия', '2024-01-01 10:00:00');
+INSERT INTO "book" VALUES (1, 'Война и мир', '111', 1869, NULL, 1300, '2024-01-02 10:00:00');
+INSERT INTO "book" VALUES (2, 'Конёк-Горбунок', NULL, 1834, NULL, NULL, '2024-01-03 10:00:00');
+INSERT INTO "genre" VALUES (1, 'Роман', NULL);
+INSERT INTO "tag" VALUES (1, 'классика');
+INSERT INTO "bookauthor" VALUES (1, 1, 1, 'автор'), (2, 1, 1, 'автор'), (3, 2, 2, 'автор'), (4, 2, 2, 'автор');
+INSERT INTO "bookgenre" VALUES (1, 1, 1), (2, 1, 1);
+INSERT INTO "booktag" VALUES (1, 1, 1), (2, 2, 1);
+"""
+
+
+def test_migrate_baseline_database():
+    # существующая база исходной схемы с повторяющимися связями обновляется всеми миграциями по порядку
+    from peewee import IntegrityError
+    from src.migrations import MIGRATIONS, migrate_database
+    from src.models import ChangeLog, SchemaVersion
+
+    previous = database.obj
+    db = SqliteDatabase(os.path.join(tempfile.mkdtemp(), 'library.db'))
+    database.initialize(db)
+    get_cache().clear()
+    try:
+        for statement in BASELINE_SCHEMA.split(';'):
+            if statement.strip():
+                db.execute_sql(statement)
+        db.close()
+
+        versions = [version for version, _, _ in MIGRATIONS]
+        assert migrate_database() == versions
+
+        with db.connection_context():
+            assert [version for version, in SchemaVersion.select(SchemaVersion.version).tuples()] == versions
+            # повторяющиеся связи удалены, остались самые ранние
+            assert [link.id for link in BookAuthor.select().order_by(BookAuthor.id)] == [1, 3]
+            assert BookGenre.select().count() == 1 and BookTag.select().count() == 2
+            try:
+                with db.atomic():
+                    BookAuthor.create(book=1, author=1)
+                raise AssertionError('уникальный индекс (book, author) не создан')
+            except IntegrityError:
+                pass
+
+            # заполненные миграциями столбцы
+            assert [author.book_count for author in Author.select().order_by(Author.id)] == [1, 1]
+            for book in Book.select():
+                assert book.version == 1 and book.updated_at == book.created_at
+            assert ChangeLog.select().count() == 6  # 2 автора, 2 книги, жанр и тег
+            books, _ = DatabaseManager.search_books('конек', 10)
+            assert [book['id'] for book in books] == [2]
+
+        # повторный запуск ничего не делает
+        assert migrate_database() == []
+        with db.connection_context():
+            assert SchemaVersion.select().count() == len(versions)
+    finally:
+        db.close()
+        get_cache().clear()
+        database.initialize(previous)
+
+
+def test_get_all_books_query_count():
+    # число запросов не должно расти вместе с количеством книг
+    with memory_database() as db:
+        author = Author.create(name='Лев Толстой')
+        genre = Genre.create(name='Роман')
+        tag = Tag.create(name='классика')
+        book_count = RELATION_CHUNK_SIZE + 10
+        for i in range(book_count):
+            book = Book.create(title=f'Книга {i}')
+            BookAuthor.create(book=book, author=author)
+            BookGenre.create(book=book, genre=genre)
+            BookTag.create(book=book, tag=tag)
+
+        with QueryCounter(db) as counter:
+            books = DatabaseManager.get_all_books()
+
+        assert len(books) == book_count
+        assert all(len(book['authors']) == 1 for book in books)
+        assert books[0]['genres'][0]['name'] == 'Роман'
+        # 1 запрос на книги + 3 запроса на каждую пачку связей
+        chunks = (book_count + RELATION_CHUNK_SIZE - 1) // RELATION_CHUNK_SIZE
+        assert counter.count == 1 + 3 * chunks, counter.count
+
+        with QueryCounter(db) as counter:
+            book = DatabaseManager.get_book_by_id(books[0]['id'])
+        assert book['tags'][0]['name'] == 'классика'
+        # версия для ключа кэша + книга + 3 запроса связей
+        assert counter.count == 5, counter.count
+
+
+def test_book_cache_invalidation():
+    # кэш с внешним хранилищем, замененным на LocalCacheClient
+    previous = get_cache()
+    cache = set_cache(SharedCache(LocalCacheClient()))
+    try:
+        with memory_database() as db:
+            author = Author.create(name='Лев Толстой')
+            book, _ = DatabaseManager.create_book({'title': 'Война и мир', 'author_ids': [author.id]})
+
+            # при попадании в кэш читается только версия книги
+            with QueryCounter(db) as counter:
+                DatabaseManager.get_book_by_id(book['id'])
+            assert counter.count == 1, counter.count
+
+            # изменение автора сбрасывает закэшированные книги этого автора
+            DatabaseManager.update_author(author.id, {'name': 'Л. Н. Толстой'})
+            book = DatabaseManager.get_book_by_id(book['id'])
+            assert book['authors'][0]['name'] == 'Л. Н. Толстой'
+
+            DatabaseManager.update_book(book['id'], {'title': 'Война и мир. Том 1'})
+            assert DatabaseManager.get_book_by_id(book['id'])['title'] == 'Война и мир. Том 1'
+
+            DatabaseManager.delete_book(book['id'])
+            assert DatabaseManager.get_book_by_id(book['id']) is None
+            assert cache.hits > 0 and cache.misses > 0
+    finally:
+        set_cache(previous)
+
+
+class InterleavingCache(SharedCache):
+    """Кэш, выполняющий before_set перед первой записью: изменение между промахом и записью в кэш"""
+
+    def __init__(self, client, before_set):
+        super().__init__(client)
+        self.before_set = before_set
+
+    def set(self, key, value):
+        before_set, self.before_set = self.before_set, None
+        if before_set:
+            before_set()
+        super().set(key, value)
+
+
+def test_book_cache_stale_set():
+    # читатель, прочитавший книгу до изменения и закэшировавший ее после, не подменяет новую версию
+    previous = get_cache()
+    try:
+        with memory_database():
+            book, _ = DatabaseManager.create_book({'title': 'Война и мир'})
+            other, _ = DatabaseManager.create_book({'title': 'Анна Каренина'})
+
+            set_cache(InterleavingCache(LocalCacheClient(), lambda: DatabaseManager.update_book(
+                book['id'], {'title': 'Война и мир. Том 1'})))
+            assert DatabaseManager.get_book_by_id(book['id'])['title'] == 'Война и мир'
+            assert DatabaseManager.get_book_by_id(book['id'])['title'] == 'Война и мир. Том 1'
+
+            set_cache(InterleavingCache(LocalCacheClient(), lambda: DatabaseManager.update_book(
+                other['id'], {'title': 'Анна Каренина. Том 1'})))
+            DatabaseManager.get_books_by_ids([other['id']])
+            books, _ = DatabaseManager.get_books_by_ids([other['id']])
+            assert books[0]['title'] == 'Анна Каренина. Том 1'
+
+            author = Author.create(name='Лев Толстой')
+            set_cache(InterleavingCache(LocalCacheClient(), lambda: DatabaseManager.update_author(
+                author.id, {'name': 'Л. Н. Толстой'})))
+            assert DatabaseManager.get_author_by_id(author.id)['name'] == 'Лев Толстой'
+            assert DatabaseManager.get_author_by_id(author.id)['name'] == 'Л. Н. Толстой'
+    finally:
+        set_cache(previous)
+
+
+def test_cache_foreign_writes():
+    # записи другого рабочего процесса не сбрасывают кэш этого, но новая версия читается мимо старых ключей
+    from src.models import touch_tables
+
+    with memory_database():
+        book, _ = DatabaseManager.create_book({'title': 'Война и мир'})
+        Genre.create(name='Роман')
+        touch_tables('genre')
+        assert DatabaseManager.get_book_by_id(book['id'])['title'] == 'Война и мир'
+        assert [genre['name'] for genre in DatabaseManager.get_all_genres()] == ['Роман']
+
+        Book.update(title='Война и мир. Том 1', version=Book.version + 1).where(Book.id == book['id']).execute()
+        Genre.create(name='Поэма')
+        touch_tables('genre')
+        assert DatabaseManager.get_book_by_id(book['id'])['title'] == 'Война и мир. Том 1'
+        assert [genre['name'] for genre in DatabaseManager.get_all_genres()] == ['Поэма', 'Роман']
+
+
+def test_batch_rollback():
+    # атомарный пакет откатывается целиком, мультизапрос возвращает книги в порядке id
+    with memory_database() as db:
+        first, _ = DatabaseManager.create_book({'title': 'Анна Каренина'})
+        second, _ = DatabaseManager.create_book({'title': 'Воскресение'})
+
+        with QueryCounter(db) as counter:
+            books, missing = DatabaseManager.get_books_by_ids([second['id'], 999, first['id']])
+        assert [book['title'] for book in books] == ['Воскресение', 'Анна Каренина']
+        assert missing == [999]
+        # созданные книги уже в кэше, из базы читается только отсутствующая
+        assert counter.count == 1, counter.count
+
+        results = DatabaseManager.execute_batch([
+            {'op': 'update', 'type': 'book', 'id': first['id'], 'data': {'title': 'Анна'}},
+            {'op': 'delete', 'type': 'book', 'id': 999},
+            {'op': 'delete', 'type': 'book', 'id': second['id']},
+        ], atomic=True)
+        assert [result['status'] for result in results] == [409, 404, 424]
+        assert DatabaseManager.get_book_by_id(first['id'])['title'] == 'Анна Каренина'
+        assert Book.select().count() == 2
+
+
+def test_stream_books():
+    # каталог отдается потоком NDJSON и потоковым JSON-массивом, пачки не теряют и не повторяют книги
+    import json
+    from src.app import create_app
+
+    with file_database():
+        author = Author.create(name='Лев Толстой')
+        titles = [f'Книга {i}' for i in range(5)]
+        for title in titles:
+            DatabaseManager.create_book({'title': title, 'author_ids': [author.id]})
+        assert [book['title'] for book in DatabaseManager.iter_books(batch_size=2)] == titles
+
+        client = create_app().test_client()
+        response = client.get('/api/books', query_string={'stream': 'ndjson'})
+        assert response.mimetype == 'application/x-ndjson'
+        books = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [book['title'] for book in books] == titles
+        assert books[0]['authors'][0]['name'] == 'Лев Толстой'
+
+        response = client.get('/api/books', query_string={'stream': '1'})
+        assert [book['title'] for book in json.loads(response.get_data())['data']] == titles
+
+
+def test_update_book_changes():
+    # записываются только изменившиеся поля и связи, без изменений книга не записывается
+    with memory_database():
+        tag_ids = [Tag.create(name=name).id for name in ('классика', 'роман', 'война')]
+        book, _ = DatabaseManager.create_book({'title': 'Война и мир', 'page_count': 1300,
+                                               'tag_ids': tag_ids[:2]})
+
+        same, changes, error = DatabaseManager.update_book(
+            book['id'], {'title': 'Война и мир', 'page_count': 1300, 'tag_ids': tag_ids[:2]})
+        assert error is None and changes == {} and same['version'] == book['version']
+
+        updated, changes, _ = DatabaseManager.update_book(
+            book['id'], {'title': 'Война и мир', 'page_count': 1225, 'tag_ids': tag_ids[1:]})
+        assert changes == {'fields': ['page_count'],
+                           'tag_ids': {'added': [tag_ids[2]], 'removed': [tag_ids[0]]}}
+        assert updated['version'] == book['version'] + 1
+        assert sorted(tag['id'] for tag in updated['tags']) == tag_ids[1:]
+
+        # связи - только списки id, ошибка относится к полю, а не к тексту исключения Python
+        for data in ({'author_ids': 5}, {'tag_ids': ['классика']}, {'genre_ids': [True]}):
+            _, _, error = DatabaseManager.update_book(book['id'], data)
+            assert error == f'Поле "{next(iter(data))}" должно быть списком id', error
+        assert DatabaseManager.create_book({'title': 'Анна Каренина', 'author_ids': 5})[1] is not None
+        assert DatabaseManager.update_book(book['id'], {'tag_ids': None})[1] == {
+            'tag_ids': {'added': [], 'removed': tag_ids[1:]}}
+
+
+def test_update_author_unchanged():
+    # обновление автора теми же значениями не меняет ни автора, ни версии его книг, ни журнал
+    from peewee import fn
+    from src.models import ChangeLog
+
+    with memory_database():
+        author = Author.create(name='Лев Толстой', country='Россия', birth_date='1828-09-09')
+        book, _ = DatabaseManager.create_book({'title': 'Война и мир', 'author_ids': [author.id]})
+        last_seq = ChangeLog.select(fn.MAX(ChangeLog.seq)).scalar()
+
+        same, error = DatabaseManager.update_author(
+            author.id, {'name': 'Лев Толстой', 'country': 'Россия', 'birth_date': '1828-09-09'})
+        assert error is None and same['version'] == author.version
+        assert DatabaseManager.get_book_by_id(book['id'])['version'] == book['version']
+        assert ChangeLog.select(fn.MAX(ChangeLog.seq)).scalar() == last_seq
+
+        updated, _ = DatabaseManager.update_author(author.id, {'name': 'Лев Толстой', 'country': 'СССР'})
+        assert updated['version'] == author.version + 1 and updated['country'] == 'СССР'
+        assert DatabaseManager.get_book_by_id(book['id'])['version'] == book['version'] + 1
+
+
+def test_book_filters_facets():
+    # фильтры по связям и диапазонам сужают список, фасеты считаются по отфильтрованным книгам
+    from src.app import create_app
+
+    with file_database():
+        novel, poem = Genre.create(name='Роман'), Genre.create(name='Поэма')
+        for title, year, genre in (('Война и мир', 1869, novel), ('Анна Каренина', 1878, novel),
+                                   ('Евгений Онегин', 1833, novel), ('Медный всадник', 1837, poem)):
+            DatabaseManager.create_book({'title': title, 'publication_year': year, 'genre_ids': [genre.id]})
+        client = create_app().test_client()
+
+        response = client.get('/api/books', query_string={'genre_id': novel.id, 'year_from': 1860,
+                                                         'facets': 'genre,year', 'limit': 10, 'with_total': 1})
+        assert [book['title'] for book in response.json['data']] == ['Анна Каренина', 'Война и мир']
+        assert response.json['total'] == 2
+        assert response.json['facets']['genre'] == [{'id': novel.id, 'name': 'Роман', 'count': 2}]
+        assert [item['year'] for item in response.json['facets']['year']] == [1869, 1878]
+
+        response = client.get('/api/books', query_string={'genre_id': f'{novel.id},{poem.id}', 'year_to': 1840})
+        assert sorted(book['title'] for book in response.json['data']) == ['Евгений Онегин', 'Медный всадник']
+
+        assert client.get('/api/books', query_string={'year_from': 'давно'}).status_code == 400
+
+
+def test_conditional_get():
+    # повторный GET с If-None-Match получает 304 без тела, пока книга не изменилась
+    from src.app import create_app
+
+    with file_database():
+        book, _ = DatabaseManager.create_book({'title': 'Война и мир'})
+        client = create_app().test_client()
+        url = f"/api/books/{book['id']}"
+
+        response = client.get(url)
+        etag = response.headers['ETag']
+        assert response.status_code == 200 and response.headers['Last-Modified']
+
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304 and response.get_data() == b''
+        assert response.headers['ETag'] == etag
+
+        DatabaseManager.update_book(book['id'], {'title': 'Война и мир. Том 1'})
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200 and response.headers['ETag'] != etag
+        assert response.json['data']['title'] == 'Война и мир. Том 1'
+
+        assert client.get('/api/books/999', headers={'If-None-Match': etag}).status_code == 404
+
+
+def test_conditional_get_stream_format():
+    # JSON и NDJSON одного URL - разные ответы: у каждого свой ETag, и ответ зависит от Accept
+    from src.app import create_app
+
+    with file_database():
+        DatabaseManager.create_book({'title': 'Война и мир'})
+        client = create_app().test_client()
+
+        response = client.get('/api/books')
+        etag = response.headers['ETag']
+        assert 'Accept' in response.headers['Vary']
+
+        ndjson = {'Accept': 'application/x-ndjson'}
+        response = client.get('/api/books', headers=dict(ndjson, **{'If-None-Match': etag}))
+        assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+        ndjson_etag = response.headers['ETag']
+        assert ndjson_etag != etag and 'Accept' in response.headers['Vary']
+        response.close()
+
+        response = client.get('/api/books', headers=dict(ndjson, **{'If-None-Match': ndjson_etag}))
+        assert response.status_code == 304 and 'Accept' in response.headers['Vary']
+        assert client.get('/api/books', headers={'If-None-Match': ndjson_etag}).status_code == 200
+
+
+def test_book_projection():
+    # ?fields= выбирает поля книги и связей, ?include= - загружаемые связи; лишние связи не читаются
+    from src.app import create_app
+
+    with file_database() as db:
+        author = Author.create(name='Лев Толстой')
+        tag = Tag.create(name='классика')
+        book, _ = DatabaseManager.create_book({'title': 'Война и мир', 'isbn': '111',
+                                               'author_ids': [author.id], 'tag_ids': [tag.id]})
+        client = create_app().test_client()
+
+        response = client.get(f"/api/books/{book['id']}", query_string={'fields': 'title,authors.name'})
+        assert response.json['data'] == {'id': book['id'], 'title': 'Война и мир',
+                                         'authors': [{'id': author.id, 'name': 'Лев Толстой'}]}
+
+        response = client.get('/api/books', query_string={'include': 'tags', 'limit': 10})
+        data = response.json['data'][0]
+        assert data['isbn'] == '111' and data['tags'][0]['name'] == 'классика'
+        assert 'authors' not in data and 'genres' not in data
+
+        for query in ({'fields': 'title,price'}, {'fields': 'authors.email'}, {'include': 'publisher'}):
+            assert client.get('/api/books', query_string=query).status_code == 400, query
+
+        # без связей страница книг - один запрос
+        projection = BookProjection.parse(fields='id,isbn')
+        with QueryCounter(db) as counter:
+            books, _ = DatabaseManager.get_books_page(10, projection=projection)
+        assert books == [{'id': book['id'], 'isbn': '111'}] and counter.count == 1, counter.count
+
+
+def test_compression_negotiation():
+    # сжатие по Accept-Encoding: тело распаковывается в тот же JSON, ETag с суффиксом, 304 по любому варианту
+    import gzip
+    import json
+    from src.app import create_app
+
+    with file_database():
+        for i in range(50):
+            DatabaseManager.create_author({'name': f'Автор {i}', 'biography': 'Русский писатель'})
+        client = create_app().test_client()
+
+        plain = client.get('/api/authors')
+        assert 'Content-Encoding' not in plain.headers and 'Accept-Encoding' in plain.headers['Vary']
+
+        response = client.get('/api/authors', headers={'Accept-Encoding': 'br;q=0.5, gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(response.get_data())) == plain.json
+        assert response.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+
+        response = client.get('/api/authors', headers={'Accept-Encoding': 'gzip',
+                                                       'If-None-Match': plain.headers['ETag']})
+        assert response.status_code == 304
+
+        # ответ меньше compression_min_size не сжимается
+        response = client.get('/api/genres', headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200 and 'Content-Encoding' not in response.headers
+
+
+def test_bulk_create_partial_failure():
+    # несуществующий автор или жанр отклоняет только свою книгу, upsert обновляет книгу по ISBN
+    with memory_database():
+        author = Author.create(name='Лев Толстой')
+        genre = Genre.create(name='Роман')
+        existing, _ = DatabaseManager.create_book({'title': 'Война и мир', 'isbn': '111', 'author_ids': [author.id]})
+
+        results = DatabaseManager.bulk_create_books([
+            {'title': 'Анна Каренина', 'author_ids': [author.id], 'genre_ids': [genre.id]},
+            {'title': 'Чужая книга', 'author_ids': [author.id, 999]},
+            {'title': 'Без жанра', 'genre_ids': [998]},
+            {'title': 'Война и мир. Том 1', 'isbn': '111', 'author_ids': []},
+            {'title': 'Воскресение', 'tag_ids': 'классика'},
+        ], upsert=True)
+
+        assert [result['success'] for result in results] == [True, False, False, True, False]
+        assert '999' in results[1]['error'] and '998' in results[2]['error']
+        assert results[3] == {'index': 3, 'success': True, 'id': existing['id'], 'action': 'updated'}
+        assert Book.select().count() == 2
+
+        book = DatabaseManager.get_book_by_id(existing['id'])
+        assert book['title'] == 'Война и мир. Том 1' and book['authors'] == []
+        assert book['version'] == existing['version'] + 1
+        assert DatabaseManager.get_author_by_id(author.id)['book_count'] == 1
+
+        # пачка откатилась целиком: ее ISBN не считаются занятыми в следующих пачках
+        results = DatabaseManager.bulk_create_books([
+            {'title': 'Хаджи-Мурат', 'isbn': '222'},
+            {'title': 'Без года', 'publication_year': [1869]},
+            {'title': 'Хаджи-Мурат', 'isbn': '222'},
+        ], batch_size=2)
+        assert [result['success'] for result in results] == [False, False, True], results
+
+
+def test_author_book_count():
+    # book_count меняется вместе со связями книги, книги автора читаются по курсору
+    with memory_database():
+        tolstoy = Author.create(name='Лев Толстой')
+        pushkin = Author.create(name='Александр Пушкин')
+        ids = [DatabaseManager.create_book({'title': f'Книга {i}', 'author_ids': [tolstoy.id]})[0]['id']
+               for i in range(3)]
+
+        DatabaseManager.update_book(ids[0], {'author_ids': [pushkin.id]})
+        DatabaseManager.delete_book(ids[1])
+        assert DatabaseManager.get_author_by_id(tolstoy.id)['book_count'] == 1
+        assert DatabaseManager.get_author_by_id(pushkin.id)['book_count'] == 1
+        assert DatabaseManager.recount_book_counts() == 0
+
+        authors, _ = DatabaseManager.get_authors_page(10, sort='-book_count', filters={'min_books': 1})
+        assert len(authors) == 2
+
+        _, books, cursor = DatabaseManager.get_author_books(tolstoy.id, 1)
+        assert [book['id'] for book in books] == [ids[2]] and cursor is None
+
+
+def test_book_documents():
+    # документ книги пересобирается при записи и заменяет сборку книги из пяти таблиц
+    previous = config['book_documents_enabled']
+    config['book_documents_enabled'] = True
+    try:
+        with memory_database() as db:
+            author = Author.create(name='Лев Толстой')
+            book, _ = DatabaseManager.create_book({'title': 'Война и мир', 'author_ids': [author.id]})
+            DatabaseManager.update_author(author.id, {'name': 'Л. Н. Толстой'})
+            get_cache().clear()
+
+            with QueryCounter(db) as counter:
+                book = DatabaseManager.get_book_by_id(book['id'])
+            assert book['authors'][0]['name'] == 'Л. Н. Толстой'
+            assert counter.count == 1, counter.count
+
+            with QueryCounter(db) as counter:
+                books, _ = DatabaseManager.get_books_page(10)
+            assert books[0]['title'] == 'Война и мир' and counter.count == 1, counter.count
+    finally:
+        config['book_documents_enabled'] = previous
+
+
+def test_search_yo():
+    # "ё" и "е" не различаются ни в названии, ни в именах авторов, ни в запросе
+    with memory_database():
+        author = Author.create(name='Пётр Ершов')
+        book, _ = DatabaseManager.create_book({'title': 'Конёк-Горбунок', 'author_ids': [author.id]})
+        DatabaseManager.create_book({'title': 'Мертвые души'})
+
+        for text in ('конек', 'Конёк', 'петр ершов', 'КОНЕ'):
+            books, _ = DatabaseManager.search_books(text, 10)
+            assert [found['id'] for found in books] == [book['id']], text
+        books, _ = DatabaseManager.search_books('мёртвые', 10)
+        assert [found['title'] for found in books] == ['Мертвые души']
+
+
+def test_change_feed():
+    # журнал изменений: последняя запись об объекте, удаление - tombstone, сжатие убирает замененные записи
+    with memory_database():
+        author = Author.create(name='Лев Толстой')
+        book, _ = DatabaseManager.create_book({'title': 'Война и мир', 'author_ids': [author.id]})
+        DatabaseManager.update_book(book['id'], {'title': 'Война и мир. Том 1'})
+
+        changes, last_seq, has_more = DatabaseManager.get_changes(0, 100)
+        assert [(change['type'], change['op']) for change in changes] == [('author', 'upsert'), ('book', 'upsert')]
+        assert changes[1]['data']['title'] == 'Война и мир. Том 1' and not has_more
+
+        DatabaseManager.delete_book(book['id'])
+        changes, _, _ = DatabaseManager.get_changes(last_seq, 100)
+        assert [(change['type'], change['op']) for change in changes] == [('author', 'upsert'), ('book', 'delete')]
+
+        assert DatabaseManager.compact_changes() > 0
+        changes, _, _ = DatabaseManager.get_changes(0, 100)
+        assert [change['op'] for change in changes] == ['upsert', 'delete']
+
+
+def test_changes_waiters():
+    # long-poll просыпается сразу после записи, а ожидающих не больше changes_max_waiters
+    import threading
+    import time
+    from src.app import create_app
+    from src.writer import write
+
+    previous = config['changes_max_waiters']
+    config['changes_max_waiters'] = 1
+    try:
+        with file_database():
+            app = create_app()
+            responses = []
+            poll = threading.Thread(target=lambda: responses.append(
+                app.test_client().get('/api/changes', query_string={'since': 0, 'wait': 10})))
+            poll.start()
+            time.sleep(0.5)
+
+            busy = app.test_client().get('/api/changes', query_string={'since': 0, 'wait': 10})
+            assert busy.status_code == 503 and busy.headers['Retry-After']
+
+            started = time.monotonic()
+            write(DatabaseManager.create_author, {'name': 'Лев Толстой'})
+            poll.join(10)
+            # без сигнала ожидающий перечитал бы журнал только через CHANGES_CHECK_INTERVAL секунд
+            assert time.monotonic() - started < 1
+            assert responses[0].json['data'][0]['type'] == 'author'
+
+            # место освободилось
+            assert app.test_client().get('/api/changes', query_string={'since': 0, 'wait': 1}).status_code == 200
+    finally:
+        config['changes_max_waiters'] = previous
+
+
+def test_group_commit_writer():
+    # операции из разных потоков фиксируются группами, ошибка одной не отменяет остальные
+    import threading
+    from src.writer import GroupCommitWriter
+
+    with file_database():
+        writer = GroupCommitWriter(window_ms=50, max_batch=100)
+        try:
+            names = [f'Автор {i}' for i in range(20)] + ['Автор 0']
+            results = [None] * len(names)
+
+            def submit(index):
+                results[index] = writer.submit(DatabaseManager.create_author, {'name': names[index]}).result()
+
+            threads = [threading.Thread(target=submit, args=(index,)) for index in range(len(names))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            assert sum(1 for author, error in results if error) == 1
+            assert Author.select().count() == 20
+            assert writer.stats['transactions'] < writer.stats['operations'], writer.stats
+        finally:
+            writer.stop()
+
+
+def test_books_page_cursor():
+    # страницы книг по курсору без пропусков; курсор с неверными типами - ошибка 400, а не 500
+    from src.app import create_app
+
+    with file_database():
+        for title in ('Война и мир', 'Анна Каренина', 'Воскресение'):
+            DatabaseManager.create_book({'title': title})
+        client = create_app().test_client()
+
+        titles, cursor = [], None
+        while True:
+            response = client.get('/api/books', query_string={'limit': 2, **({'cursor': cursor} if cursor else {})})
+            assert response.status_code == 200
+            titles += [book['title'] for book in response.json['data']]
+            cursor = response.json['next_cursor']
+            if not cursor:
+                break
+        assert titles == ['Анна Каренина', 'Война и мир', 'Воскресение']
+
+        for cursor in ('не курсор', encode_cursor([['Война и мир'], 1]), encode_cursor([1, 1])):
+            response = client.get('/api/books', query_string={'limit': 2, 'cursor': cursor})
+            assert response.status_code == 400, (cursor, response.status_code)
+
+
+def test_asgi_disconnect():
+    # клиент отключился посреди потокового ответа: обработчик останавливается, поток пула освобождается
+    import asyncio
+    import threading
+    import time
+    from src.asgi import WsgiToAsgi
+
+    closed = threading.Event()
+
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/event-stream')])
+
+        def events():
+            try:
+                while True:
+                    yield b': keepalive\n\n'
+                    time.sleep(0.05)
+            finally:
+                closed.set()
+        return events()
+
+    async def run():
+        app = WsgiToAsgi(wsgi_app, max_workers=1)
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        sent = []
+        gone = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            # Отправка не падает: отключение видно только по http.disconnect
+            sent.append(message)
+            if len(sent) == 3:
+                gone.set()
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/changes', 'headers': []}
+        await asyncio.wait_for(app(scope, receive, send), 5)
+        app.executor.shutdown()
+        return sent
+
+    sent = asyncio.run(run())
+    assert closed.is_set() and sent[0]['status'] == 200
+
+
+def test_profiling_headers():
+    # заголовки профилирования считают SQL-запросы запроса; медленные запросы печатаются с параметрами и планом
+    import io
+    from contextlib import redirect_stdout
+    from src.app import create_app
+
+    with file_database():
+        Tag.create(name='классика')
+        client = create_app().test_client()
+
+        # ETag по счетчику таблицы, счетчик для ключа кэша и сами теги
+        response = client.get('/api/tags')
+        assert response.headers['X-DB-Queries'] == '3'
+        assert float(response.headers['X-DB-Time']) > 0
+        assert response.headers['Server-Timing'].startswith('db;dur=') and ', app;dur=' in response.headers['Server-Timing']
+        # теги уже в кэше
+        assert client.get('/api/tags').headers['X-DB-Queries'] == '2'
+
+        previous = config['slow_query_ms']
+        config['slow_query_ms'] = 0
+        try:
+            output = io.StringIO()
+            with redirect_stdout(output):
+                response = client.get('/api/tags')
+        finally:
+            config['slow_query_ms'] = previous
+        lines = output.getvalue().splitlines()
+        slow = [index for index, line in enumerate(lines) if line.startswith('Медленный запрос')]
+        assert len(slow) == int(response.headers['X-DB-Queries']) == 2, lines
+        assert all('GET /api/tags' in lines[index] and 'tableversion' in lines[index] for index in slow)
+        assert all(lines[index + 1] == "  параметры: ['tag']" for index in slow)
+        assert all(lines[index + 2] == '  план:' and lines[index + 3].startswith('    ') for index in slow)
+
+
+def parse_metrics(text):
+    """Разобрать текстовый формат Prometheus: {(имя, метки): значение} и {семейство: тип}"""
+    import re
+    sample = re.compile(r'^([a-z_]+)(?:\{(.*)\})? (\S+)$')
+    label = re.compile(r'([a-z_]+)="((?:[^"\\]|\\.)*)"')
+    samples, types = {}, {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            types[name] = kind
+        elif line and not line.startswith('#'):
+            match = sample.match(line)
+            assert match, line
+            name, labels, value = match.groups()
+            samples[(name, frozenset(label.findall(labels or '')))] = float(value)
+    return samples, types
+
+
+def test_metrics_endpoint():
+    # /metrics отдает разбираемый текстовый формат; счетчик запросов и гистограмма маршрута сходятся
+    from src import metrics
+    from src.app import create_app
+
+    with file_database():
+        metrics.metrics.reset()
+        client = create_app().test_client()
+        for _ in range(3):
+            assert client.get('/api/tags').status_code == 200
+        assert client.get('/api/books/999').status_code == 404
+
+        response = client.get('/metrics')
+        assert response.status_code == 200 and response.mimetype == 'text/plain'
+        samples, types = parse_metrics(response.get_data(as_text=True))
+        assert types['library_http_requests_total'] == 'counter'
+        assert types['library_http_request_duration_seconds'] == 'histogram'
+
+        def value(name, **labels):
+            return samples[(name, frozenset(labels.items()))]
+
+        route = {'method': 'GET', 'route': '/api/tags'}
+        assert value('library_http_requests_total', status='200', **route) == 3
+        assert value('library_http_requests_total', method='GET', route='/api/books/<int:book_id>', status='404') == 1
+
+        buckets = sorted((float(dict(labels)['le']), count) for (name, labels), count in samples.items()
+                         if name == 'library_http_request_duration_seconds_bucket'
+                         and dict(labels).items() >= route.items())
+        assert len(buckets) == len(metrics.REQUEST_BUCKETS) + 1
+        assert all(a[1] <= b[1] for a, b in zip(buckets, buckets[1:]))
+        assert buckets[-1] == (float('inf'), 3) and value('library_http_request_duration_seconds_count', **route) == 3
+        assert value('library_http_request_duration_seconds_sum', **route) > 0
+        assert (value('library_db_query_duration_seconds_count')
+                == value('library_db_queries_total') > 0)
+
+        previous = config['metrics_enabled']
+        config['metrics_enabled'] = False
+        try:
+            assert create_app().test_client().get('/metrics').status_code == 404
+        finally:
+            config['metrics_enabled'] = previous
+
+
+def test_benchmark_scenarios():
+    # каждый сценарий замеров выполняется на тестовом клиенте без ответов с ошибкой
+    from src.app import create_app
+    from src.benchmark import SCENARIOS, ClientDriver, benchmark_api
+    from src.models import seed_database
+
+    with file_database():
+        seed_database(books=50)
+        result = benchmark_api(ClientDriver(create_app()), requests_count=3, concurrency=1, warmup=1)
+        assert list(result['scenarios']) == list(SCENARIOS)
+        failed = {name: scenario['errors'] for name, scenario in result['scenarios'].items() if scenario['errors']}
+        assert not failed, failed
+
+
 if __name__ == "__main__":
-    test_authors()
\ No newline at end of file
+    test_authors()
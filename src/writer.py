@@ -0,0 +1,201 @@
+"""Групповая фиксация записей в SQLite: один поток-писатель на процесс.
+
+SQLite допускает только одного пишущего, поэтому при частых правках каждая
+отдельная транзакция create_book/update_book ждет блокировку и делает свой
+fsync. С включенной настройкой group_commit_enabled обработчики передают
+операции записи потоку-писателю (write), а он собирает операции, пришедшие
+в течение group_commit_window_ms миллисекунд (но не больше
+group_commit_max_batch), в одну транзакцию. Каждая операция выполняется в
+своей точке сохранения (SAVEPOINT): ошибка одной откатывает только ее.
+Результат возвращается вызывающему потоку через Future после фиксации.
+
+Транзакция писателя - обычная транзакция записи (write_transaction, в SQLite
+BEGIN IMMEDIATE), методы DatabaseManager внутри нее открывают точки сохранения.
+
+После каждой записи через write ожидающие журнал изменений (long-poll и SSE
+в GET /api/changes) просыпаются по общему условию (wait_for_commit), а не
+опрашивают базу. Записи других процессов их не будят: журнал все равно
+перечитывается по истечении таймаута ожидания.
+
+Писатель свой у каждого процесса (после fork создается заново), поэтому при
+нескольких рабочих процессах транзакции по-прежнему чередуются, но их
+становится во столько раз меньше, сколько операций попадает в группу.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from src.config import config
+from src.models import database
+
+# Сколько секунд ждать завершения начатых операций при остановке писателя
+STOP_TIMEOUT = 10
+
+
+class GroupCommitWriter:
+    """Поток, выполняющий операции записи группами в одной транзакции"""
+
+    def __init__(self, window_ms=None, max_batch=None):
+        self.window = (config['group_commit_window_ms'] if window_ms is None else window_ms) / 1000
+        self.max_batch = config['group_commit_max_batch'] if max_batch is None else max_batch
+        self.queue = queue.Queue()
+        self.pid = os.getpid()
+        self.stats = {'operations': 0, 'transactions': 0, 'failed_transactions': 0}
+        self.thread = threading.Thread(target=self.run, name='group-commit-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Поставить операцию func(*args, **kwargs) в очередь; результат - в возвращаемом Future"""
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Выполнить операции, уже стоящие в очереди, и остановить поток"""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def next_batch(self):
+        """Дождаться операции и добрать к ней пришедшие за окно; None - сигнал остановки"""
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Остановка: текущую группу выполняем, сигнал возвращаем в очередь
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+            if batch:
+                self.commit(batch)
+
+    def commit(self, batch):
+        """Выполнить группу операций в одной транзакции и передать результаты в Future"""
+        from src.database import forget_counts, write_transaction
+
+        results = []
+        database.connect(reuse_if_open=True)
+        try:
+            # Ключи кэша, сброшенные операциями, write_transaction сбрасывает повторно после фиксации
+            try:
+                with write_transaction():
+                    for future, func, args, kwargs in batch:
+                        try:
+                            with database.atomic():
+                                results.append((future, func(*args, **kwargs), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                # Не удалась сама фиксация: ни одна операция группы не записана
+                print(f"Ошибка групповой фиксации ({len(batch)} операций): {e}")
+                self.stats['failed_transactions'] += 1
+                results = [(future, None, e) for future, _, _, _ in batch]
+
+            forget_counts('books')
+            forget_counts('authors')
+        finally:
+            database.close()
+        notify_commit()
+
+        self.stats['operations'] += len(batch)
+        self.stats['transactions'] += 1
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+# Сколько раз процесс записывал через write; ожидающие журнал изменений ждут изменения счетчика
+_commits = {'count': 0}
+_commit_condition = threading.Condition()
+
+
+def commit_count():
+    """Счетчик записей процесса (значение seen для wait_for_commit)"""
+    return _commits['count']
+
+
+def wait_for_commit(seen, timeout):
+    """Ждать записи после значения seen из commit_count, но не дольше timeout секунд.
+
+    Возвращает True, если запись была.
+    """
+    with _commit_condition:
+        return _commit_condition.wait_for(lambda: _commits['count'] != seen, timeout)
+
+
+def notify_commit():
+    """Разбудить ожидающих журнал изменений: запись зафиксирована, кэш уже сброшен"""
+    with _commit_condition:
+        _commits['count'] += 1
+        _commit_condition.notify_all()
+
+
+def get_writer():
+    """Писатель текущего процесса (создается при первом обращении и заново после fork)"""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = GroupCommitWriter()
+        return _writer
+
+
+def write(func, *args, **kwargs):
+    """Выполнить метод записи DatabaseManager: через писателя, если включен group_commit_enabled.
+
+    Возвращает результат func; вызывающий поток ждет фиксации группы.
+    В самом потоке-писателе func выполняется сразу (он не может ждать себя).
+    """
+    if not config['group_commit_enabled']:
+        try:
+            return func(*args, **kwargs)
+        finally:
+            notify_commit()
+    writer = get_writer()
+    if threading.current_thread() is writer.thread:
+        return func(*args, **kwargs)
+    return writer.submit(func, *args, **kwargs).result()
+
+
+def writer_stats():
+    """Счетчики писателя текущего процесса (None, если он не запускался)"""
+    if _writer is None or _writer.pid != os.getpid():
+        return None
+    stats = dict(_writer.stats)
+    stats['queued'] = _writer.queue.qsize()
+    stats['avg_batch'] = round(stats['operations'] / stats['transactions'], 2) if stats['transactions'] else 0
+    return stats
+
+
+def stop_writer():
+    """Остановить писателя текущего процесса, дождавшись операций из очереди"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None and writer.pid == os.getpid():
+        writer.stop()
+
+
+atexit.register(stop_writer)